@@ -0,0 +1,113 @@
+"""Admission control for the search routes.
+
+At most SEARCH_MAX_IN_FLIGHT searches run at once per process and at most
+SEARCH_MAX_QUEUE wait for a slot, anything beyond that gets a fast 503 with
+Retry-After. The server needs more worker threads than the two together, the
+rest stay free for /book and /boarding_pass, which are never limited. Set
+SERVER_THREADS to the server's thread count and the app refuses to start
+without at least BOOK_RESERVED_THREADS of them left over.
+"""
+from typing import Callable
+from contextlib import contextmanager
+
+import functools
+import threading
+import time
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+SEARCH_MAX_IN_FLIGHT = 4
+SEARCH_MAX_QUEUE = 8
+SEARCH_QUEUE_TIMEOUT_SECS = 2.0
+SEARCH_RETRY_AFTER_SECS = 1
+BOOK_RESERVED_THREADS = 2
+
+
+class AdmissionLimiter:
+  def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float, retry_after: int):
+    self.max_in_flight = max_in_flight
+    self.max_queue = max_queue
+    self.queue_timeout = queue_timeout
+    self.retry_after = retry_after
+    self._condition = threading.Condition()
+    self.in_flight = 0
+    self.queued = 0
+    self.shed = 0
+
+  def acquire(self) -> bool:
+    """Waits for a slot, False if the queue is full or the wait timed out."""
+    with self._condition:
+      if self.in_flight < self.max_in_flight:
+        self.in_flight += 1
+        return True
+      if self.queued >= self.max_queue:
+        self.shed += 1
+        return False
+      self.queued += 1
+      deadline = time.monotonic() + self.queue_timeout
+      try:
+        while self.in_flight >= self.max_in_flight:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            self.shed += 1
+            return False
+          self._condition.wait(remaining)
+      finally:
+        self.queued -= 1
+      self.in_flight += 1
+      return True
+
+  def try_acquire(self) -> bool:
+    """Takes a slot only if one is free right now, never queues."""
+    with self._condition:
+      if self.in_flight < self.max_in_flight:
+        self.in_flight += 1
+        return True
+      return False
+
+  def release(self):
+    with self._condition:
+      self.in_flight -= 1
+      self._condition.notify()
+
+  def acquire_or_shed(self):
+    if not self.acquire():
+      raise ServiceUnavailable("Too many searches right now, please retry shortly.", retry_after=self.retry_after)
+
+  @contextmanager
+  def admitted(self):
+    self.acquire_or_shed()
+    try:
+      yield
+    finally:
+      self.release()
+
+
+def search_limiter() -> AdmissionLimiter:
+  return current_app.extensions["search_admission"]
+
+
+def limit_searches(view: Callable) -> Callable:
+  @functools.wraps(view)
+  def admitted_view(*args, **kwargs):
+    with search_limiter().admitted():
+      return view(*args, **kwargs)
+  return admitted_view
+
+
+def init_app(app):
+  app.config.setdefault("SEARCH_MAX_IN_FLIGHT", SEARCH_MAX_IN_FLIGHT)
+  app.config.setdefault("SEARCH_MAX_QUEUE", SEARCH_MAX_QUEUE)
+  app.config.setdefault("SEARCH_QUEUE_TIMEOUT_SECS", SEARCH_QUEUE_TIMEOUT_SECS)
+  app.config.setdefault("SEARCH_RETRY_AFTER_SECS", SEARCH_RETRY_AFTER_SECS)
+  app.config.setdefault("SERVER_THREADS", None)
+  app.config.setdefault("BOOK_RESERVED_THREADS", BOOK_RESERVED_THREADS)
+  search_threads = app.config["SEARCH_MAX_IN_FLIGHT"] + app.config["SEARCH_MAX_QUEUE"]
+  if app.config["SERVER_THREADS"] is not None and app.config["SERVER_THREADS"] - search_threads < app.config["BOOK_RESERVED_THREADS"]:
+    raise ValueError(
+        f"SERVER_THREADS={app.config['SERVER_THREADS']} leaves fewer than {app.config['BOOK_RESERVED_THREADS']} threads for bookings "
+        f"next to {search_threads} admitted and queued searches.")
+  app.extensions["search_admission"] = AdmissionLimiter(
+      app.config["SEARCH_MAX_IN_FLIGHT"], app.config["SEARCH_MAX_QUEUE"],
+      app.config["SEARCH_QUEUE_TIMEOUT_SECS"], app.config["SEARCH_RETRY_AFTER_SECS"])
@@ -0,0 +1,73 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left
+import unicodedata
+
+from .objects import Airport
+
+# Terms of lower rank are listed first, so typing a code beats a city that
+# happens to start with the same letters.
+CODE_RANK, CITY_RANK, COUNTRY_RANK, KEYWORD_RANK = range(4)
+
+
+def normalize(text: str) -> str:
+  text = unicodedata.normalize("NFKD", text)
+  return "".join(c for c in text if not unicodedata.combining(c)).strip().lower()
+
+
+def _terms(airport: Airport) -> Iterable[Tuple[str, int]]:
+  yield normalize(airport.airport_id), CODE_RANK
+  for value, rank in [(airport.city, CITY_RANK), (airport.country, COUNTRY_RANK)] + [(k, KEYWORD_RANK) for k in airport.keywords]:
+    value = normalize(value)
+    yield value, rank
+    # Also index every word so "york" finds "New York City".
+    for word in value.split()[1:]:
+      yield word, rank
+
+
+class AirportIndex:
+  """Sorted-array prefix index over airport codes, cities, countries and keywords."""
+
+  def __init__(self, airports: Iterable[Airport] = ()):
+    self.rebuild(airports)
+
+  def rebuild(self, airports: Iterable[Airport]):
+    by_id = {a.airport_id: a for a in airports}
+    entries = sorted({(term, rank, airport_id) for airport_id, a in by_id.items() for term, rank in _terms(a) if term})
+    # Swapped in with a single assignment so concurrent readers never see a
+    # half built index.
+    self._state = ([e[0] for e in entries], entries, by_id)
+
+  def __len__(self) -> int:
+    return len(self._state[2])
+
+  def complete(self, prefix: str, limit: int = 10) -> List[Airport]:
+    terms, entries, by_id = self._state
+    prefix = normalize(prefix)
+    if not prefix:
+      return []
+    lo = bisect_left(terms, prefix)
+    hi = bisect_left(terms, prefix + "\uffff", lo)
+    matches = sorted(entries[lo:hi], key=lambda e: (e[1], e[0] != prefix, e[0]))
+
+    airports: Dict[str, Airport] = {}
+    for _, _, airport_id in matches:
+      airports.setdefault(airport_id, by_id[airport_id])
+      if len(airports) == limit:
+        break
+    return list(airports.values())
+
+  def resolve(self, text: str) -> Optional[str]:
+    """Returns the airport id `text` stands for, if it names a single airport."""
+    terms, entries, by_id = self._state
+    text = normalize(text)
+    if text.upper() in by_id:
+      return text.upper()
+    candidates = self.complete(text, limit=2)
+    if len(candidates) == 1:
+      return candidates[0].airport_id
+    # Ambiguous prefix, prefer an airport where a whole term matches.
+    lo = bisect_left(terms, text)
+    exact = {e[2] for e in entries[lo:bisect_left(terms, text + "\0", lo)]}
+    if len(exact) == 1:
+      return exact.pop()
+    return None
@@ -0,0 +1,227 @@
+"""Daily occupancy, load factor and revenue per route, airline and class.
+
+Run offline with `python -m <package>.analytics [--csv report.csv]`. Bookings
+come from the booking event log: every run folds the events since its last
+checkpoint into per flight and class totals, so the report never reads the
+booked flags the booking path writes. Capacity and fares are streamed with
+projections from flights and seats into NumPy arrays and aggregated there, the
+Mongo server only serves plain finds.
+
+Run it more often than the capped log wraps. When events were dropped before
+being folded in, the totals are rebuilt from the booked seats. Departed flights
+moved by `archive` are read from the archive collections, so their days stay in
+the report.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from collections import defaultdict
+from datetime import datetime, timedelta
+import argparse
+import csv
+import time
+
+import numpy as np
+from pymongo import UpdateOne
+
+from .archive import ARCHIVE_PREFIX
+from .database import mongo
+from .events import read_booking_events
+
+REPORT_COLLECTION = "report_daily"
+# Booked seats and revenue per flight and class, folded from the event log.
+BOOKINGS_COLLECTION = "report_bookings"
+# Offset of the last folded event.
+STATE_COLLECTION = "report_state"
+BATCH_SIZE = 50000
+EVENTS_BATCH_SIZE = 10000
+# Collection name prefixes of live and archived flights and seats.
+REPORT_PREFIXES = ("", ARCHIVE_PREFIX)
+REPORT_FIELDS = ["day", "departure_airport_id", "arrival_airport_id", "airline_id", "travel_class",
+                 "seats", "booked", "load_factor", "revenue", "fare_sum"]
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def load_flights(db: Any, prefixes: Sequence[str] = ("",)):
+  flights, source = [], []
+  index: Dict[str, int] = {}
+  for p, prefix in enumerate(prefixes):
+    for f in db[f"{prefix}flights"].find({}, {
+        "_id": 0, "flight_id": 1, "airline_id": 1, "departure_airport_id": 1, "arrival_airport_id": 1, "date": 1,
+    }).batch_size(BATCH_SIZE):
+      # Archiving copies before it deletes, a flight in both is counted once.
+      if f["flight_id"] not in index:
+        index[f["flight_id"]] = len(flights)
+        flights.append(f)
+        source.append(p)
+  routes, route_idx = np.unique(
+      np.array([f"{f['departure_airport_id']}-{f['arrival_airport_id']}" for f in flights]), return_inverse=True)
+  columns = {
+      "day": np.array([(f["date"] - EPOCH).days for f in flights], dtype=np.int32),
+      "route": route_idx.astype(np.int32),
+      "airline_id": np.array([f["airline_id"] for f in flights], dtype=np.int32),
+      # Position in `prefixes` of the collection the flight was read from.
+      "source": np.array(source, dtype=np.int8),
+  }
+  return index, routes, columns
+
+
+def load_seats(db: Any, flight_index: Dict[str, int], price_field: str = "price", prefix: str = ""):
+  seats_collection = db[f"{prefix}seats"]
+  n = seats_collection.estimated_document_count()
+  flight = np.empty(n, dtype=np.int32)
+  travel_class = np.empty(n, dtype=np.int8)
+  price = np.empty(n, dtype=np.float64)
+  booked = np.empty(n, dtype=np.bool_)
+  i = 0
+  for s in seats_collection.find({}, {"_id": 0, "flight_id": 1, "travel_class": 1, price_field: 1, "booked": 1}).batch_size(BATCH_SIZE):
+    if i == n:  # Seats were added while streaming.
+      n = max(2 * n, 1)
+      flight, travel_class, price, booked = (np.resize(a, n) for a in (flight, travel_class, price, booked))
+    flight[i] = flight_index.get(s["flight_id"], -1)
+    travel_class[i], price[i], booked[i] = s["travel_class"], s[price_field], s["booked"]
+    i += 1
+  known = flight[:i] >= 0  # Skip seats of flights removed meanwhile.
+  return flight[:i][known], travel_class[:i][known], price[:i][known], booked[:i][known]
+
+
+def rebuild_booking_totals(db: Any) -> Optional[Any]:
+  """Recomputes the booking totals from the booked seats, returns the new checkpoint."""
+  # Events up to the newest one are reflected in the seats. Bookings made while
+  # the seats are scanned may also be folded in from the log afterwards.
+  newest = db.booking_events.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+  offset = newest["_id"] if newest is not None else None
+  staging = db[f"{BOOKINGS_COLLECTION}_staging"]
+  staging.drop()
+  totals: Dict[Tuple[str, int], Dict[str, Any]] = {}
+  for prefix in REPORT_PREFIXES:
+    for t in db[f"{prefix}seats"].aggregate([
+      { "$match": { "booked": True } },
+      { "$group": {
+          "_id": { "flight_id": "$flight_id", "travel_class": "$travel_class" },
+          "booked": { "$sum": 1 },
+          "revenue": { "$sum": "$price" },
+        }
+      },
+    ]):
+      totals.setdefault((t["_id"]["flight_id"], t["_id"]["travel_class"]), t)
+  if totals:
+    staging.insert_many(list(totals.values()))
+    staging.rename(BOOKINGS_COLLECTION, dropTarget=True)
+  else:
+    db[BOOKINGS_COLLECTION].drop()
+  db[STATE_COLLECTION].replace_one({"_id": "booking_events"}, {"_id": "booking_events", "offset": offset}, upsert=True)
+  return offset
+
+
+def fold_booking_events(db: Any) -> int:
+  """Adds the events since the last checkpoint to the booking totals, returns how many."""
+  state = db[STATE_COLLECTION].find_one({"_id": "booking_events"})
+  if state is None or (state["offset"] is not None and db.booking_events.find_one({"_id": state["offset"]}, {"_id": 1}) is None):
+    # First run, or the log wrapped past the checkpoint and dropped events.
+    offset = rebuild_booking_totals(db)
+  else:
+    offset = state["offset"]
+
+  folded = 0
+  while True:
+    events = read_booking_events(db, offset, EVENTS_BATCH_SIZE)
+    if not events:
+      return folded
+    totals: Dict[Tuple[str, int], List[float]] = defaultdict(lambda: [0, 0.0])
+    for e in events:
+      total = totals[(e["flight_id"], e["travel_class"])]
+      total[0] += 1
+      total[1] += e["price"]
+    db[BOOKINGS_COLLECTION].bulk_write([UpdateOne(
+        {"_id": {"flight_id": flight_id, "travel_class": travel_class}},
+        {"$inc": {"booked": booked, "revenue": revenue}}, upsert=True)
+      for (flight_id, travel_class), (booked, revenue) in totals.items()], ordered=False)
+    # A crash before this line folds the batch in twice, the next rebuild
+    # corrects it.
+    offset = events[-1]["_id"]
+    db[STATE_COLLECTION].update_one({"_id": "booking_events"}, {"$set": {"offset": offset}})
+    folded += len(events)
+
+
+def daily_report(db: Any) -> List[Dict[str, Any]]:
+  fold_booking_events(db)
+  flight_index, routes, flights = load_flights(db, REPORT_PREFIXES)
+  if not flight_index:
+    return []
+  flight, travel_class, price, _ = (np.concatenate(a) for a in zip(*[
+      load_seats(db, {flight_id: i for flight_id, i in flight_index.items() if flights["source"][i] == p}, prefix=prefix)
+      for p, prefix in enumerate(REPORT_PREFIXES)]))
+
+  keys = np.stack([flights["day"][flight], flights["route"][flight], flights["airline_id"][flight], travel_class.astype(np.int32)], axis=1)
+  groups, group_idx = np.unique(keys, axis=0, return_inverse=True)
+  group_idx = group_idx.reshape(-1)
+  seats = np.bincount(group_idx, minlength=len(groups))
+  fare_sum = np.bincount(group_idx, weights=price, minlength=len(groups))
+
+  # Revenue is what the booked seats sold for, later repricing doesn't change it.
+  booked_seats = np.zeros(len(groups))
+  revenue = np.zeros(len(groups))
+  group_of = {tuple(g): i for i, g in enumerate(groups.tolist())}
+  for t in db[BOOKINGS_COLLECTION].find({}).batch_size(BATCH_SIZE):
+    f = flight_index.get(t["_id"]["flight_id"])
+    if f is None:
+      continue  # Flight removed meanwhile.
+    i = group_of.get((flights["day"][f], flights["route"][f], flights["airline_id"][f], t["_id"]["travel_class"]))
+    if i is not None:
+      booked_seats[i] += t["booked"]
+      revenue[i] += t["revenue"]
+
+  report = []
+  for (day, route, airline_id, cls), n, b, r, f in zip(groups.tolist(), seats.tolist(), booked_seats.tolist(), revenue.tolist(), fare_sum.tolist()):
+    departure, arrival = routes[route].split("-")
+    report.append({
+        "day": EPOCH + timedelta(days=day),
+        "departure_airport_id": departure,
+        "arrival_airport_id": arrival,
+        "airline_id": airline_id,
+        "travel_class": cls,
+        "seats": n,
+        "booked": int(b),
+        "load_factor": b / n,
+        "revenue": round(r, 2),
+        "fare_sum": round(f, 2),
+    })
+  return report
+
+
+def write_report(db: Any, report: List[Dict[str, Any]]):
+  # Built aside and renamed over the old report so dashboards never see a
+  # partial one.
+  staging = db[f"{REPORT_COLLECTION}_staging"]
+  staging.drop()
+  if report:
+    staging.insert_many(report)
+    staging.rename(REPORT_COLLECTION, dropTarget=True)
+  else:
+    db[REPORT_COLLECTION].drop()
+
+
+def write_csv(path: str, report: List[Dict[str, Any]]):
+  with open(path, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for row in report:
+      writer.writerow(dict(row, day=row["day"].strftime("%Y-%m-%d")))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--csv", help="Also write the report to this CSV file.")
+  args = parser.parse_args()
+
+  start = time.time()
+  report = daily_report(mongo.db)
+  print(f"Computed {len(report)} report rows in {time.time() - start:.2f}s.")
+  write_report(mongo.db, report)
+  if args.csv:
+    write_csv(args.csv, report)
+  print(f"Finished in {time.time() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,297 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import datetime
+import json
+import os
+import threading
+
+from bson import ObjectId
+from flask import Blueprint, Response, current_app, request, stream_with_context, url_for
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import ServiceUnavailable
+
+try:
+  import orjson
+except ImportError:  # Falls back to the standard library encoder.
+  orjson = None
+
+from .admission import AdmissionLimiter, limit_searches, search_limiter
+from .events import read_booking_events
+from .facets import SearchFilters
+from .fares import TOP_K
+from .main import get_repository, mongo_database, resolve_airport, searches, shared_search_seats
+from .objects import Person, Seat, identity_scope
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+SEARCH_WINDOW = datetime.timedelta(hours=48)
+MAX_BATCH_QUERIES = 1000
+# Upper bound of the `limit` of /search_best, past TOP_K it runs the full query.
+MAX_BEST_LIMIT = 200
+# Overlapping windows of a batch are merged into one aggregation up to this
+# length, so a chain of them doesn't turn into one huge scan.
+MAX_MERGED_WINDOW = 2 * SEARCH_WINDOW
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+
+def executor() -> ThreadPoolExecutor:
+  # One bounded pool per process, shared by all batch requests.
+  global _executor, _executor_pid
+  with _executor_lock:
+    if _executor is None or _executor_pid != os.getpid():
+      _executor = ThreadPoolExecutor(max_workers=current_app.config.get("BATCH_SEARCH_WORKERS", 8), thread_name_prefix="batch-search")
+      _executor_pid = os.getpid()
+    return _executor
+
+
+def _default(o: Any):
+  if isinstance(o, (datetime.datetime, datetime.date)):
+    return o.isoformat()
+  raise TypeError(f"Cannot serialize {type(o).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+  if orjson is not None:
+    return orjson.dumps(obj)
+  return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+  return Response(dumps(obj), status=status, mimetype="application/json")
+
+
+def params() -> MultiDict:
+  # JSON bodies and form/query parameters are accepted alike.
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict):
+    return request.values
+  return MultiDict([(k, v) for k, vs in body.items() for v in (vs if isinstance(vs, list) else [vs])])
+
+
+def seat_to_dict(seat: Seat) -> Dict[str, Any]:
+  flight = seat.flight
+  return {
+      "flight_id": flight.flight_id,
+      "airline_id": flight.airline_id,
+      "airline": flight.airline.name,
+      "departure_airport_id": flight.departure_airport_id,
+      "arrival_airport_id": flight.arrival_airport_id,
+      "departure": flight.date,
+      "arrival": flight.date + datetime.timedelta(minutes=flight.duration_mins),
+      "duration_mins": flight.duration_mins,
+      "plane": flight.plane,
+      "travel_class": seat.travel_class,
+      "price": seat.price,
+  }
+
+
+def field_list(fields: Any) -> List[str]:
+  """Field names out of a list, a comma-separated string or a list of those."""
+  if not fields:
+    return []
+  if isinstance(fields, str):
+    fields = [fields]
+  return [f for value in fields for f in value.split(",") if f]
+
+
+def select_fields(rows: Iterable[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+  if not fields:
+    return list(rows)
+  return [{k: row[k] for k in fields if k in row} for row in rows]
+
+
+def window(values: MultiDict):
+  start = datetime.datetime.strptime(f"{values['dep_date']} {values.get('dep_time', '00:00')}", "%Y-%m-%d %H:%M")
+  return start, start + SEARCH_WINDOW
+
+
+@api.errorhandler(ServiceUnavailable)
+def service_unavailable(e: ServiceUnavailable):
+  response = json_response({"error": e.description}, 503)
+  if e.retry_after is not None:
+    response.headers["Retry-After"] = str(e.retry_after)
+  return response
+
+
+@api.route("/search", methods=["GET", "POST"])
+@limit_searches
+def search():
+  values = params()
+  start, end = window(values)
+  filters = SearchFilters.from_values(values)
+  seats, _ = shared_search_seats(
+      (resolve_airport(values["from"]), resolve_airport(values["to"]), start, end, int(values.get("travel_class", 2)), filters.key()),
+      filters)
+  return json_response({"results": select_fields(map(seat_to_dict, seats), field_list(values.getlist("fields")))})
+
+
+@api.route("/search_best", methods=["GET", "POST"])
+@limit_searches
+def search_best():
+  # The `limit` (TOP_K by default) cheapest departures in the window.
+  values = params()
+  start, end = window(values)
+  key = (resolve_airport(values["from"]), int(values.get("travel_class", 2)), start, end, min(int(values.get("limit", TOP_K)), MAX_BEST_LIMIT))
+  repository = get_repository()
+  seats = searches.do(("best",) + key, lambda: repository.cheapest_departures(*key))
+  return json_response({"results": select_fields(map(seat_to_dict, seats), field_list(values.getlist("fields")))})
+
+
+@api.route("/book", methods=["POST"])
+def book():
+  values = params()
+  repository = get_repository()
+  travel_class = int(values.get("travel_class", 2))
+  if "person_id" in values:
+    person_id = int(values["person_id"])
+    if repository.person(person_id) is None:
+      return json_response({"error": f"Unknown person {person_id}."}, 404)
+  else:
+    person = Person(repository.next_person_id(), values["name"], datetime.datetime.strptime(values["birthdate"], "%Y-%m-%d"), values["passport"], travel_class)
+    repository.insert_person(person)
+    person_id = person.person_id
+
+  seat = repository.book_seat(values["flight_id"], travel_class, person_id)
+  if seat is None:
+    return json_response({"error": "Sold out."}, 409)
+  booking = dict(seat_to_dict(seat), seat_id=seat.seat_id, seat=seat.number, person_id=person_id,
+                 boarding_pass=url_for("flights.boarding_pass", seat_id=seat.seat_id, person_id=person_id, _external=True))
+  return json_response(select_fields([booking], field_list(values.getlist("fields")))[0], 201)
+
+
+@api.route("/events")
+def events():
+  # Consumers poll with the `next` offset of their previous call. Events name
+  # the seat and person of every booking, so like the other admin endpoints
+  # this is only served when ADMIN_ENDPOINTS is set.
+  db = mongo_database()
+  if not current_app.config["ADMIN_ENDPOINTS"] or db is None:
+    return json_response({"error": "Not found."}, 404)
+  after = request.args.get("after")
+  if after is not None and not ObjectId.is_valid(after):
+    return json_response({"error": f"Invalid offset {after}."}, 400)
+  limit = min(int(request.args.get("limit", 1000)), 10000)
+  events = read_booking_events(db, ObjectId(after) if after else None, limit)
+  for e in events:
+    e["offset"] = str(e.pop("_id"))
+  return json_response({"events": events, "next": events[-1]["offset"] if events else after})
+
+
+@api.route("/admin/slow_queries", methods=["GET", "DELETE"])
+def slow_queries():
+  log = current_app.extensions.get("slow_query_log")
+  if not current_app.config["ADMIN_ENDPOINTS"] or log is None:
+    return json_response({"error": "Not found."}, 404)
+  if request.method == "DELETE":
+    log.clear()
+  return json_response({"threshold_ms": log.threshold_ms, "queries": log.entries()})
+
+
+def merge_windows(windows: List[Tuple[datetime.datetime, datetime.datetime, int]]) -> List[Tuple[datetime.datetime, datetime.datetime, List[int]]]:
+  """Merges overlapping (start, end, query index) windows of one route, up to MAX_MERGED_WINDOW."""
+  merged = []
+  for start, end, i in sorted(windows):
+    if merged and start <= merged[-1][1] and max(end, merged[-1][1]) - merged[-1][0] <= MAX_MERGED_WINDOW:
+      merged[-1] = (merged[-1][0], max(end, merged[-1][1]), merged[-1][2] + [i])
+    else:
+      merged.append((start, end, [i]))
+  return merged
+
+
+def scoped_search_seats(repository, *args):
+  # Pool threads don't run in the request's identity scope, give each search
+  # its own.
+  with identity_scope():
+    return repository.search_seats(*args)
+
+
+def admitted_search_seats(limiter: AdmissionLimiter, *args):
+  # Runs on a search slot taken by the submitting request.
+  try:
+    return scoped_search_seats(*args)
+  finally:
+    limiter.release()
+
+
+@api.route("/search/batch", methods=["POST"])
+def search_batch():
+  # Every aggregation of the batch runs on its own search slot. The one taken
+  # here goes to the first aggregation, or back when the stream is closed
+  # before it started.
+  body = request.get_json(force=True)
+  if len(body["queries"]) > MAX_BATCH_QUERIES:
+    return json_response({"error": f"At most {MAX_BATCH_QUERIES} queries per batch."}, 413)
+  limiter = search_limiter()
+  limiter.acquire_or_shed()
+  slot = {"held": True}
+
+  def release_unused():
+    if slot.pop("held", False):
+      limiter.release()
+
+  try:
+    response = _search_batch(body, limiter, slot)
+  except BaseException:
+    release_unused()
+    raise
+  response.call_on_close(release_unused)
+  return response
+
+
+def _search_batch(body: Dict[str, Any], limiter: AdmissionLimiter, slot: Dict[str, bool]) -> Response:
+  queries = body["queries"]
+  fields = field_list(body.get("fields"))
+
+  routes = defaultdict(list)
+  windows = []
+  for i, q in enumerate(queries):
+    start, end = window(q)
+    windows.append((start, end))
+    routes[(resolve_airport(q["from"]), resolve_airport(q["to"]), int(q.get("travel_class", 2)))].append((start, end, i))
+
+  # Identical and overlapping queries of a route share one aggregation.
+  jobs = deque()
+  for (src, dst, travel_class), route_windows in routes.items():
+    for start, end, indices in merge_windows(route_windows):
+      jobs.append(((src, dst, start, end, travel_class, SearchFilters()), indices))
+  repository = get_repository()
+
+  def lines(indices: List[int], seats: Optional[List[Dict[str, Any]]] = None, error: Optional[str] = None):
+    for i in indices:
+      if error is not None:
+        yield dumps({"query": i, "error": error}) + b"\n"
+      else:
+        start, end = windows[i]
+        rows = [s for s in seats if start <= s["departure"] <= end]
+        yield dumps({"query": i, "results": select_fields(rows, fields)}) + b"\n"
+
+  def results():
+    # One JSON line per query, streamed as soon as its aggregation is done.
+    # More aggregations run at once only while search slots are free.
+    running = {}
+    while jobs or running:
+      while jobs and (slot.pop("held", False) or limiter.try_acquire() or (not running and limiter.acquire())):
+        args, indices = jobs.popleft()
+        running[executor().submit(admitted_search_seats, limiter, repository, *args)] = indices
+      if not running:
+        # No slot freed up within the queue timeout.
+        for _, indices in jobs:
+          yield from lines(indices, error="Too many searches right now, please retry shortly.")
+        return
+      done, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        indices = running.pop(future)
+        try:
+          seats = [seat_to_dict(s) for s in future.result()[0]]
+        except Exception:
+          current_app.logger.exception("Batch search for queries %s failed", indices)
+          yield from lines(indices, error="Search failed.")
+          continue
+        yield from lines(indices, seats)
+
+  return Response(stream_with_context(results()), mimetype="application/x-ndjson")
@@ -0,0 +1,90 @@
+"""Moves departed flights with their seats and bookings to archive collections.
+
+Run with `python -m <package>.archive [--before YYYY-MM-DD]`. Searches only
+target future dates, so this keeps the hot collections and their indexes sized
+to the bookable horizon. Boarding passes and trips fall back to the archive,
+see `itineraries.find_booking` and `itineraries.find_trips`.
+"""
+from typing import Any
+from datetime import datetime, timedelta
+import argparse
+import time
+
+import pymongo
+from pymongo import ReplaceOne
+from pymongo.errors import CollectionInvalid
+
+from .database import mongo
+from .fares import day_of
+
+ARCHIVE_PREFIX = "archive_"
+BATCH_SIZE = 500
+# zstd compresses the rarely read archive much better than the default snappy.
+ARCHIVE_STORAGE = {"wiredTiger": {"configString": "block_compressor=zstd"}}
+ARCHIVE_KEYS = {
+    "flights": [("flight_id", pymongo.ASCENDING)],
+    "seats": [("seat_id", pymongo.ASCENDING)],
+    "bookings": [("seat_id", pymongo.ASCENDING), ("person_id", pymongo.ASCENDING)],
+}
+
+
+def ensure_archive(db: Any):
+  for name, key in ARCHIVE_KEYS.items():
+    try:
+      db.create_collection(f"{ARCHIVE_PREFIX}{name}", storageEngine=ARCHIVE_STORAGE)
+    except CollectionInvalid:
+      pass  # Already exists.
+    db[f"{ARCHIVE_PREFIX}{name}"].create_index(key, unique=True)
+  # Trips page through the bookings of a passenger.
+  db[f"{ARCHIVE_PREFIX}bookings"].create_index([("person_id", pymongo.ASCENDING)])
+
+
+def _copy(db: Any, name: str, docs):
+  # Upserts keep a rerun after an interrupted batch idempotent.
+  requests = [ReplaceOne({k: d[k] for k, _ in ARCHIVE_KEYS[name]}, d, upsert=True) for d in docs]
+  if requests:
+    db[f"{ARCHIVE_PREFIX}{name}"].bulk_write(requests, ordered=False)
+
+
+def archive_departed(db: Any, before: datetime) -> int:
+  ensure_archive(db)
+  archived = 0
+  while True:
+    flights = list(db.flights.find({"date": {"$lt": before}}, {"_id": 0}).limit(BATCH_SIZE))
+    if not flights:
+      break
+    flight_ids = [f["flight_id"] for f in flights]
+    seats = list(db.seats.find({"flight_id": {"$in": flight_ids}}, {"_id": 0}))
+    seat_ids = [s["seat_id"] for s in seats]
+    bookings = list(db.bookings.find({"seat_id": {"$in": seat_ids}}, {"_id": 0}))
+
+    # Everything is copied before anything is deleted, the flight goes last
+    # so an interrupted batch is picked up again by the next run.
+    _copy(db, "flights", flights)
+    _copy(db, "seats", seats)
+    _copy(db, "bookings", bookings)
+    db.bookings.delete_many({"seat_id": {"$in": seat_ids}})
+    db.seats.delete_many({"flight_id": {"$in": flight_ids}})
+    db.flights.delete_many({"flight_id": {"$in": flight_ids}})
+    archived += len(flights)
+    print(f"Archived {archived} flights.")
+
+  # Buckets of the day of `before` only hold fares in the past, which searches
+  # already skip.
+  db.cheapest_fares.delete_many({"day": {"$lt": day_of(before)}})
+  return archived
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--before", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), default=datetime.utcnow() - timedelta(days=1),
+                      help="Archive flights departed before this date (YYYY-MM-DD), defaults to yesterday.")
+  args = parser.parse_args()
+
+  start = time.time()
+  archived = archive_departed(mongo.db, args.before)
+  print(f"Archived {archived} flights in {time.time() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,52 @@
+from typing import Any, Dict, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from .events import append_booking_event
+from .fares import on_seat_booked
+from .objects import Booking, Seat
+
+
+def claim_seat(db: Any, flight_id: str, travel_class: int) -> Optional[Dict[str, Any]]:
+  """Books a random free seat of the cheapest price in the class, None if sold out."""
+  free = {"flight_id": flight_id, "travel_class": travel_class, "booked": False}
+  while True:
+    cheapest = db.seats.find_one(free, {"_id": 0, "price": 1}, sort=[("price", ASCENDING)])
+    if cheapest is None:
+      return None  # Class is sold out.
+    # Sample among the cheapest seats so concurrent bookings on the same
+    # flight spread out instead of all racing for the first free seat.
+    candidates = list(db.seats.aggregate([
+      { "$match": dict(free, price=cheapest["price"]) },
+      { "$sample": { "size": 1 } },
+      { "$project": { "_id": 0, "seat_id": 1 } },
+    ]))
+    if candidates:
+      seat = db.seats.find_one_and_update(
+        {"seat_id": candidates[0]["seat_id"], "booked": False},
+        { "$set": {"booked": True}},
+        return_document=ReturnDocument.AFTER)
+      if seat is not None:
+        return seat
+
+    # Someone else got the sampled seat, take any other one at the same price.
+    seat = db.seats.find_one_and_update(
+      dict(free, price=cheapest["price"]),
+      { "$set": {"booked": True}},
+      return_document=ReturnDocument.AFTER)
+    if seat is not None:
+      return seat
+    # That price sold out meanwhile, retry at the next cheapest.
+
+
+def book_seat(db: Any, flight_id: str, travel_class: int, person_id: int) -> Optional[Seat]:
+  """Books the cheapest free seat of `travel_class` on the flight, None if sold out."""
+  seat_dict = claim_seat(db, flight_id, travel_class)
+  if seat_dict is None:
+    return None
+  seat = Seat.from_dict(seat_dict).load(db)
+  booking = Booking(seat_id=seat.seat_id, person_id=person_id)
+  db.bookings.insert_one(booking.to_dict())
+  append_booking_event(db, seat_dict, person_id)
+  on_seat_booked(db, seat_dict, seat.flight)
+  return seat
@@ -0,0 +1,93 @@
+from typing import Any, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+  """Thread-safe mapping holding at most `maxsize` of the most recently used entries."""
+
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self._lock = threading.Lock()
+    self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+  def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+    with self._lock:
+      if key not in self._entries:
+        return default
+      self._entries.move_to_end(key)
+      return self._entries[key]
+
+  def put(self, key: Hashable, value: Any):
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+
+class _Call:
+  def __init__(self):
+    self.done = threading.Event()
+    self.result: Any = None
+    self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+  """Runs concurrent calls with the same key once and shares the result.
+
+  Results are also kept for `ttl` seconds after the call finished, failures
+  are never kept.
+  """
+
+  def __init__(self, ttl: float, maxsize: int):
+    self.ttl = ttl
+    self._lock = threading.Lock()
+    self._calls: Dict[Hashable, _Call] = {}
+    self._results = LRUCache(maxsize)
+
+  def _cached(self, key: Hashable) -> Optional[tuple]:
+    cached = self._results.get(key)
+    return cached if cached is not None and cached[0] > time.monotonic() else None
+
+  def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+    cached = self._cached(key)
+    if cached is not None:
+      return cached[1]
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        # A call may have finished since the check above.
+        cached = self._cached(key)
+        if cached is not None:
+          return cached[1]
+        call = self._calls[key] = _Call()
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result
+
+    try:
+      call.result = fn()
+      self._results.put(key, (time.monotonic() + self.ttl, call.result))
+    except BaseException as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+    return call.result
+
+  def clear(self):
+    self._results.clear()
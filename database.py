@@ -0,0 +1,96 @@
+from typing import Any, Callable, Mapping, Optional
+
+import os
+import threading
+
+import pymongo
+from pymongo import ReturnDocument
+
+DEFAULT_CONFIG = {
+    "MONGO_URI": os.environ.get("MONGO_URI", "mongodb://localhost:27017/myDatabase"),
+    "MONGO_MAX_POOL_SIZE": int(os.environ.get("MONGO_MAX_POOL_SIZE", 100)),
+    "MONGO_MIN_POOL_SIZE": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+}
+
+
+class LazyMongo:
+  """Mongo client created on first use in each process.
+
+  Nothing connects at import or while the app is being built, and a process
+  forked after that (e.g. gunicorn --preload workers) opens its own client
+  instead of reusing the sockets of its parent.
+  """
+
+  def __init__(self, config: Optional[Mapping[str, Any]] = None):
+    self._lock = threading.Lock()
+    self._client = None
+    self._pid = None
+    # Set by profiling.init_app, reads then go through a ProfiledDatabase.
+    self.slow_query_log = None
+    self.configure(config or {})
+
+  def init_app(self, app):
+    for key, value in DEFAULT_CONFIG.items():
+      app.config.setdefault(key, value)
+    self.configure(app.config)
+    app.extensions["mongo"] = self
+
+  def configure(self, config: Mapping[str, Any]):
+    with self._lock:
+      self._settings = {key: config.get(key, value) for key, value in DEFAULT_CONFIG.items()}
+      self._client = None
+
+  @property
+  def client(self) -> pymongo.MongoClient:
+    pid = os.getpid()
+    if self._client is None or self._pid != pid:
+      with self._lock:
+        if self._client is None or self._pid != pid:
+          self._client = pymongo.MongoClient(
+              self._settings["MONGO_URI"],
+              maxPoolSize=self._settings["MONGO_MAX_POOL_SIZE"],
+              minPoolSize=self._settings["MONGO_MIN_POOL_SIZE"],
+              connect=False)
+          self._pid = pid
+    return self._client
+
+  @property
+  def db(self):
+    db = self.client.get_default_database()
+    if self.slow_query_log is not None:
+      from .profiling import ProfiledDatabase
+      return ProfiledDatabase(db, self.slow_query_log)
+    return db
+
+
+mongo = LazyMongo()
+
+
+def next_sequence(db: Any, name: str, seed: Callable[[], int], n: int = 1) -> int:
+  """Atomically hands out the next `n` values of a counter shared by all processes.
+
+  Returns the first of them. `seed` returns the first value to hand out, it
+  is only used when the counter doesn't exist yet.
+  """
+  counter = db.counters.find_one_and_update(
+      {"_id": name}, {"$inc": {"value": n}}, return_document=ReturnDocument.BEFORE)
+  if counter is not None:
+    return counter["value"]
+  # $max keeps the seed idempotent if several processes race to create it.
+  db.counters.update_one({"_id": name}, {"$max": {"value": seed()}}, upsert=True)
+  return next_sequence(db, name, seed, n)
+
+
+def _after_max(collection: Any, field: str) -> Callable[[], int]:
+  def seed():
+    last = collection.find_one({}, {field: 1}, sort=[(field, pymongo.DESCENDING)])
+    return 0 if last is None else last[field] + 1
+  return seed
+
+
+def next_person_id(db: Any, n: int = 1) -> int:
+  return next_sequence(db, "person_id", _after_max(db.persons, "person_id"), n)
+
+
+def next_seat_id(db: Any, n: int = 1) -> int:
+  return next_sequence(db, "seat_id", _after_max(db.seats, "seat_id"), n)
@@ -1,18 +1,19 @@
 from datetime import datetime, timedelta
 from collections import defaultdict
+import argparse
 import random
 
 import pymongo
-from flask import Flask
-from flask_pymongo import PyMongo
+from pymongo import UpdateOne
 
+from .archive import ARCHIVE_PREFIX
+from .database import mongo, next_person_id, next_seat_id
+from .events import booking_event, ensure_booking_events
+from .fares import day_of, rebuild_cheapest_fares, refresh_cheapest_fares
+from .logos import seed_logos
 from .names import first_names, last_names
 from .objects import Airline, Airport, Flight, Seat, Booking, Person
 
-app = Flask(__name__)
-app.config["MONGO_URI"] = "mongodb://localhost:27017/myDatabase"
-mongo = PyMongo(app)
-
 
 def random_date(start=datetime(1930, 1, 1), end=datetime(2020, 1, 1)):
   """Generate a random datetime between `start` and `end`"""
@@ -34,7 +35,7 @@ def populate_bookings(db):
             db["bookings"].append(Booking(seat_id=seat.seat_id, person_id=person.person_id))
     return person_id
 
-def generate_dataset():
+def generate_dataset(dates=None):
     airplanes = list({
         "Airbus A220": {"rows": 36, "cols": 6},
         "Boeing 777": {"rows": 39, "cols": 8},
@@ -48,12 +49,12 @@ def generate_dataset():
     }
 
     airports = {
-        "ZRH": {"obj": Airport("ZRH", "Zurich", "Switzerland", []), "price_modifier": 1.5, "airlines": ["Swiss", "Austrian", "Delta"]},
-        "VIE": {"obj": Airport("VIE", "Vienna", "Austria", []), "price_modifier": 1.1, "airlines": ["Austrian", "KLM"]},
-        "SYD": {"obj": Airport("SYD", "Syndey", "Australia", []), "price_modifier": 1.3, "airlines": ["Swiss", "Delta"]},
-        "LHR": {"obj": Airport("LHR", "London", "England", []), "price_modifier": 1.2, "airlines": ["Austrian", "Swiss", "KLM"]},
-        "OTP": {"obj": Airport("OTP", "Bucharest", "Romania", []), "price_modifier": 0.8, "airlines": ["Swiss"]},
-        "JFK": {"obj": Airport("JFK", "New York City", "United States of America", []), "price_modifier": 1.4, "airlines": ["Swiss", "KLM", "Delta"]},
+        "ZRH": {"obj": Airport("ZRH", "Zurich", "Switzerland", ["Kloten"]), "price_modifier": 1.5, "airlines": ["Swiss", "Austrian", "Delta"]},
+        "VIE": {"obj": Airport("VIE", "Vienna", "Austria", ["Schwechat", "Wien"]), "price_modifier": 1.1, "airlines": ["Austrian", "KLM"]},
+        "SYD": {"obj": Airport("SYD", "Syndey", "Australia", ["Sydney", "Kingsford Smith"]), "price_modifier": 1.3, "airlines": ["Swiss", "Delta"]},
+        "LHR": {"obj": Airport("LHR", "London", "England", ["Heathrow"]), "price_modifier": 1.2, "airlines": ["Austrian", "Swiss", "KLM"]},
+        "OTP": {"obj": Airport("OTP", "Bucharest", "Romania", ["Otopeni", "Henri Coanda"]), "price_modifier": 0.8, "airlines": ["Swiss"]},
+        "JFK": {"obj": Airport("JFK", "New York City", "United States of America", ["Kennedy", "John F. Kennedy"]), "price_modifier": 1.4, "airlines": ["Swiss", "KLM", "Delta"]},
     }
 
     distance_matrix = {
@@ -70,11 +71,9 @@ def generate_dataset():
         2: {"rows": set(range(9, 100000)), "price_modifier": 0.9},
     }
     price_per_hour = 50.0
-
-    years = [2020]
-    months = [1]
-    days = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10:31, 11: 30, 12: 31}
     seat_id = 0
+    if dates is None:
+        dates = [datetime(2020, 1, day) for day in range(1, 32)]
 
     db = {
         "airlines": [a[0] for a in airlines.values()],
@@ -87,35 +86,37 @@ def generate_dataset():
     for src, src_obj in airports.items():
         for i, (dst, dst_obj) in enumerate(airports.items()):
             for airline in src_obj["airlines"]:
+                # Seeded per route and per day, so every run generates the same
+                # schedule and a top-up only adds what is new.
+                route_rng = random.Random(f"{src}_{dst}_{airline}")
                 airline_obj, airline_modifier = airlines[airline]
-                duration = distance_matrix[src][i] * (1+((random.random()/2)**4))
+                duration = distance_matrix[src][i] * (1+((route_rng.random()/2)**4))
                 duration_mins = int(duration * 60)
                 if src == dst or airline not in dst_obj["airlines"]:
                     continue
-                if random.random() < 0.25:
+                if route_rng.random() < 0.25:
                     continue
                 price = duration * price_per_hour * src_obj["price_modifier"] * dst_obj["price_modifier"] * airline_modifier
                 print(f"{src}->{dst} ({airline}, {duration_mins / 60:.2f} hrs, 1st price {int(price * prices[1]['price_modifier'])} EUR, 2nd price {int(price * prices[2]['price_modifier'])} EUR)")
 
-                for year in years:
-                    for month in months:
-                        for day in range(1, days[month]+1):
-                            hour = random.randint(7, 21)
-                            minute = random.randint(0, 59)
-                            date_str = "-".join(str(x) for x in [year, month, day, hour, minute])
-                            date = datetime.strptime(date_str, "%Y-%m-%d-%H-%M")
-
-                            plane, seat_cnt = random.choice(airplanes)
-                            f = Flight(f"{src}_{dst}_{airline}_{date_str}", airline_obj.airline_id, src_obj["obj"].airport_id, dst_obj["obj"].airport_id, plane, date, duration_mins)
-                            db["flights"].append(f)
-
-                            for row in range(1, seat_cnt["rows"]+1):
-                                travel_class, price_modifier = [p for p in prices.items() if row in p[1]["rows"]][0]
-                                price_modifier = price_modifier["price_modifier"]
-                                for col in range(seat_cnt["cols"]):
-                                    seat = f"{row}{chr(ord('A') + col)}"
-                                    db["seats"][f.flight_id][seat_id] = Seat(seat_id, f.flight_id, seat, travel_class, price * price_modifier, booked=False)
-                                    seat_id += 1
+                for day in dates:
+                    rng = random.Random(f"{src}_{dst}_{airline}_{day:%Y-%m-%d}")
+                    hour = rng.randint(7, 21)
+                    minute = rng.randint(0, 59)
+                    date_str = "-".join(str(x) for x in [day.year, day.month, day.day, hour, minute])
+                    date = datetime.strptime(date_str, "%Y-%m-%d-%H-%M")
+
+                    plane, seat_cnt = rng.choice(airplanes)
+                    f = Flight(f"{src}_{dst}_{airline}_{date_str}", airline_obj.airline_id, src_obj["obj"].airport_id, dst_obj["obj"].airport_id, plane, date, duration_mins)
+                    db["flights"].append(f)
+
+                    for row in range(1, seat_cnt["rows"]+1):
+                        travel_class, price_modifier = [p for p in prices.items() if row in p[1]["rows"]][0]
+                        price_modifier = price_modifier["price_modifier"]
+                        for col in range(seat_cnt["cols"]):
+                            seat = f"{row}{chr(ord('A') + col)}"
+                            db["seats"][f.flight_id][seat_id] = Seat(seat_id, f.flight_id, seat, travel_class, price * price_modifier, booked=False)
+                            seat_id += 1
     return db
 
 
@@ -125,6 +126,34 @@ def check_insert_many(collection, inserted_vals):
     raise ValueError(f"Tried to insert: {len(inserted_vals)}, inserted: {len(result.inserted_ids)}")
 
 
+def drop_collections(db):
+  db.airports.drop()
+  db.airlines.drop()
+  db.flights.drop()
+  db.seats.drop()
+  db.bookings.drop()
+  db.persons.drop()
+  db.counters.drop()
+  db.cheapest_fares.drop()
+  db.booking_events.drop()
+  db.report_bookings.drop()
+  db.report_state.drop()
+
+
+def create_indexes(db):
+  ensure_booking_events(db)
+  db.airports.create_index([("airport_id", pymongo.ASCENDING)], unique=True)
+  db.airlines.create_index([("airline_id", pymongo.ASCENDING)], unique=True)
+  db.flights.create_index([("flight_id", pymongo.ASCENDING)], unique=True)
+  db.flights.create_index([("departure_airport_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)])
+  db.seats.create_index([("seat_id", pymongo.ASCENDING)], unique=True)
+  db.seats.create_index([("flight_id", pymongo.ASCENDING), ("travel_class", pymongo.ASCENDING), ("booked", pymongo.ASCENDING)])
+  db.bookings.create_index([("seat_id", pymongo.ASCENDING), ("person_id", pymongo.ASCENDING)], unique=True)
+  db.bookings.create_index([("person_id", pymongo.ASCENDING), ("_id", pymongo.DESCENDING)])
+  db.persons.create_index([("person_id", pymongo.ASCENDING)], unique=True)
+  db.persons.create_index([("passport", pymongo.ASCENDING)])
+
+
 def populate_db():
   def print_db(db):
     for s in ["airports", "airlines", "flights", "seats", "bookings", "persons"]:
@@ -141,19 +170,8 @@ def populate_db():
   print("\nAdding to database:")
   print_db(db_dict)
 
-  mongo.db.airports.drop()
-  mongo.db.airlines.drop()
-  mongo.db.flights.drop()
-  mongo.db.seats.drop()
-  mongo.db.bookings.drop()
-  mongo.db.persons.drop()
-
-  mongo.db.airports.create_index([("airport_id", pymongo.ASCENDING)], unique=True)
-  mongo.db.airlines.create_index([("airline_id", pymongo.ASCENDING)], unique=True)
-  mongo.db.flights.create_index([("flight_id", pymongo.ASCENDING)], unique=True)
-  mongo.db.seats.create_index([("seat_id", pymongo.ASCENDING)], unique=True)
-  mongo.db.bookings.create_index([("seat_id", pymongo.ASCENDING), ("person_id", pymongo.ASCENDING)], unique=True)
-  mongo.db.persons.create_index([("person_id", pymongo.ASCENDING)], unique=True)
+  drop_collections(mongo.db)
+  create_indexes(mongo.db)
 
   check_insert_many(mongo.db.airports, db_dict["airports"])
   check_insert_many(mongo.db.airlines, db_dict["airlines"])
@@ -161,8 +179,81 @@ def populate_db():
   check_insert_many(mongo.db.seats, [b for a in db_dict["seats"].values() for b in a.values()])
   check_insert_many(mongo.db.bookings, db_dict["bookings"])
   check_insert_many(mongo.db.persons, db_dict["persons"])
+  rebuild_cheapest_fares(mongo.db)
+  seed_logos(db_dict["airlines"])
   print("\nFinished adding to database.")
     
 
-if __name__ == "__main__":
+def top_up_db(db, dates):
+  """Adds the schedule of `dates` to a live database, keeping everything in it.
+
+  Flights are upserted on flight_id and only flights without seats get seats
+  and bookings, so running it again for the same dates adds nothing. Flights
+  already moved to the archive are skipped. A run interrupted after the seats
+  may leave some of them booked without a booking, the app only sees those as
+  taken.
+  """
+  db_dict = generate_dataset(dates)
+  flight_ids = [f.flight_id for f in db_dict["flights"]]
+  archived = set(db[f"{ARCHIVE_PREFIX}flights"].distinct("flight_id", {"flight_id": {"$in": flight_ids}}))
+  flights = [f for f in db_dict["flights"] if f.flight_id not in archived]
+  for collection, key, values in [("airports", "airport_id", db_dict["airports"]), ("airlines", "airline_id", db_dict["airlines"]), ("flights", "flight_id", flights)]:
+    if values:
+      db[collection].bulk_write([UpdateOne({key: getattr(v, key)}, {"$setOnInsert": v.to_dict()}, upsert=True) for v in values], ordered=False)
+
+  have_seats = set(db.seats.distinct("flight_id", {"flight_id": {"$in": [f.flight_id for f in flights]}}))
+  new_flights = [f for f in flights if f.flight_id not in have_seats]
+  if not new_flights:
+    print("Schedule is already up to date.")
+    return
+
+  seats = [s for f in new_flights for s in db_dict["seats"][f.flight_id].values()]
+  first_seat_id = next_seat_id(db, len(seats))
+  for i, s in enumerate(seats):
+    s.seat_id = first_seat_id + i
+  new_dict = {"flights": new_flights, "seats": defaultdict(dict), "persons": [], "bookings": []}
+  for s in seats:
+    new_dict["seats"][s.flight_id][s.seat_id] = s
+  populate_bookings(new_dict)
+  first_person_id = next_person_id(db, len(new_dict["persons"]))
+  for p in new_dict["persons"]:
+    p.person_id += first_person_id
+  for b in new_dict["bookings"]:
+    b.person_id += first_person_id
+
+  print(f"Adding {len(new_flights)} flights, {len(seats)} seats and {len(new_dict['bookings'])} bookings.")
+  check_insert_many(db.seats, seats)
+  if new_dict["persons"]:
+    check_insert_many(db.persons, new_dict["persons"])
+    check_insert_many(db.bookings, new_dict["bookings"])
+    # Reports count bookings from the event log.
+    ensure_booking_events(db)
+    seat_of = {s.seat_id: s for s in seats}
+    db.booking_events.insert_many([booking_event(seat_of[b.seat_id].to_dict(), b.person_id) for b in new_dict["bookings"]])
+  for departure_airport_id, day in {(f.departure_airport_id, day_of(f.date)) for f in new_flights}:
+    refresh_cheapest_fares(db, departure_airport_id, day)
+  print("Finished topping up the schedule.")
+
+
+def next_schedule_day(db):
+  last = db.flights.find_one({}, {"date": 1}, sort=[("date", pymongo.DESCENDING)])
+  return day_of(last["date"]) + timedelta(days=1) if last is not None else day_of(datetime.utcnow())
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Fills the database with generated flights, seats and bookings.")
+  parser.add_argument("--top-up", action="store_true", help="Add days to the existing schedule instead of replacing everything.")
+  parser.add_argument("--start", type=lambda s: datetime.strptime(s, "%Y-%m-%d"),
+                      help="First day to add with --top-up (YYYY-MM-DD), defaults to the day after the last flight.")
+  parser.add_argument("--days", type=int, default=1, help="Number of days to add with --top-up.")
+  args = parser.parse_args()
+
+  if not args.top_up:
     populate_db()
+    return
+  start = args.start or next_schedule_day(mongo.db)
+  top_up_db(mongo.db, [start + timedelta(days=i) for i in range(args.days)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional, Set
+from datetime import datetime, timedelta
+import threading
+
+from bson import ObjectId
+from pymongo.errors import CollectionInvalid
+
+# Size of the capped booking_events collection, the oldest events are dropped
+# once it is full.
+BOOKING_EVENTS_SIZE = 256 * 1024 * 1024
+# Offsets are the ObjectIds the app servers stamp events with, ordered by
+# their time. Readers stay this far behind the clock, so an event stamped just
+# before a read but inserted just after it isn't skipped.
+READ_LAG = timedelta(seconds=5)
+
+# Databases whose booking_events collection is known to exist, and the size
+# new ones are created with.
+_ensured: Set[str] = set()
+_ensured_lock = threading.Lock()
+_size = BOOKING_EVENTS_SIZE
+
+
+def init_app(app):
+  global _size
+  _size = app.config.setdefault("BOOKING_EVENTS_SIZE", BOOKING_EVENTS_SIZE)
+
+
+def ensure_booking_events(db: Any, size: int = BOOKING_EVENTS_SIZE):
+  try:
+    db.create_collection("booking_events", capped=True, size=size)
+  except CollectionInvalid:
+    pass  # Already exists.
+  _ensured.add(db.name)
+
+
+def booking_event(seat: Dict[str, Any], person_id: int) -> Dict[str, Any]:
+  return {
+      "seat_id": seat["seat_id"],
+      "flight_id": seat["flight_id"],
+      "person_id": person_id,
+      "price": seat["price"],
+      "travel_class": seat["travel_class"],
+      "booked_at": datetime.utcnow(),
+  }
+
+
+def append_booking_event(db: Any, seat: Dict[str, Any], person_id: int):
+  # An insert into a missing collection would create it uncapped.
+  if db.name not in _ensured:
+    with _ensured_lock:
+      if db.name not in _ensured:
+        ensure_booking_events(db, _size)
+  db.booking_events.insert_one(booking_event(seat, person_id))
+
+
+def read_booking_events(db: Any, after: Optional[ObjectId] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+  """Events with an offset (`_id`) greater than `after`, in offset order."""
+  offsets = {"$lt": ObjectId.from_datetime(datetime.utcnow() - READ_LAG)}
+  if after is not None:
+    offsets["$gt"] = after
+  return list(db.booking_events.find({"_id": offsets}).sort("_id", 1).limit(limit))
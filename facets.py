@@ -0,0 +1,167 @@
+from typing import Any, Dict, List, Optional, Tuple
+from bisect import bisect_right
+import dataclasses
+
+from .objects import Airline, Flight, Seat
+
+PRICE_BUCKETS = [0, 100, 200, 500, 1000, 2000]
+PRICE_BUCKET_OVERFLOW = "2000+"
+TIMES_OF_DAY = {
+    "night": (0, 6),
+    "morning": (6, 12),
+    "afternoon": (12, 18),
+    "evening": (18, 24),
+}
+
+
+@dataclasses.dataclass
+class SearchFilters:
+  airline_ids: List[int] = dataclasses.field(default_factory=list)
+  max_price: Optional[float] = None
+  times_of_day: List[str] = dataclasses.field(default_factory=list)
+
+  @staticmethod
+  def from_values(values: Any) -> "SearchFilters":
+    max_price = values.get("max_price")
+    return SearchFilters(
+        [int(a) for a in values.getlist("airline")],
+        float(max_price) if max_price else None,
+        [t for t in values.getlist("time_of_day") if t in TIMES_OF_DAY])
+
+  def key(self) -> Tuple[Any, ...]:
+    return tuple(sorted(self.airline_ids)), self.max_price, tuple(sorted(self.times_of_day))
+
+  def airline_match(self) -> List[Dict[str, Any]]:
+    return [{ "$match": { "airline_id": { "$in": self.airline_ids } } }] if self.airline_ids else []
+
+  def price_match(self) -> List[Dict[str, Any]]:
+    return [{ "$match": { "seat.price": { "$lte": self.max_price } } }] if self.max_price is not None else []
+
+  def time_match(self) -> List[Dict[str, Any]]:
+    if not self.times_of_day:
+      return []
+    return [{ "$match": { "$or": [
+        { "hour": { "$gte": TIMES_OF_DAY[t][0], "$lt": TIMES_OF_DAY[t][1] } } for t in self.times_of_day
+    ]}}]
+
+  def airline_ok(self, seat: Seat) -> bool:
+    return not self.airline_ids or seat.flight.airline_id in self.airline_ids
+
+  def price_ok(self, seat: Seat) -> bool:
+    return self.max_price is None or seat.price <= self.max_price
+
+  def time_ok(self, seat: Seat) -> bool:
+    return not self.times_of_day or any(TIMES_OF_DAY[t][0] <= seat.flight.date.hour < TIMES_OF_DAY[t][1] for t in self.times_of_day)
+
+
+@dataclasses.dataclass
+class Facets:
+  airlines: List[Tuple[Airline, int]]
+  prices: List[Tuple[str, int]]
+  times_of_day: List[Tuple[str, int]]
+
+
+def search_seats(db: Any, flight_match: Dict[str, Any], travel_class: int, filters: SearchFilters) -> Tuple[List[Seat], Facets]:
+  """Cheapest free seat of `travel_class` per matching flight, plus facet counts.
+
+  Each facet is counted with every filter applied except its own, so the
+  counts show what selecting another value of that facet would return.
+  """
+  result = db.flights.aggregate([
+    { "$match": flight_match },
+    { "$lookup": {
+        "from": "seats",
+        "let": { "flight_id": "$flight_id" },
+        "pipeline": [
+          { "$match": { "$expr": { "$and": [
+              { "$eq": ["$flight_id", "$$flight_id"] },
+              { "$eq": ["$travel_class", travel_class] },
+              { "$eq": ["$booked", False] },
+          ]}}},
+          { "$sort": { "price": 1 } },
+          { "$limit": 1 },
+          { "$project": { "_id": 0 } },
+        ],
+        "as": "seat"
+      }
+    },
+    { "$unwind": "$seat" },  # Skip flights without available seats.
+    { "$addFields": { "hour": { "$hour": "$date" } } },
+    { "$facet": {
+        "results": filters.airline_match() + filters.price_match() + filters.time_match() + [
+          { "$sort": { "date": 1 } },
+          { "$project": { "_id": 0, "hour": 0 } },
+        ],
+        "airlines": filters.price_match() + filters.time_match() + [
+          { "$group": { "_id": "$airline_id", "count": { "$sum": 1 } } },
+          { "$sort": { "_id": 1 } },
+        ],
+        "prices": filters.airline_match() + filters.time_match() + [
+          { "$bucket": {
+              "groupBy": "$seat.price",
+              "boundaries": PRICE_BUCKETS,
+              "default": PRICE_BUCKET_OVERFLOW,
+            }
+          },
+        ],
+        "times_of_day": filters.airline_match() + filters.price_match() + [
+          { "$bucket": {
+              "groupBy": "$hour",
+              "boundaries": [start for start, _ in TIMES_OF_DAY.values()] + [24],
+            }
+          },
+        ],
+      }
+    },
+  ]).next()
+
+  seats = []
+  for f in result["results"]:
+    seat = Seat.from_dict(f.pop("seat"))
+    seat.flight = Flight.from_dict(f).load(db)
+    seats.append(seat)
+
+  airline_counts = {a["_id"]: a["count"] for a in result["airlines"]}
+  airlines = [Airline.from_dict(a) for a in db.airlines.find({"airline_id": {"$in": list(airline_counts)}})]
+  bucket_names = {start: name for name, (start, _) in TIMES_OF_DAY.items()}
+  facets = Facets(
+      [(a, airline_counts[a.airline_id]) for a in airlines],
+      [(_price_bucket_name(b["_id"]), b["count"]) for b in result["prices"]],
+      [(bucket_names[b["_id"]], b["count"]) for b in result["times_of_day"]])
+  return seats, facets
+
+
+def facet_seats(seats: List[Seat], filters: SearchFilters) -> Tuple[List[Seat], Facets]:
+  """`search_seats` over the cheapest seat per flight already loaded, in date order."""
+  airline_counts: Dict[int, int] = {}
+  price_counts: Dict[Any, int] = {}
+  time_counts: Dict[str, int] = {}
+  for seat in seats:
+    airline, price, time = filters.airline_ok(seat), filters.price_ok(seat), filters.time_ok(seat)
+    if price and time:
+      airline_counts[seat.flight.airline_id] = airline_counts.get(seat.flight.airline_id, 0) + 1
+    if airline and time:
+      bucket = _price_bucket(seat.price)
+      price_counts[bucket] = price_counts.get(bucket, 0) + 1
+    if airline and price:
+      name = next(name for name, (start, end) in TIMES_OF_DAY.items() if start <= seat.flight.date.hour < end)
+      time_counts[name] = time_counts.get(name, 0) + 1
+
+  airlines = {seat.flight.airline_id: seat.flight.airline for seat in seats}
+  facets = Facets(
+      [(airlines[a], airline_counts[a]) for a in sorted(airline_counts)],
+      [(_price_bucket_name(b), price_counts[b]) for b in PRICE_BUCKETS[:-1] + [PRICE_BUCKET_OVERFLOW] if b in price_counts],
+      [(name, time_counts[name]) for name in TIMES_OF_DAY if name in time_counts])
+  return [seat for seat in seats if filters.airline_ok(seat) and filters.price_ok(seat) and filters.time_ok(seat)], facets
+
+
+def _price_bucket(price: float) -> Any:
+  i = bisect_right(PRICE_BUCKETS, price) - 1
+  return PRICE_BUCKETS[i] if 0 <= i < len(PRICE_BUCKETS) - 1 else PRICE_BUCKET_OVERFLOW
+
+
+def _price_bucket_name(lower_bound: Any) -> str:
+  if lower_bound == PRICE_BUCKET_OVERFLOW:
+    return lower_bound
+  upper_bound = PRICE_BUCKETS[PRICE_BUCKETS.index(lower_bound) + 1]
+  return f"{lower_bound}-{upper_bound}"
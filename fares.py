@@ -0,0 +1,176 @@
+from typing import Any, Dict, List
+from datetime import datetime, timedelta
+import heapq
+import itertools
+
+import pymongo
+from pymongo import DeleteMany, ReplaceOne
+
+from .objects import Flight, Seat
+
+# Number of cheapest fares kept per (departure airport, day, travel class).
+TOP_K = 20
+
+DAY_OF_DATE = {"$dateFromParts": {
+    "year": {"$year": "$date"},
+    "month": {"$month": "$date"},
+    "day": {"$dayOfMonth": "$date"},
+}}
+
+# Cheapest free seat of every travel class of the flight, as `classes`.
+CHEAPEST_SEAT_PER_CLASS = { "$lookup": {
+    "from": "seats",
+    "let": { "flight_id": "$flight_id" },
+    "pipeline": [
+      { "$match": { "$expr": { "$and": [
+          { "$eq": ["$flight_id", "$$flight_id"] },
+          { "$eq": ["$booked", False] },
+      ]}}},
+      { "$sort": { "price": 1 } },
+      { "$group": {
+          "_id": "$travel_class",
+          "price": { "$first": "$price" },
+          "seat_id": { "$first": "$seat_id" },
+          "number": { "$first": "$number" },
+        }
+      },
+    ],
+    "as": "classes"
+  }
+}
+
+
+def day_of(date: datetime) -> datetime:
+  return datetime(date.year, date.month, date.day)
+
+
+def _cheapest_fares_pipeline(flight_match: Dict[str, Any], k: int = TOP_K) -> List[Dict[str, Any]]:
+  return [
+    { "$match": flight_match },
+    CHEAPEST_SEAT_PER_CLASS,
+    { "$unwind": "$classes" },
+    { "$sort": { "classes.price": 1, "date": 1 } },
+    { "$group": {
+        "_id": {
+          "departure_airport_id": "$departure_airport_id",
+          "day": DAY_OF_DATE,
+          "travel_class": "$classes._id",
+        },
+        "fares": { "$push": {
+          "price": "$classes.price",
+          "date": "$date",
+          "seat": { "seat_id": "$classes.seat_id", "number": "$classes.number" },
+          "flight": {
+            "flight_id": "$flight_id",
+            "airline_id": "$airline_id",
+            "departure_airport_id": "$departure_airport_id",
+            "arrival_airport_id": "$arrival_airport_id",
+            "plane": "$plane",
+            "date": "$date",
+            "duration_mins": "$duration_mins",
+          },
+        }},
+      }
+    },
+    { "$project": {
+        "_id": 0,
+        "departure_airport_id": "$_id.departure_airport_id",
+        "day": "$_id.day",
+        "travel_class": "$_id.travel_class",
+        "fares": { "$slice": ["$fares", k] },
+      }
+    },
+  ]
+
+
+def _bucket_key(doc: Dict[str, Any]) -> Dict[str, Any]:
+  return {k: doc[k] for k in ["departure_airport_id", "day", "travel_class"]}
+
+
+def rebuild_cheapest_fares(db: Any):
+  db.cheapest_fares.create_index([
+    ("departure_airport_id", pymongo.ASCENDING),
+    ("travel_class", pymongo.ASCENDING),
+    ("day", pymongo.ASCENDING),
+  ], unique=True)
+  # Buckets are replaced in place and stale ones removed afterwards, so
+  # searches running meanwhile never see an empty collection.
+  built_at = datetime.utcnow()
+  requests = [ReplaceOne(_bucket_key(d), dict(d, built_at=built_at), upsert=True) for d in db.flights.aggregate(_cheapest_fares_pipeline({}), allowDiskUse=True)]
+  requests.append(DeleteMany({"built_at": {"$ne": built_at}}))
+  db.cheapest_fares.bulk_write(requests)
+
+
+def refresh_cheapest_fares(db: Any, departure_airport_id: str, day: datetime):
+  day = day_of(day)
+  buckets = list(db.flights.aggregate(_cheapest_fares_pipeline({
+    "departure_airport_id": departure_airport_id,
+    "date": {"$gte": day, "$lt": day + timedelta(days=1)},
+  })))
+  requests = [DeleteMany({
+    "departure_airport_id": departure_airport_id,
+    "day": day,
+    "travel_class": {"$nin": [b["travel_class"] for b in buckets]},
+  })]
+  requests += [ReplaceOne(_bucket_key(b), b, upsert=True) for b in buckets]
+  db.cheapest_fares.bulk_write(requests)
+
+
+def on_seat_booked(db: Any, seat: Dict[str, Any], flight: Flight):
+  # The fares only change if the booked seat was the last free one at the
+  # cheapest price of its class.
+  still_as_cheap = db.seats.find_one({
+    "flight_id": seat["flight_id"],
+    "travel_class": seat["travel_class"],
+    "booked": False,
+    "price": {"$lte": seat["price"]},
+  }, {"_id": 1})
+  if still_as_cheap is None:
+    refresh_cheapest_fares(db, flight.departure_airport_id, flight.date)
+
+
+def cheapest_departures(db: Any, departure_airport_id: str, travel_class: int, start: datetime, end: datetime, k: int = TOP_K) -> List[Seat]:
+  if k > TOP_K:
+    # The buckets only keep TOP_K fares, more need the full aggregation.
+    buckets = [b for b in db.flights.aggregate(_cheapest_fares_pipeline({
+      "departure_airport_id": departure_airport_id,
+      "date": {"$gte": start, "$lte": end},
+    }, k)) if b["travel_class"] == travel_class]
+  else:
+    buckets = db.cheapest_fares.find({
+      "departure_airport_id": departure_airport_id,
+      "travel_class": travel_class,
+      "day": {"$gte": day_of(start), "$lte": end},
+    }, {"_id": 0, "fares": 1})
+  # Every bucket is already sorted, so a k-way merge yields the overall order.
+  fares = heapq.merge(*[b["fares"] for b in buckets], key=lambda f: (f["price"], f["date"]))
+  seats = []
+  for fare in itertools.islice((f for f in fares if start <= f["date"] <= end), k):
+    seat = Seat(fare["seat"]["seat_id"], fare["flight"]["flight_id"], fare["seat"]["number"], travel_class, int(fare["price"]), False)
+    seat.flight = Flight.from_dict(fare["flight"]).load(db)
+    seats.append(seat)
+  return seats
+
+
+def fare_matrix(db: Any, departure_airport_id: str, arrival_airport_id: str, day: datetime, days: int) -> List[Dict[str, Any]]:
+  """Cheapest available fare per day and travel class for `day` +- `days`."""
+  first_day = day_of(day) - timedelta(days=days)
+  prices = db.flights.aggregate([
+    { "$match": {
+        "departure_airport_id": departure_airport_id,
+        "arrival_airport_id": arrival_airport_id,
+        "date": {"$gte": first_day, "$lt": first_day + timedelta(days=2 * days + 1)},
+      }
+    },
+    CHEAPEST_SEAT_PER_CLASS,
+    { "$unwind": "$classes" },
+    { "$group": {
+        "_id": { "day": DAY_OF_DATE, "travel_class": "$classes._id" },
+        "price": { "$min": "$classes.price" },
+      }
+    },
+  ])
+  matrix = [{"day": first_day + timedelta(days=i), "prices": {}} for i in range(2 * days + 1)]
+  for p in prices:
+    matrix[(p["_id"]["day"] - first_day).days]["prices"][p["_id"]["travel_class"]] = int(p["price"])
+  return matrix
@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional
+
+import pymongo
+
+from .archive import ARCHIVE_PREFIX
+from .objects import Airline, Airport, Booking, Flight, Person, Seat
+
+
+def _lookup_one(collection: str, local_field: str, foreign_field: str, as_field: str) -> List[Dict[str, Any]]:
+  return [
+    { "$lookup": {
+        "from": collection,
+        "localField": local_field,
+        "foreignField": foreign_field,
+        "as": as_field
+      }
+    },
+    { "$unwind": f"${as_field}" },
+  ]
+
+
+def itinerary_stages(prefix: str = "") -> List[Dict[str, Any]]:
+  """Resolves bookings to seat, flight, airline, airports and person.
+
+  `prefix` selects the seats and flights collections, see `archive`.
+  """
+  return (_lookup_one(f"{prefix}seats", "seat_id", "seat_id", "seat")
+    + _lookup_one(f"{prefix}flights", "seat.flight_id", "flight_id", "flight")
+    + _lookup_one("airlines", "flight.airline_id", "airline_id", "airline")
+    + _lookup_one("airports", "flight.departure_airport_id", "airport_id", "departure_airport")
+    + _lookup_one("airports", "flight.arrival_airport_id", "airport_id", "arrival_airport")
+    + _lookup_one("persons", "person_id", "person_id", "person"))
+
+
+def booking_from_itinerary(d: Dict[str, Any]) -> Booking:
+  booking = Booking.from_dict(d)
+  booking.person = Person.from_dict(d["person"])
+  booking.seat = Seat.from_dict(d["seat"])
+  flight = booking.seat.flight = Flight.from_dict(d["flight"])
+  flight.airline = Airline.from_dict(d["airline"])
+  flight.departure_airport = Airport.from_dict(d["departure_airport"])
+  flight.arrival_airport = Airport.from_dict(d["arrival_airport"])
+  return booking
+
+
+def find_booking(db: Any, seat_id: int, person_id: int) -> Optional[Booking]:
+  # Bookings of departed flights are moved to the archive collections.
+  for prefix in ["", ARCHIVE_PREFIX]:
+    bookings = list(db[f"{prefix}bookings"].aggregate([
+      { "$match": { "seat_id": seat_id, "person_id": person_id } },
+      { "$limit": 1 },
+    ] + itinerary_stages(prefix)))
+    if bookings:
+      return booking_from_itinerary(bookings[0])
+  return None
+
+
+def find_trips(db: Any, person_ids: List[int], limit: int = 50, skip: int = 0) -> List[Booking]:
+  """Bookings of the given persons, most recently booked first, then archived ones."""
+  # Paging happens on the (person_id, _id) indexes before any $lookup, so long
+  # histories only resolve the requested page.
+  match = { "person_id": { "$in": person_ids } }
+  bookings = []
+  live = list(db.bookings.find(match, {"_id": 0, "seat_id": 1, "person_id": 1}).sort("_id", pymongo.DESCENDING).skip(skip).limit(limit))
+  if live:
+    bookings += _resolve(db, "", live)
+  if len(live) < limit:
+    # Archived bookings get new ids when they are moved, they come after all
+    # live ones.
+    archive_skip = max(skip - db.bookings.count_documents(match), 0) if not live else 0
+    archived = list(db[f"{ARCHIVE_PREFIX}bookings"].find(match, {"_id": 0, "seat_id": 1, "person_id": 1})
+        .sort("_id", pymongo.DESCENDING).skip(archive_skip).limit(limit - len(live)))
+    if archived:
+      bookings += _resolve(db, ARCHIVE_PREFIX, archived)
+  return bookings
+
+
+def _resolve(db: Any, prefix: str, keys: List[Dict[str, Any]]) -> List[Booking]:
+  # Keeps the order of `keys`.
+  bookings = {(b["seat_id"], b["person_id"]): booking_from_itinerary(b) for b in db[f"{prefix}bookings"].aggregate([
+    { "$match": { "$or": keys } },
+  ] + itinerary_stages(prefix))}
+  return [bookings[key] for key in ((k["seat_id"], k["person_id"]) for k in keys) if key in bookings]
+
+
+def person_ids_for_passport(db: Any, passport: str) -> List[int]:
+  # Every search registers the passenger again, so one passport can have many
+  # person ids.
+  return [p["person_id"] for p in db.persons.find({"passport": passport}, {"_id": 0, "person_id": 1})]
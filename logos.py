@@ -0,0 +1,139 @@
+from typing import Dict, Iterable, Optional
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+try:
+  from PIL import Image
+except ImportError:  # Thumbnails are skipped, the original logo is served.
+  Image = None
+
+from .objects import Airline
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Optional local logos named <airline_id>.<ext>, served while fetching logo_url
+# fails (offline workers and tests). None are shipped.
+DEFAULT_SEED_DIR = os.path.join(PACKAGE_DIR, "static", "logos")
+DEFAULT_CACHE_DIR = os.path.join(PACKAGE_DIR, "logo_cache")
+# Width of the logo on the result cards.
+CARD_WIDTH = 150
+MAX_WIDTH = 800
+FETCH_TIMEOUT_SECS = 5
+# A failed download isn't retried for this long, so an offline worker doesn't
+# wait FETCH_TIMEOUT_SECS on every request for the same logo.
+FETCH_RETRY_SECS = 300
+# Magic bytes of the formats airlines publish logos in.
+MIMETYPES = [
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"<svg", "image/svg+xml"),
+    (b"<?xml", "image/svg+xml"),
+]
+
+_failed_lock = threading.Lock()
+# logo_url -> monotonic time its download may be retried
+_failed: Dict[str, float] = {}
+
+
+def logo_digest(airline: Airline) -> str:
+  # Part of the logo URL, so a new logo_url gets a new immutable URL.
+  return hashlib.sha1(airline.logo_url.encode()).hexdigest()[:12]
+
+
+def _write_atomic(path: str, data: bytes):
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+  with os.fdopen(fd, "wb") as f:
+    f.write(data)
+  os.replace(tmp, path)
+
+
+def _seed_file(seed_dir: str, airline_id: int) -> Optional[str]:
+  if not os.path.isdir(seed_dir):
+    return None
+  for name in os.listdir(seed_dir):
+    if os.path.splitext(name)[0] == str(airline_id):
+      return os.path.join(seed_dir, name)
+  return None
+
+
+def original_logo(airline: Airline, cache_dir: str = DEFAULT_CACHE_DIR, seed_dir: str = DEFAULT_SEED_DIR) -> str:
+  """Path of the cached original logo, downloaded from its logo_url.
+
+  While the download fails the airline's file in `seed_dir` is served, it isn't
+  cached so the download is retried after FETCH_RETRY_SECS.
+  """
+  path = os.path.join(cache_dir, f"{airline.airline_id}-{logo_digest(airline)}.orig")
+  if not os.path.exists(path):
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+      _fetch(airline.logo_url, path)
+    except OSError:
+      seed = _seed_file(seed_dir, airline.airline_id)
+      if seed is None:
+        raise
+      return seed
+  return path
+
+
+def _fetch(url: str, path: str):
+  with _failed_lock:
+    if _failed.get(url, 0) > time.monotonic():
+      raise OSError(f"Fetching {url} failed recently.")
+  try:
+    request = urllib.request.Request(url, headers={"User-Agent": "flights-logo-cache"})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT_SECS) as response:
+      _write_atomic(path, response.read())
+  except OSError:
+    with _failed_lock:
+      _failed[url] = time.monotonic() + FETCH_RETRY_SECS
+    raise
+
+
+def logo_thumbnail(airline: Airline, width: int, cache_dir: str = DEFAULT_CACHE_DIR, seed_dir: str = DEFAULT_SEED_DIR) -> str:
+  """Path of the logo scaled to `width`, the original without Pillow."""
+  if width < 1:
+    raise ValueError(f"Invalid logo width {width}.")
+  original = original_logo(airline, cache_dir, seed_dir)
+  if Image is None:
+    return original
+  name = f"{airline.airline_id}-seed" if is_seed(airline, original) else f"{airline.airline_id}-{logo_digest(airline)}"
+  path = os.path.join(cache_dir, f"{name}-{width}.png")
+  if not os.path.exists(path):
+    with Image.open(original) as image:
+      if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+      buffer = io.BytesIO()
+      image.save(buffer, format="PNG", optimize=True)
+    _write_atomic(path, buffer.getvalue())
+  return path
+
+
+def is_seed(airline: Airline, path: str) -> bool:
+  """Whether `path` is a seed logo or its thumbnail rather than the fetched logo."""
+  return not os.path.basename(path).startswith(f"{airline.airline_id}-{logo_digest(airline)}")
+
+
+def logo_mimetype(path: str) -> str:
+  # Originals are cached without their extension, sniff the format.
+  with open(path, "rb") as f:
+    head = f.read(512).lstrip()
+  if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+    return "image/webp"
+  for magic, mimetype in MIMETYPES:
+    if head.startswith(magic):
+      return mimetype
+  return "application/octet-stream"
+
+
+def seed_logos(airlines: Iterable[Airline], cache_dir: str = DEFAULT_CACHE_DIR, seed_dir: str = DEFAULT_SEED_DIR):
+  for airline in airlines:
+    try:
+      logo_thumbnail(airline, CARD_WIDTH, cache_dir, seed_dir)
+    except OSError as e:
+      # The app falls back to the remote URL.
+      print(f"Could not cache logo of {airline.name}: {e}")
@@ -1,126 +1,228 @@
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional, Mapping
 
 import datetime
-import json
+import time
 
-from flask import Flask, render_template, request, redirect
-from flask_pymongo import PyMongo
+from flask import Flask, Blueprint, abort, current_app, render_template, request, redirect, jsonify, send_file, url_for
 from flask_bootstrap import Bootstrap
 from flask_qrcode import QRcode
 
-from bson.code import Code
-from bson.son import SON
-import pymongo
+from .objects import Airline, Airport, Person, Booking, Seat, open_identity_scope, close_identity_scope, identity_scope, preload_identities
+from .airport_index import AirportIndex
+from .database import mongo
+from . import admission, events, profiling, rendering
+from .logos import DEFAULT_CACHE_DIR, DEFAULT_SEED_DIR, FETCH_RETRY_SECS, MAX_WIDTH, is_seed, logo_digest, logo_mimetype, logo_thumbnail
+from .cache import LRUCache, SingleFlight
+from .events import ensure_booking_events
+from .facets import SearchFilters, TIMES_OF_DAY
+from .fares import TOP_K
+from .repository import FlightRepository, MongoRepository, create_repository
+from .admission import limit_searches
+from .warmup import hot_routes, touch_indexes
+
+bp = Blueprint("flights", __name__)
+
+MAX_FLEX_DAYS = 7
+TRIPS_PER_PAGE = 20
+
+# Issued boarding passes never change, keyed by (seat_id, person_id).
+boarding_passes = LRUCache(maxsize=10000)
+# Identical concurrent searches share one computation, results live briefly.
+SEARCH_RESULT_TTL_SECS = 2.0
+searches = SingleFlight(ttl=SEARCH_RESULT_TTL_SECS, maxsize=10000)
+
+
+def create_app(config: Optional[Mapping[str, Any]] = None) -> Flask:
+  app = Flask(__name__)
+  app.config["WARMUP_ON_START"] = False
+  app.config["LOGO_CACHE_DIR"] = DEFAULT_CACHE_DIR
+  app.config["LOGO_SEED_DIR"] = DEFAULT_SEED_DIR
+  app.config["WARMUP_ROUTES"] = 20
+  app.config["WARMUP_DAYS"] = 3
+  app.config["WARMUP_BUDGET_SECS"] = 30
+  app.config["REPOSITORY"] = "mongo"
+  app.config["SQLITE_PATH"] = ":memory:"
+  app.config.update(config or {})
+  Bootstrap(app)
+  QRcode(app)
+  mongo.init_app(app)
+  profiling.init_app(app, mongo)
+  admission.init_app(app)
+  events.init_app(app)
+  rendering.init_app(app)
+  app.extensions["repository"] = create_repository(app.config)
+  app.before_request(open_identity_scope)
+  app.teardown_request(lambda exc: close_identity_scope())
+  app.register_blueprint(bp)
+  from .api import api
+  app.register_blueprint(api)
+  app.extensions["ready"] = True
+  if app.config["WARMUP_ON_START"]:
+    warm_up(app)
+  return app
+
+
+def warm_up(app: Flask):
+  """Loads reference data and primes the hottest routes, then marks the app ready.
+
+  Priming stops once WARMUP_BUDGET_SECS are spent, the worker is ready either
+  way. Also safe to call from a gunicorn post_fork hook, every process gets
+  its own client.
+  """
+  app.extensions["ready"] = False
+  start = time.monotonic()
+  deadline = start + app.config["WARMUP_BUDGET_SECS"]
+  with app.app_context():
+    db = mongo_database()
+    if db is not None:
+      db.command("ping")
+      ensure_booking_events(db, app.config["BOOKING_EVENTS_SIZE"])
+    load_reference_data()
+    for name in app.jinja_loader.list_templates():
+      app.jinja_env.get_template(name)
+
+    primed = 0
+    today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    with app.test_request_context(), identity_scope():
+      # Route history and the indexes to page in are Mongo's.
+      for src_airport, dst_airport in (hot_routes(db, today, app.config["WARMUP_ROUTES"]) if db is not None else []):
+        for day in range(app.config["WARMUP_DAYS"]):
+          start_date = today + datetime.timedelta(days=day)
+          for travel_class in (1, 2):
+            if time.monotonic() > deadline:
+              break
+            seats, _ = get_repository().search_seats(
+                src_airport, dst_airport, start_date, start_date + datetime.timedelta(hours=48), travel_class, SearchFilters())
+            compute_occupancy([s.flight_id for s in seats])
+            for s in seats:
+              rendering.flight_card(s.flight)
+            primed += 1
+    keys = touch_indexes(db, deadline, time.monotonic) if db is not None and time.monotonic() < deadline else 0
+  app.extensions["ready"] = True
+  print(f"Warmed up {primed} searches and {keys} index keys in {time.monotonic() - start:.2f}s.")
+
+
+def load_reference_data():
+  """Refreshes the airport index and the airlines and airports every request starts with."""
+  airports = [Airport.from_dict(a) for a in get_repository().all_airports()]
+  airlines = [Airline.from_dict(a) for a in get_repository().all_airlines()]
+  preload_identities(airlines, airports)
+  index = current_app.extensions["airport_index"] = AirportIndex(airports)
+  print(f"Loaded {len(airlines)} airlines and {len(index)} airports.")
+  return index
+
+
+def build_airport_index(repository: FlightRepository) -> AirportIndex:
+  index = AirportIndex(Airport.from_dict(a) for a in repository.all_airports())
+  print(f"Indexed {len(index)} airports.")
+  return index
+
+
+def get_airport_index() -> AirportIndex:
+  index = current_app.extensions.get("airport_index")
+  if index is None:
+    index = current_app.extensions["airport_index"] = build_airport_index(get_repository())
+  return index
+
+
+def resolve_airport(text: str) -> str:
+  # Fall back to the raw input so exact codes unknown to the index still match.
+  return get_airport_index().resolve(text) or text
+
+
+def get_repository() -> FlightRepository:
+  return current_app.extensions["repository"]
+
+
+def mongo_database() -> Optional[Any]:
+  """The database behind a Mongo repository, None with the other backends."""
+  repository = get_repository()
+  return repository.db if isinstance(repository, MongoRepository) else None
 
-from .objects import Airline, Airport, Flight, Person, Booking, Seat
 
-app = Flask(__name__)
-Bootstrap(app)
-QRcode(app)
-app.config["MONGO_URI"] = "mongodb://localhost:27017/myDatabase"
-mongo = PyMongo(app)
+def compute_occupancy(flight_ids: List[str]) -> Dict[str, float]:
+  return get_repository().occupancy(flight_ids)
 
-if "persons" in mongo.db.list_collection_names():
-  person_id = mongo.db.persons.find().sort("person_id", pymongo.DESCENDING).limit(1)[0]["person_id"] + 1
-else:
-  person_id = 0
 
-def compute_occupancy(flight_ids: List[str]) -> Dict[str, float]:
-  occupancy = mongo.db.seats.map_reduce(
-    Code("""function () {
-      emit(this.flight_id, { booked: this.booked });
-    }"""), Code("""function (key, values) {
-      var results = {"flight_id": key, "occupancy": 0.0};
-      occupied = 0;
-      total = 0;
-      values.forEach(function (value) {
-        total++;
-        if (value["booked"] === true) occupied++;
-      });
-      results["occupancy"] = occupied / total;
-      return results;
-    }"""), "occupancy", query={
-      "flight_id": {"$in": flight_ids}
-    })
-  occupancy = {v["value"]["flight_id"]: v["value"]["occupancy"] for v in occupancy.find()}
-  return occupancy
-
-
-def get_seats(db: Any, travel_class: int, matcher: Any):
-  found_flights = db.flights.aggregate([
-    matcher,
-    { "$lookup": {
-        "from": "seats", 
-        "localField": "flight_id", 
-        "foreignField": "flight_id", 
-        "as": "seat"
-      }
-    },
-    { "$unwind": "$seat" },
-    { "$group": {
-        "_id": "$flight_id",
-        "flight": { "$first": "$$CURRENT" },
-        "seats": { "$push": "$seat" }, 
-      }
-    }
-  ])
-
-  seats = []
-  for s in found_flights:
-    seat = None
-    for seat_dict in s["seats"]:
-      if not seat_dict["booked"] and seat_dict["travel_class"] == travel_class:
-        seat = Seat.from_dict(seat_dict)
-        break
-    if seat is None:
-      continue  # Skip flight if no available seats.  
-    
-    seat.flight = Flight.from_dict(s["flight"]).load(db)
-    seats.append(seat)
-  print(f"Found {len(seats)} flights.")
-  return seats
+def shared_search_seats(key: tuple, filters: SearchFilters):
+  """`search_seats` for the (from, to, start, end, travel_class, filters.key()) `key`."""
+  repository = get_repository()
+  return searches.do(("seats",) + key, lambda: repository.search_seats(*key[:5], filters))
 
 
-@app.route('/')
+@bp.route('/')
 def find_flight():
   return render_template('index.html')
 
 
-@app.route('/search', methods = ["POST"])
-def search():
-  name = request.values["pass_name"]
-  birthdate = datetime.datetime.strptime(request.values["pass_birthdate"], "%Y-%m-%d")
-  travel_class = int(request.values["pass_class"])
-  passport = request.values["pass_passport"]
-  
-  global person_id
-  person = Person(person_id, name, birthdate, passport, travel_class)
-  person_id += 1
-  mongo.db.persons.insert_one(person.to_dict())
+@bp.route('/ready')
+def ready():
+  # Readiness probe, the load balancer only routes to warmed up workers.
+  is_ready = current_app.extensions.get("ready", False)
+  return jsonify({"ready": is_ready}), 200 if is_ready else 503
+
+
+@bp.route('/airports/autocomplete')
+def airports_autocomplete():
+  limit = min(int(request.args.get("limit", 10)), 50)
+  return jsonify([{
+      "airport_id": a.airport_id,
+      "city": a.city,
+      "country": a.country,
+  } for a in get_airport_index().complete(request.args.get("q", ""), limit)])
+
+
+@bp.route('/airports/reindex', methods = ["POST"])
+def airports_reindex():
+  index = load_reference_data()
+  return jsonify({"airports": len(index)})
 
-  src_airport = request.values["from"]
-  dst_airport = request.values["to"]
+
+@bp.route('/search', methods = ["POST"])
+@limit_searches
+def search():
+  repository = get_repository()
+  if "person_id" in request.values:
+    # Refining the filters of an earlier search, keep the same passenger.
+    person_dict = repository.person(int(request.values["person_id"]))
+    if person_dict is None:
+      abort(404)
+    person = Person.from_dict(person_dict)
+  else:
+    name = request.values["pass_name"]
+    birthdate = datetime.datetime.strptime(request.values["pass_birthdate"], "%Y-%m-%d")
+    travel_class = int(request.values["pass_class"])
+    passport = request.values["pass_passport"]
+
+    person = Person(repository.next_person_id(), name, birthdate, passport, travel_class)
+    repository.insert_person(person)
+
+  src_airport = resolve_airport(request.values["from"])
+  dst_airport = resolve_airport(request.values["to"])
   dep_date = request.values["dep_date"]
   dep_time = request.values["dep_time"]
   
-  dep_datetime = datetime.datetime.strptime(f"{dep_date} {dep_time}", "%Y-%m-%d %H:%S")
+  dep_datetime = datetime.datetime.strptime(f"{dep_date} {dep_time}", "%Y-%m-%d %H:%M")
   next_day = dep_datetime + datetime.timedelta(hours=48)
   print("Flights between", dep_datetime, next_day)
   
-  seats = get_seats(mongo.db, person.travel_class, matcher={ "$match": {
-      "departure_airport_id": src_airport,
-      "arrival_airport_id": dst_airport,
-      "date": {"$lte": next_day, "$gte": dep_datetime}
-    }
-  })
-  seats.sort(key=lambda s: s.flight.date)
+  filters = SearchFilters.from_values(request.values)
+  key = (src_airport, dst_airport, dep_datetime, next_day, person.travel_class, filters.key())
+  seats, facets = shared_search_seats(key, filters)
+  print(f"Found {len(seats)} flights.")
 
-  flight_ids = [s.flight_id for s in seats]
   variables = {
       "seats": seats,
-      "occupancy": compute_occupancy(flight_ids),
+      "occupancy": searches.do(("occupancy",) + key, lambda: compute_occupancy([s.flight_id for s in seats])),
       "person": person,
+      "facets": facets,
+      "filters": filters,
+      "times_of_day": TIMES_OF_DAY,
   }
+  flex_days = min(int(request.values.get("flex_days", 0)), MAX_FLEX_DAYS)
+  if flex_days > 0:
+    variables["fare_matrix"] = repository.fare_matrix(src_airport, dst_airport, dep_datetime, flex_days)
+    variables["selected_day"] = dep_datetime.date()
   return render_template('search.html', **variables)
 
 
@@ -139,162 +241,130 @@ def render_boarding_pass(base_url: str, person: Person, seat: Seat):
   return render_template('boarding_pass.html', **variables)
 
 
-@app.route("/boarding_pass/<int:seat_id>/<int:person_id>")
+@bp.route("/boarding_pass/<int:seat_id>/<int:person_id>")
 def boarding_pass(seat_id: int, person_id: int):
-  booking = Booking.from_dict(mongo.db.bookings.find({"person_id": person_id, "seat_id": seat_id})[0]).load(mongo.db)
+  booking = boarding_passes.get((seat_id, person_id))
+  if booking is None:
+    booking = get_repository().find_booking(seat_id, person_id)
+    if booking is None:
+      abort(404)
+    boarding_passes.put((seat_id, person_id), booking)
   return render_boarding_pass(request.base_url, booking.person, booking.seat)
 
 
-@app.route('/book/<int:seat_id>/<int:person_id>')
-def book(seat_id: int, person_id: int):
-  person_query = mongo.db.persons.find({"person_id": person_id})
-  num_persons = person_query.count()
-  if num_persons != 1:
-    raise ValueError(f"Found {num_persons} people with {person_id}.")
-  
-  person = Person.from_dict(person_query[0]).load(mongo.db)
-  booking = Booking(seat_id=seat_id, person_id=person_id)
+@bp.route('/book/<flight_id>/<int:travel_class>/<int:person_id>')
+def book(flight_id: str, travel_class: int, person_id: int):
+  repository = get_repository()
+  person_dict = repository.person(person_id)
+  if person_dict is None:
+    abort(404)
+  person = Person.from_dict(person_dict)
 
-  update_result = mongo.db.seats.update_one({"seat_id": seat_id, "booked": False}, { "$set": {"booked": True}})
-  if update_result.modified_count != 1:
-    return render_template("seat_booking_failed.html", seat_id=seat_id)
-  mongo.db.bookings.insert_one(booking.to_dict())
+  seat = repository.book_seat(flight_id, travel_class, person_id)
+  if seat is None:
+    return render_template("seat_booking_failed.html", flight_id=flight_id)
+  booking = Booking(seat_id=seat.seat_id, person_id=person_id)
+  booking.seat, booking.person = seat, person
+  boarding_passes.put((seat.seat_id, person_id), booking)
 
-  seat = Seat.from_dict(mongo.db.seats.find({"seat_id": seat_id})[0]).load(mongo.db)
   return render_boarding_pass(request.base_url, person, seat)
 
 
-@app.route('/best')
+@bp.route('/trips')
+def trips():
+  passport = request.args.get("passport")
+  if not passport:
+    return render_template('trips.html')
+  page = int(request.args.get("page", 0))
+  repository = get_repository()
+  bookings = repository.find_trips(repository.person_ids_for_passport(passport), TRIPS_PER_PAGE, page * TRIPS_PER_PAGE)
+  return render_template('trips.html', passport=passport, bookings=bookings, page=page, trips_per_page=TRIPS_PER_PAGE)
+
+
+@bp.route('/trips/<int:person_id>')
+def person_trips(person_id: int):
+  page = int(request.args.get("page", 0))
+  bookings = get_repository().find_trips([person_id], TRIPS_PER_PAGE, page * TRIPS_PER_PAGE)
+  return render_template('trips.html', bookings=bookings, page=page, trips_per_page=TRIPS_PER_PAGE)
+
+
+@bp.route('/best')
 def best():
-    return render_template('best.html')
+    return render_template('best.html', top_k=TOP_K)
 
 
-@app.route('/search_best', methods = ["POST"])
+@bp.route('/search_best', methods = ["POST"])
+@limit_searches
 def search_best():
   travel_class = int(request.values["pass_class"])
   
-  src_airport = request.values["from"]
+  src_airport = resolve_airport(request.values["from"])
   dep_date = request.values["dep_date"]
   dep_time = "00:00"
 
-  dep_datetime = datetime.datetime.strptime(f"{dep_date} {dep_time}", "%Y-%m-%d %H:%S")
+  dep_datetime = datetime.datetime.strptime(f"{dep_date} {dep_time}", "%Y-%m-%d %H:%M")
   next_day = dep_datetime + datetime.timedelta(hours=48)
   print("Best flights between", dep_datetime, next_day)
   
-  seats = get_seats(mongo.db, travel_class, matcher={ "$match": {
-      "departure_airport_id": src_airport,
-      "date": {"$lte": next_day, "$gte": dep_datetime}
-    }
-  })
-  seats.sort(key=lambda s: (s.price, s.flight.date))
+  key = (src_airport, travel_class, dep_datetime, next_day)
+  repository = get_repository()
+  seats = searches.do(("best",) + key, lambda: repository.cheapest_departures(src_airport, travel_class, dep_datetime, next_day))
   print(f"Found {len(seats)} flights.")
 
-  flight_ids = [s.flight_id for s in seats]
   variables = {
       "seats": seats,
-      "occupancy": compute_occupancy(flight_ids),
+      "occupancy": searches.do(("best_occupancy",) + key, lambda: compute_occupancy([s.flight_id for s in seats])),
   }
   return render_template('search.html', **variables)
 
-@app.route('/airlines')
+@bp.route('/logos/<int:airline_id>/<digest>/<int:width>.png')
+def logo(airline_id: int, digest: str, width: int):
+  if width < 1:
+    abort(404)
+  airline_dict = get_repository().airline(airline_id)
+  if airline_dict is None:
+    abort(404)
+  airline = Airline.from_dict(airline_dict)
+  if digest != logo_digest(airline):
+    return redirect(url_for("flights.logo", airline_id=airline_id, digest=logo_digest(airline), width=width))
+  try:
+    path = logo_thumbnail(airline, min(width, MAX_WIDTH), current_app.config["LOGO_CACHE_DIR"], current_app.config["LOGO_SEED_DIR"])
+  except OSError:
+    return redirect(airline.logo_url)  # Not cached and unreachable from here.
+  if is_seed(airline, path):
+    # Stand-in until logo_url can be fetched.
+    return send_file(path, mimetype=logo_mimetype(path), max_age=FETCH_RETRY_SECS)
+  # The URL changes with the logo, so browsers never need to revalidate.
+  response = send_file(path, mimetype=logo_mimetype(path), max_age=365 * 24 * 3600)
+  response.cache_control.public = True
+  response.cache_control.immutable = True
+  return response
+
+
+@bp.route('/airlines')
 def airlines():
-  # mongo.db.flight_seats.drop()
-  # mongo.db.flights.aggregate([
-  #   # { "$match": {
-  #   #     "airline_id": airline_id
-  #   #   }
-  #   # },
-  #   { "$lookup": {
-  #       "from": "airlines", 
-  #       "localField": "airline_id", 
-  #       "foreignField": "airline_id", 
-  #       "as": "airline"
-  #     }
-  #   },
-  #   { "$unwind": "$airline" },
-  #   { "$lookup": {
-  #       "from": "seats", 
-  #       "localField": "flight_id", 
-  #       "foreignField": "flight_id", 
-  #       "as": "seat"
-  #     }
-  #   },
-  #   { "$unwind": "$seat" },
-  #   { "$group": {
-  #       "_id": "$seat_id",
-  #       "flight": { "$first": "$$CURRENT" },
-  #       "seats": { "$push": "$seat" }, 
-  #       "airline": { "$first": "$airline" },
-  #     }
-  #   },
-  #   { "$out": "flight_seats"}
-  # ],  allowDiskUse=True)
-
-  reduce_oc = Code("""function (key, values) {
-      var results = {};
-      var occupied = 0;
-      var total = 0;
-      values.forEach(function (value) {
-        if (values["airline_id"] !== undefined) results["airline_id"] = values["airline_id"];
-        if (values["booked"] !== undefined) {
-          total++;
-          occupied += value["booked"];
-        }
-      });
-      results["total"] = total;
-      results["occupied"] = occupied;
-      return results;
-    }""")
-  mongo.db.seats.map_reduce(Code("""function () {
-      emit(this.flight_id, { booked: this.booked ? 1 : 0 });
-    }"""), reduce_oc, out={ "reduce": "occupancy"})
-  mongo.db.flights.map_reduce(Code("""function () {
-    emit(this.flight_id, { airline_id: this.airline_id });
-  }"""), reduce_oc, out={"reduce": "occupancy"})
-  for k in mongo.db.occupancy.find():
-    print(k)
-  occupancy = {v["value"]["airline_id"]: v["value"]["occupancy"] for v in occupancy.find()}
-  airline_ids = occupancy.keys()
-
-  airports = mongo.db.flight_seats.map_reduce(
-    Code("""function () {
-      emit(this.airline.airline_id, { airport: this.departure_airport_id });
-    }"""), Code("""function (key, values) {
-      var set = new Set();
-      values.forEach(function (value) {
-        set.add(value["airport_id"]);
-      });
-      var results = {"airline_id": key, "airports": set.size};
-      return results;
-    }"""), "airports")
-  airports = {v["value"]["airline_id"]: v["value"]["airports"] for v in airports.find()}
-
-  price = mongo.db.flight_seats.map_reduce(
-  Code("""function () {
-      var price_sum = 0;
-      var seats = 0;
-      this.seats.forEach(function (value) {
-        price_sum += value["price"];
-        seats++;
-      });
-      emit(this.airline.airline_id, { price: price_sum, seats: seats });
-  }"""), Code("""function (key, values) {
-    var price_sum = values.reduce((a, b) => a["price"] + b["price"], 0);
-    var seat_sum = values.reduce((a, b) => a["seats"] + b["seats"], 0);
-    var results = {"airline_id": key, "price": price_sum / seat_sum};
-    return results;
-  }"""), "price")
-  price = {v["value"]["airline_id"]: v["value"]["price"] for v in price.find()}
-
-  return render_template('airlines.html', {
-    "s": [{
-      "airline": result["airline"]["airline_id"],
-      "occupancy": occupancy[result["airline"]["airline_id"]],
-      "airports_served": airports[result["airline"]["airline_id"]],
-      "avg_price": price[result["airline"]["airline_id"]],
-    } for result in found_flights.find()]
-  })
+  # Reads the report written offline by `analytics`, never the live seats.
+  db = mongo_database()
+  if db is None:
+    abort(404)  # The report is only written to Mongo.
+  stats = {a["_id"]: a for a in db.report_daily.aggregate([
+    { "$group": {
+        "_id": "$airline_id",
+        "seats": { "$sum": "$seats" },
+        "booked": { "$sum": "$booked" },
+        "fare_sum": { "$sum": "$fare_sum" },
+        "airports": { "$addToSet": "$departure_airport_id" },
+      }
+    }
+  ])}
+  airline_stats = [{
+      "airline": airline,
+      "occupancy": stats[airline.airline_id]["booked"] / stats[airline.airline_id]["seats"],
+      "airports_served": len(stats[airline.airline_id]["airports"]),
+      "avg_price": int(stats[airline.airline_id]["fare_sum"] / stats[airline.airline_id]["seats"]),
+  } for airline in (Airline.from_dict(a) for a in get_repository().all_airlines() if a["airline_id"] in stats)]
+  return render_template('airlines.html', airline_stats=airline_stats)
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -1,7 +1,50 @@
+import contextlib
 import dataclasses
-from typing import List, Tuple
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
+##### Identity map
+
+# Within a scope (one web request) every airline, airport and flight is
+# materialized once, from_dict and load hand out the existing instance.
+_identity_map: ContextVar[Optional[Dict[Tuple[type, Any], Any]]] = ContextVar("identity_map", default=None)
+
+# Airlines and airports rarely change, every scope starts with this snapshot.
+_preloaded: Dict[Tuple[type, Any], Any] = {}
+
+def preload_identities(airlines: List["Airline"], airports: List["Airport"]):
+  global _preloaded
+  _preloaded = {**{(Airline, a.airline_id): a for a in airlines}, **{(Airport, a.airport_id): a for a in airports}}
+
+def open_identity_scope():
+  _identity_map.set(dict(_preloaded))
+
+def close_identity_scope():
+  _identity_map.set(None)
+
+@contextlib.contextmanager
+def identity_scope():
+  previous = _identity_map.set(dict(_preloaded))
+  try:
+    yield
+  finally:
+    _identity_map.reset(previous)
+
+def lookup(cls: type, key: Any) -> Optional[Any]:
+  """The object of `cls` with `key` in the current identity scope, if loaded."""
+  identities = _identity_map.get()
+  return None if identities is None else identities.get((cls, key))
+
+def _identity(cls: type, key: Any, make: Callable[[], Any]) -> Any:
+  identities = _identity_map.get()
+  if identities is None:
+    return make()
+  obj = identities.get((cls, key))
+  if obj is None:
+    obj = identities[(cls, key)] = make()
+  return obj
+
 ##### Local classes
 
 class Persistable:
@@ -40,7 +83,7 @@ class Airline(Persistable):
 
   @staticmethod
   def from_dict(d):
-    return Airline(int(d["airline_id"]), d["name"], d["logo_url"])
+    return _identity(Airline, int(d["airline_id"]), lambda: Airline(int(d["airline_id"]), d["name"], d["logo_url"]))
 
   def load(self, db):
     return self
@@ -54,7 +97,7 @@ class Airport(Persistable):
 
   @staticmethod
   def from_dict(d):
-    return Airport(d["airport_id"], d["city"], d["country"], d["keywords"])
+    return _identity(Airport, d["airport_id"], lambda: Airport(d["airport_id"], d["city"], d["country"], d["keywords"]))
 
   def load(self, db):
     return self
@@ -71,12 +114,14 @@ class Flight(Persistable):
 
   @staticmethod
   def from_dict(d):
-    return Flight(d["flight_id"], int(d["airline_id"]), d["departure_airport_id"], d["arrival_airport_id"], d["plane"], d["date"], int(d["duration_mins"]))
+    return _identity(Flight, d["flight_id"], lambda: Flight(d["flight_id"], int(d["airline_id"]), d["departure_airport_id"], d["arrival_airport_id"], d["plane"], d["date"], int(d["duration_mins"])))
 
   def load(self, db):
-    self.airline = Airline.from_dict(db.airlines.find({"airline_id": self.airline_id}).next()).load(db)
-    self.departure_airport = Airport.from_dict(db.airports.find({"airport_id": self.departure_airport_id}).next()).load(db)
-    self.arrival_airport = Airport.from_dict(db.airports.find({"airport_id": self.arrival_airport_id}).next()).load(db)
+    if getattr(self, "arrival_airport", None) is not None:
+      return self  # Already loaded through the identity map.
+    self.airline = lookup(Airline, self.airline_id) or Airline.from_dict(db.airlines.find({"airline_id": self.airline_id}).next()).load(db)
+    self.departure_airport = lookup(Airport, self.departure_airport_id) or Airport.from_dict(db.airports.find({"airport_id": self.departure_airport_id}).next()).load(db)
+    self.arrival_airport = lookup(Airport, self.arrival_airport_id) or Airport.from_dict(db.airports.find({"airport_id": self.arrival_airport_id}).next()).load(db)
     return self
 
   @staticmethod
@@ -106,7 +151,8 @@ class Seat(Persistable):
     return Seat(int(d["seat_id"]), d["flight_id"], d["number"], d["travel_class"], int(d["price"]), bool(d["booked"]))
 
   def load(self, db):
-    self.flight = Flight.from_dict(db.flights.find({"flight_id": self.flight_id}).next()).load(db)
+    flight = lookup(Flight, self.flight_id) or Flight.from_dict(db.flights.find({"flight_id": self.flight_id}).next())
+    self.flight = flight.load(db)
     return self
 
 @dataclasses.dataclass
@@ -119,6 +165,6 @@ class Booking(Persistable):
     return Booking(int(d["seat_id"]), int(d["person_id"]))
 
   def load(self, db):
-    self.seat = Seat.from_dict(db.seats.find({"seat_id": self.seat_id})).load(db)
-    self.person = Person.from_dict(db.person.find({"person_id": self.person_id})).load(db)
+    self.seat = Seat.from_dict(db.seats.find({"seat_id": self.seat_id}).next()).load(db)
+    self.person = Person.from_dict(db.persons.find({"person_id": self.person_id}).next()).load(db)
     return self
@@ -0,0 +1,244 @@
+"""Slow query log for the reads the app sends to Mongo.
+
+`mongo.db` hands out a `ProfiledDatabase` once `init_app` ran. Every
+aggregate, find and map_reduce slower than SLOW_QUERY_MS is kept in a bounded
+ring buffer with the shape of its filter or pipeline, duration, document
+count and the `explain()` of the plan. GET /api/v1/admin/slow_queries lists
+them once ADMIN_ENDPOINTS is set.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from collections import deque
+
+import datetime
+import json
+import threading
+import time
+
+from bson import json_util
+
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG_SIZE = 200
+# Explaining reruns the query planner, once per collection and operation in
+# this interval is enough to see a plan regression.
+EXPLAIN_INTERVAL_SECS = 60
+
+
+# Parts of an explain() that repeat the query's values.
+EXPLAIN_VALUE_KEYS = {"parsedQuery", "filter", "indexBounds", "command", "originalCommand"}
+
+
+def _plain(value: Any) -> Any:
+  # Extended JSON, so entries serialize without bson types.
+  return json.loads(json_util.dumps(value))
+
+
+def query_shape(value: Any) -> Any:
+  """`value` with every literal replaced by "?", field names and operators kept.
+
+  Filters carry passports and names, the log only keeps their shape.
+  """
+  if isinstance(value, dict):
+    return {k: query_shape(v) for k, v in value.items()}
+  if isinstance(value, list):
+    return [query_shape(v) for v in value]
+  if isinstance(value, str) and value.startswith("$"):
+    return value  # Field paths and variables in pipelines.
+  return "?"
+
+
+def _redact_explain(value: Any) -> Any:
+  if isinstance(value, dict):
+    return {k: query_shape(v) if k in EXPLAIN_VALUE_KEYS else _redact_explain(v) for k, v in value.items()}
+  if isinstance(value, list):
+    return [_redact_explain(v) for v in value]
+  return value
+
+
+class SlowQueryLog:
+  def __init__(self, threshold_ms: float = SLOW_QUERY_MS, size: int = SLOW_QUERY_LOG_SIZE, explain_interval: float = EXPLAIN_INTERVAL_SECS):
+    self.threshold_ms = threshold_ms
+    self.explain_interval = explain_interval
+    self._lock = threading.Lock()
+    self._entries: deque = deque(maxlen=size)
+    self._explained: Dict[Any, float] = {}
+
+  def _should_explain(self, key: Any) -> bool:
+    now = time.monotonic()
+    with self._lock:
+      if now - self._explained.get(key, -self.explain_interval) < self.explain_interval:
+        return False
+      self._explained[key] = now
+      return True
+
+  def record(self, collection: str, operation: str, query: Any, duration_ms: float, documents: Optional[int], explain=None):
+    """Keeps the operation if it was slow, `explain` is only called then."""
+    if duration_ms < self.threshold_ms:
+      return
+    plan = None
+    if explain is not None and self._should_explain((collection, operation)):
+      try:
+        plan = _redact_explain(_plain(explain()))
+      except Exception as e:  # Profiling never fails the query itself.
+        plan = {"error": str(e)}
+    entry = {
+        "at": datetime.datetime.utcnow().isoformat(),
+        "collection": collection,
+        "operation": operation,
+        "query": query_shape(_plain(query)),
+        "duration_ms": round(duration_ms, 1),
+        "documents": documents,
+        "explain": plan,
+    }
+    with self._lock:
+      self._entries.append(entry)
+
+  def entries(self) -> List[Dict[str, Any]]:
+    """Newest first."""
+    with self._lock:
+      return list(reversed(self._entries))
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+
+class ProfiledCursor:
+  """Times a find cursor from the first fetch until it is exhausted or closed."""
+
+  def __init__(self, cursor: Any, collection: "ProfiledCollection", query: Dict[str, Any]):
+    self._cursor = cursor
+    self._collection = collection
+    self._query = query
+
+  def __getattr__(self, name: str):
+    attr = getattr(self._cursor, name)
+    if not callable(attr):
+      return attr
+
+    def call(*args, **kwargs):
+      result = attr(*args, **kwargs)
+      # sort(), limit() etc. return the cursor itself, keep chaining on us.
+      return self if result is self._cursor else result
+    return call
+
+  def _record(self, duration_ms: float, documents: int):
+    self._collection._record("find", self._query, duration_ms, documents, lambda: self._cursor.clone().explain())
+
+  def __iter__(self) -> Iterator[Dict[str, Any]]:
+    start = time.perf_counter()
+    documents = 0
+    try:
+      for document in self._cursor:
+        documents += 1
+        yield document
+    finally:
+      self._record((time.perf_counter() - start) * 1000, documents)
+
+  def __next__(self) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+      return next(self._cursor)
+    finally:
+      self._record((time.perf_counter() - start) * 1000, 1)
+
+  next = __next__
+
+  # Special methods are looked up on the class, __getattr__ never sees them.
+  def __getitem__(self, index: Any):
+    if isinstance(index, slice):
+      self._cursor[index]  # Applies skip and limit to the cursor itself.
+      return self
+    start = time.perf_counter()
+    try:
+      return self._cursor[index]
+    finally:
+      self._record((time.perf_counter() - start) * 1000, 1)
+
+  def __enter__(self) -> "ProfiledCursor":
+    return self
+
+  def __exit__(self, *exc_info):
+    self._cursor.close()
+
+
+class _Documents:
+  """Iterator over fetched results with the `next()` of a command cursor."""
+
+  def __init__(self, documents: List[Dict[str, Any]]):
+    self._documents = iter(documents)
+
+  def __iter__(self) -> "_Documents":
+    return self
+
+  def __next__(self) -> Dict[str, Any]:
+    return next(self._documents)
+
+  next = __next__
+
+
+class ProfiledCollection:
+  def __init__(self, collection: Any, log: SlowQueryLog):
+    self._collection = collection
+    self._log = log
+
+  def __getattr__(self, name: str):
+    return getattr(self._collection, name)
+
+  def _record(self, operation: str, query: Any, duration_ms: float, documents: Optional[int], explain=None):
+    self._log.record(self._collection.name, operation, query, duration_ms, documents, explain)
+
+  def find(self, filter: Optional[Dict[str, Any]] = None, *args, **kwargs) -> ProfiledCursor:
+    return ProfiledCursor(self._collection.find(filter, *args, **kwargs), self, filter or {})
+
+  def find_one(self, filter: Any = None, *args, **kwargs) -> Optional[Dict[str, Any]]:
+    start = time.perf_counter()
+    document = self._collection.find_one(filter, *args, **kwargs)
+    query = filter if isinstance(filter, dict) else {"_id": filter}
+    self._record("find_one", query, (time.perf_counter() - start) * 1000, int(document is not None),
+                 lambda: self._collection.find(query, *args, **kwargs).limit(1).explain())
+    return document
+
+  def aggregate(self, pipeline: List[Dict[str, Any]], *args, **kwargs) -> _Documents:
+    # Aggregations here are small and always fully read, so the results are
+    # fetched up front to time them completely.
+    start = time.perf_counter()
+    documents = list(self._collection.aggregate(pipeline, *args, **kwargs))
+    database = self._collection.database
+    self._record("aggregate", pipeline, (time.perf_counter() - start) * 1000, len(documents),
+                 lambda: database.command("explain", {"aggregate": self._collection.name, "pipeline": pipeline, "cursor": {}}, verbosity="queryPlanner"))
+    return _Documents(documents)
+
+  def map_reduce(self, map: Any, reduce: Any, out: Any, *args, **kwargs):
+    start = time.perf_counter()
+    result = self._collection.map_reduce(map, reduce, out, *args, **kwargs)
+    self._record("map_reduce", {"map": str(map), "reduce": str(reduce), "query": kwargs.get("query", {})},
+                 (time.perf_counter() - start) * 1000, None)
+    return result
+
+
+class ProfiledDatabase:
+  def __init__(self, database: Any, log: SlowQueryLog):
+    self._database = database
+    self._log = log
+
+  def __getattr__(self, name: str):
+    attr = getattr(self._database, name)
+    # Names the database class doesn't define are collections.
+    return attr if hasattr(type(self._database), name) else ProfiledCollection(attr, self._log)
+
+  def __getitem__(self, name: str) -> ProfiledCollection:
+    return ProfiledCollection(self._database[name], self._log)
+
+  def get_collection(self, name: str, *args, **kwargs) -> ProfiledCollection:
+    return ProfiledCollection(self._database.get_collection(name, *args, **kwargs), self._log)
+
+
+def init_app(app, mongo):
+  app.config.setdefault("SLOW_QUERY_MS", SLOW_QUERY_MS)
+  app.config.setdefault("SLOW_QUERY_LOG_SIZE", SLOW_QUERY_LOG_SIZE)
+  app.config.setdefault("ADMIN_ENDPOINTS", False)
+  if app.config["SLOW_QUERY_MS"] is None:
+    mongo.slow_query_log = None
+  else:
+    mongo.slow_query_log = SlowQueryLog(app.config["SLOW_QUERY_MS"], app.config["SLOW_QUERY_LOG_SIZE"])
+  app.extensions["slow_query_log"] = mongo.slow_query_log
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+from flask import Flask, render_template, url_for
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from .cache import LRUCache
+from .logos import CARD_WIDTH, logo_digest
+from .objects import Airline, Flight
+
+# Bump whenever flight_card.html changes, so cached cards are not reused.
+CARD_LAYOUT_VERSION = 2
+
+flight_cards = LRUCache(maxsize=10000)
+
+
+def flight_card(flight: Flight) -> Markup:
+  """Static part of a search result card, rendered once per flight and logo."""
+  key = (flight.flight_id, logo_digest(flight.airline), CARD_LAYOUT_VERSION)
+  card = flight_cards.get(key)
+  if card is None:
+    card = Markup(render_template("flight_card.html", flight=flight))
+    flight_cards.put(key, card)
+  return card
+
+
+def logo_url(airline: Airline, width: int = CARD_WIDTH) -> str:
+  return url_for("flights.logo", airline_id=airline.airline_id, digest=logo_digest(airline), width=width)
+
+
+def init_app(app: Flask):
+  app.jinja_env.globals["flight_card"] = flight_card
+  app.jinja_env.globals["logo_url"] = logo_url
+  # Compiled templates are shared by all workers and survive restarts.
+  cache_dir = app.config.get("JINJA_BYTECODE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), f"flights-jinja-{os.getuid()}")
+  os.makedirs(cache_dir, exist_ok=True)
+  app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
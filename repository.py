@@ -0,0 +1,601 @@
+"""Storage backends behind searching and booking.
+
+`FlightRepository` is what the routes talk to, picked with the REPOSITORY
+config key: "mongo" (the default), "memory" or "sqlite" (at SQLITE_PATH).
+Backends implement a few primitive lookups and writes, searching and booking
+are composed from them in the base class. The Mongo backend overrides those
+with its aggregation pipelines, booking event log and cheapest fare buckets.
+
+Every backend claims seats the same way: a free seat of the cheapest price
+in the class, picked at random among the seats at that price.
+
+Run `python -m <package>.repository` to compare the backends on the same
+benchmark, the in-memory and SQLite backends need no database server.
+"""
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+import abc
+import argparse
+import heapq
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from . import booking, facets, fares, itineraries
+from .database import LazyMongo, mongo, next_person_id
+from .facets import Facets, SearchFilters
+from .objects import Airline, Airport, Booking, Flight, Person, Seat, lookup
+
+TRAVEL_CLASSES = (1, 2)
+
+
+class FlightRepository(abc.ABC):
+  ##### Primitives
+
+  @abc.abstractmethod
+  def add(self, airlines: Iterable[Airline], airports: Iterable[Airport], flights: Iterable[Flight], seats: Iterable[Seat]):
+    pass
+
+  @abc.abstractmethod
+  def all_airlines(self) -> List[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def all_airports(self) -> List[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def airline(self, airline_id: int) -> Optional[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def airport(self, airport_id: str) -> Optional[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def seat(self, seat_id: int) -> Optional[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def flights_in_window(self, departure_airport_id: str, arrival_airport_id: Optional[str], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Flights departing in [start, end] ordered by date, to any arrival airport if None."""
+
+  @abc.abstractmethod
+  def free_seats(self, flight_id: str, travel_class: int, limit: int = 1) -> List[Dict[str, Any]]:
+    """Cheapest free seats of the class on the flight."""
+
+  @abc.abstractmethod
+  def claim_seat(self, flight_id: str, travel_class: int) -> Optional[Dict[str, Any]]:
+    """Atomically books a random free seat of the cheapest price in the class, None if sold out."""
+
+  @abc.abstractmethod
+  def insert_booking(self, booking: Booking):
+    pass
+
+  @abc.abstractmethod
+  def has_booking(self, seat_id: int, person_id: int) -> bool:
+    pass
+
+  @abc.abstractmethod
+  def bookings_of(self, person_ids: List[int], limit: int, skip: int) -> List[Dict[str, Any]]:
+    """Bookings of the persons, most recently booked first."""
+
+  @abc.abstractmethod
+  def person(self, person_id: int) -> Optional[Dict[str, Any]]:
+    pass
+
+  @abc.abstractmethod
+  def insert_person(self, person: Person):
+    pass
+
+  @abc.abstractmethod
+  def next_person_id(self) -> int:
+    pass
+
+  @abc.abstractmethod
+  def person_ids_for_passport(self, passport: str) -> List[int]:
+    pass
+
+  @abc.abstractmethod
+  def occupancy(self, flight_ids: List[str]) -> Dict[str, float]:
+    """Fraction of booked seats per flight."""
+
+  @abc.abstractmethod
+  def flights_by_id(self, flight_ids: List[str]) -> List[Dict[str, Any]]:
+    """Flights with the ids, in no particular order."""
+
+  ##### Searching and booking
+
+  def load_flight(self, d: Dict[str, Any]) -> Flight:
+    flight = Flight.from_dict(d)
+    if getattr(flight, "arrival_airport", None) is not None:
+      return flight  # Already loaded through the identity map.
+    flight.airline = lookup(Airline, flight.airline_id) or Airline.from_dict(self.airline(flight.airline_id))
+    flight.departure_airport = lookup(Airport, flight.departure_airport_id) or Airport.from_dict(self.airport(flight.departure_airport_id))
+    flight.arrival_airport = lookup(Airport, flight.arrival_airport_id) or Airport.from_dict(self.airport(flight.arrival_airport_id))
+    return flight
+
+  def load_seat(self, d: Dict[str, Any], flight: Optional[Dict[str, Any]] = None) -> Seat:
+    seat = Seat.from_dict(d)
+    seat.flight = self.load_flight(flight or self.flights_by_id([seat.flight_id])[0])
+    return seat
+
+  def _cheapest_per_flight(self, flights: List[Dict[str, Any]], travel_class: int) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    cheapest = []
+    for f in flights:
+      seats = self.free_seats(f["flight_id"], travel_class)
+      if seats:
+        cheapest.append((f, seats[0]))
+    return cheapest
+
+  def search_seats(self, departure_airport_id: str, arrival_airport_id: str, start: datetime, end: datetime, travel_class: int, filters: SearchFilters) -> Tuple[List[Seat], Facets]:
+    """Cheapest free seat of `travel_class` per flight of the route in the window, plus facet counts."""
+    flights = self.flights_in_window(departure_airport_id, arrival_airport_id, start, end)
+    seats = [self.load_seat(s, f) for f, s in self._cheapest_per_flight(flights, travel_class)]
+    return facets.facet_seats(seats, filters)
+
+  def cheapest_departures(self, departure_airport_id: str, travel_class: int, start: datetime, end: datetime, k: int = fares.TOP_K) -> List[Seat]:
+    flights = self.flights_in_window(departure_airport_id, None, start, end)
+    cheapest = heapq.nsmallest(k, self._cheapest_per_flight(flights, travel_class), key=lambda fs: (fs[1]["price"], fs[0]["date"]))
+    return [self.load_seat(s, f) for f, s in cheapest]
+
+  def fare_matrix(self, departure_airport_id: str, arrival_airport_id: str, day: datetime, days: int) -> List[Dict[str, Any]]:
+    """Cheapest available fare per day and travel class for `day` +- `days`."""
+    first_day = fares.day_of(day) - timedelta(days=days)
+    matrix = [{"day": first_day + timedelta(days=i), "prices": {}} for i in range(2 * days + 1)]
+    end = first_day + timedelta(days=2 * days + 1) - timedelta(microseconds=1)
+    for f in self.flights_in_window(departure_airport_id, arrival_airport_id, first_day, end):
+      prices = matrix[(fares.day_of(f["date"]) - first_day).days]["prices"]
+      for travel_class in TRAVEL_CLASSES:
+        seats = self.free_seats(f["flight_id"], travel_class)
+        if seats:
+          prices[travel_class] = min(prices.get(travel_class, float("inf")), int(seats[0]["price"]))
+    return matrix
+
+  def book_seat(self, flight_id: str, travel_class: int, person_id: int) -> Optional[Seat]:
+    """Books a free seat of `travel_class` on the flight, None if sold out."""
+    seat_dict = self.claim_seat(flight_id, travel_class)
+    if seat_dict is None:
+      return None
+    seat = self.load_seat(seat_dict)
+    self.insert_booking(Booking(seat_id=seat.seat_id, person_id=person_id))
+    return seat
+
+  def _load_booking(self, seat_id: int, person_id: int) -> Booking:
+    b = Booking(seat_id, person_id)
+    b.seat = self.load_seat(self.seat(seat_id))
+    b.person = Person.from_dict(self.person(person_id))
+    return b
+
+  def find_booking(self, seat_id: int, person_id: int) -> Optional[Booking]:
+    return self._load_booking(seat_id, person_id) if self.has_booking(seat_id, person_id) else None
+
+  def find_trips(self, person_ids: List[int], limit: int = 50, skip: int = 0) -> List[Booking]:
+    """Bookings of the given persons, most recently booked first."""
+    return [self._load_booking(b["seat_id"], b["person_id"]) for b in self.bookings_of(person_ids, limit, skip)]
+
+
+class MongoRepository(FlightRepository):
+  def __init__(self, db: Any):
+    # A database, or the app's LazyMongo so every process uses its own client.
+    self._db = db
+
+  @property
+  def db(self) -> Any:
+    return self._db.db if isinstance(self._db, LazyMongo) else self._db
+
+  def add(self, airlines, airports, flights, seats):
+    for collection, values in [("airlines", airlines), ("airports", airports), ("flights", flights), ("seats", seats)]:
+      values = [v.to_dict() for v in values]
+      if values:
+        self.db[collection].insert_many(values)
+
+  def all_airlines(self):
+    return list(self.db.airlines.find({}, {"_id": 0}))
+
+  def all_airports(self):
+    return list(self.db.airports.find({}, {"_id": 0}))
+
+  def airline(self, airline_id):
+    return self.db.airlines.find_one({"airline_id": airline_id}, {"_id": 0})
+
+  def airport(self, airport_id):
+    return self.db.airports.find_one({"airport_id": airport_id}, {"_id": 0})
+
+  def seat(self, seat_id):
+    return self.db.seats.find_one({"seat_id": seat_id}, {"_id": 0})
+
+  def flights_by_id(self, flight_ids):
+    return list(self.db.flights.find({"flight_id": {"$in": flight_ids}}, {"_id": 0}))
+
+  def flights_in_window(self, departure_airport_id, arrival_airport_id, start, end):
+    match = {"departure_airport_id": departure_airport_id, "date": {"$gte": start, "$lte": end}}
+    if arrival_airport_id is not None:
+      match["arrival_airport_id"] = arrival_airport_id
+    return list(self.db.flights.find(match, {"_id": 0}).sort("date", 1))
+
+  def free_seats(self, flight_id, travel_class, limit=1):
+    return list(self.db.seats.find({"flight_id": flight_id, "travel_class": travel_class, "booked": False}, {"_id": 0}).sort("price", 1).limit(limit))
+
+  def claim_seat(self, flight_id, travel_class):
+    return booking.claim_seat(self.db, flight_id, travel_class)
+
+  def insert_booking(self, b):
+    self.db.bookings.insert_one(b.to_dict())
+
+  def has_booking(self, seat_id, person_id):
+    return self.db.bookings.find_one({"seat_id": seat_id, "person_id": person_id}, {"_id": 1}) is not None
+
+  def bookings_of(self, person_ids, limit, skip):
+    return list(self.db.bookings.find({"person_id": {"$in": person_ids}}, {"_id": 0}).sort("_id", -1).skip(skip).limit(limit))
+
+  def person(self, person_id):
+    return self.db.persons.find_one({"person_id": person_id}, {"_id": 0})
+
+  def insert_person(self, person):
+    self.db.persons.insert_one(person.to_dict())
+
+  def next_person_id(self):
+    return next_person_id(self.db)
+
+  def person_ids_for_passport(self, passport):
+    return itineraries.person_ids_for_passport(self.db, passport)
+
+  def occupancy(self, flight_ids):
+    return {o["_id"]: o["booked"] / o["total"] for o in self.db.seats.aggregate([
+      { "$match": { "flight_id": { "$in": flight_ids } } },
+      { "$group": {
+          "_id": "$flight_id",
+          "total": { "$sum": 1 },
+          "booked": { "$sum": { "$cond": ["$booked", 1, 0] } },
+        }
+      },
+    ])}
+
+  def load_seat(self, d, flight=None):
+    return Seat.from_dict(d).load(self.db)
+
+  def search_seats(self, departure_airport_id, arrival_airport_id, start, end, travel_class, filters):
+    return facets.search_seats(self.db, {
+        "departure_airport_id": departure_airport_id,
+        "arrival_airport_id": arrival_airport_id,
+        "date": {"$lte": end, "$gte": start}
+      }, travel_class, filters)
+
+  def cheapest_departures(self, departure_airport_id, travel_class, start, end, k=fares.TOP_K):
+    return fares.cheapest_departures(self.db, departure_airport_id, travel_class, start, end, k)
+
+  def fare_matrix(self, departure_airport_id, arrival_airport_id, day, days):
+    return fares.fare_matrix(self.db, departure_airport_id, arrival_airport_id, day, days)
+
+  def book_seat(self, flight_id, travel_class, person_id):
+    # Also appends to the booking event log and keeps the fare buckets fresh.
+    return booking.book_seat(self.db, flight_id, travel_class, person_id)
+
+  def find_booking(self, seat_id, person_id):
+    return itineraries.find_booking(self.db, seat_id, person_id)
+
+  def find_trips(self, person_ids, limit=50, skip=0):
+    return itineraries.find_trips(self.db, person_ids, limit, skip)
+
+
+class InMemoryRepository(FlightRepository):
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.airlines: Dict[int, Dict[str, Any]] = {}
+    self.airports: Dict[str, Dict[str, Any]] = {}
+    self.flights: Dict[str, Dict[str, Any]] = {}
+    self.seats: Dict[int, Dict[str, Any]] = {}
+    self.persons: Dict[int, Dict[str, Any]] = {}
+    # (seat_id, person_id) -> booking, in booking order.
+    self.bookings: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    self._person_bookings: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    self._passports: Dict[str, List[int]] = defaultdict(list)
+    self._next_person_id = 0
+    # (departure, arrival) and (departure, None) -> sorted [(date, flight_id)]
+    self._routes: Dict[Tuple[str, Optional[str]], List[Tuple[datetime, str]]] = defaultdict(list)
+    # (flight_id, travel_class) -> sorted [(price, seat_id)] of free seats
+    self._free: Dict[Tuple[str, int], List[Tuple[float, int]]] = defaultdict(list)
+    # flight_id -> [booked, total]
+    self._counts: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+
+  def add(self, airlines, airports, flights, seats):
+    with self._lock:
+      self.airlines.update((a.airline_id, a.to_dict()) for a in airlines)
+      self.airports.update((a.airport_id, a.to_dict()) for a in airports)
+      for f in flights:
+        self.flights[f.flight_id] = f.to_dict()
+        insort(self._routes[(f.departure_airport_id, f.arrival_airport_id)], (f.date, f.flight_id))
+        insort(self._routes[(f.departure_airport_id, None)], (f.date, f.flight_id))
+      for s in seats:
+        self.seats[s.seat_id] = s.to_dict()
+        self._counts[s.flight_id][1] += 1
+        if s.booked:
+          self._counts[s.flight_id][0] += 1
+        else:
+          insort(self._free[(s.flight_id, s.travel_class)], (s.price, s.seat_id))
+
+  def all_airlines(self):
+    return list(self.airlines.values())
+
+  def all_airports(self):
+    return list(self.airports.values())
+
+  def airline(self, airline_id):
+    return self.airlines.get(airline_id)
+
+  def airport(self, airport_id):
+    return self.airports.get(airport_id)
+
+  def seat(self, seat_id):
+    seat = self.seats.get(seat_id)
+    return None if seat is None else dict(seat)
+
+  def flights_by_id(self, flight_ids):
+    return [dict(self.flights[f]) for f in flight_ids if f in self.flights]
+
+  def flights_in_window(self, departure_airport_id, arrival_airport_id, start, end):
+    route = self._routes.get((departure_airport_id, arrival_airport_id), [])
+    lo = bisect_left(route, (start, ""))
+    hi = bisect_right(route, (end, "\uffff"))
+    return [dict(self.flights[flight_id]) for _, flight_id in route[lo:hi]]
+
+  def free_seats(self, flight_id, travel_class, limit=1):
+    return [dict(self.seats[seat_id]) for _, seat_id in self._free.get((flight_id, travel_class), [])[:limit]]
+
+  def claim_seat(self, flight_id, travel_class):
+    with self._lock:
+      free = self._free.get((flight_id, travel_class))
+      if not free:
+        return None
+      cheapest = bisect_right(free, (free[0][0], float("inf")))
+      _, seat_id = free.pop(random.randrange(cheapest))
+      self.seats[seat_id]["booked"] = True
+      self._counts[flight_id][0] += 1
+      return dict(self.seats[seat_id])
+
+  def insert_booking(self, b):
+    with self._lock:
+      self.bookings[(b.seat_id, b.person_id)] = b.to_dict()
+      self._person_bookings[b.person_id].append((len(self.bookings), b.seat_id))
+
+  def has_booking(self, seat_id, person_id):
+    return (seat_id, person_id) in self.bookings
+
+  def bookings_of(self, person_ids, limit, skip):
+    ordered = sorted(((n, seat_id, person_id) for person_id in set(person_ids) for n, seat_id in self._person_bookings.get(person_id, [])), reverse=True)
+    return [{"seat_id": seat_id, "person_id": person_id} for _, seat_id, person_id in ordered[skip:skip + limit]]
+
+  def person(self, person_id):
+    person = self.persons.get(person_id)
+    return None if person is None else dict(person)
+
+  def insert_person(self, person):
+    with self._lock:
+      self.persons[person.person_id] = person.to_dict()
+      self._passports[person.passport].append(person.person_id)
+      self._next_person_id = max(self._next_person_id, person.person_id + 1)
+
+  def next_person_id(self):
+    with self._lock:
+      person_id = self._next_person_id
+      self._next_person_id += 1
+      return person_id
+
+  def person_ids_for_passport(self, passport):
+    return list(self._passports.get(passport, []))
+
+  def occupancy(self, flight_ids):
+    return {f: self._counts[f][0] / self._counts[f][1] for f in flight_ids if f in self._counts}
+
+
+class SQLiteRepository(FlightRepository):
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS airlines (airline_id INTEGER PRIMARY KEY, name TEXT, logo_url TEXT);
+    CREATE TABLE IF NOT EXISTS airports (airport_id TEXT PRIMARY KEY, city TEXT, country TEXT, keywords TEXT);
+    CREATE TABLE IF NOT EXISTS flights (
+      flight_id TEXT PRIMARY KEY, airline_id INTEGER, departure_airport_id TEXT, arrival_airport_id TEXT,
+      plane TEXT, date TEXT, duration_mins INTEGER);
+    CREATE INDEX IF NOT EXISTS flights_route ON flights (departure_airport_id, arrival_airport_id, date);
+    CREATE INDEX IF NOT EXISTS flights_departure ON flights (departure_airport_id, date);
+    CREATE TABLE IF NOT EXISTS seats (
+      seat_id INTEGER PRIMARY KEY, flight_id TEXT, number TEXT, travel_class INTEGER, price REAL, booked INTEGER);
+    CREATE INDEX IF NOT EXISTS seats_free ON seats (flight_id, travel_class, booked, price);
+    CREATE TABLE IF NOT EXISTS persons (
+      person_id INTEGER PRIMARY KEY, name TEXT, birthdate TEXT, passport TEXT, travel_class INTEGER);
+    CREATE INDEX IF NOT EXISTS persons_passport ON persons (passport);
+    CREATE TABLE IF NOT EXISTS bookings (
+      booking_no INTEGER PRIMARY KEY AUTOINCREMENT, seat_id INTEGER, person_id INTEGER, UNIQUE (seat_id, person_id));
+    CREATE INDEX IF NOT EXISTS bookings_person ON bookings (person_id, booking_no);
+    CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER);
+  """
+  FREE_SEATS = "SELECT * FROM seats WHERE flight_id = ? AND travel_class = ? AND booked = 0"
+
+  def __init__(self, path: str = ":memory:"):
+    self._lock = threading.Lock()
+    self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self.conn.row_factory = sqlite3.Row
+    self.conn.executescript(self.SCHEMA)
+
+  def _all(self, sql: str, args: Iterable[Any] = ()) -> List[sqlite3.Row]:
+    with self._lock:
+      return self.conn.execute(sql, tuple(args)).fetchall()
+
+  def _one(self, sql: str, args: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+    rows = self._all(sql, args)
+    return rows[0] if rows else None
+
+  @staticmethod
+  def _flight(row: sqlite3.Row) -> Dict[str, Any]:
+    return dict(row, date=datetime.fromisoformat(row["date"]))
+
+  @staticmethod
+  def _seat(row: sqlite3.Row) -> Dict[str, Any]:
+    return dict(row, booked=bool(row["booked"]))
+
+  def add(self, airlines, airports, flights, seats):
+    with self._lock:
+      self.conn.execute("BEGIN")
+      self.conn.executemany("INSERT INTO airlines VALUES (?, ?, ?)", [(a.airline_id, a.name, a.logo_url) for a in airlines])
+      self.conn.executemany("INSERT INTO airports VALUES (?, ?, ?, ?)", [(a.airport_id, a.city, a.country, json.dumps(a.keywords)) for a in airports])
+      self.conn.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?, ?, ?)", [
+          (f.flight_id, f.airline_id, f.departure_airport_id, f.arrival_airport_id, f.plane, f.date.isoformat(), f.duration_mins) for f in flights])
+      self.conn.executemany("INSERT INTO seats VALUES (?, ?, ?, ?, ?, ?)", [
+          (s.seat_id, s.flight_id, s.number, s.travel_class, s.price, int(s.booked)) for s in seats])
+      self.conn.execute("COMMIT")
+
+  def all_airlines(self):
+    return [dict(r) for r in self._all("SELECT * FROM airlines")]
+
+  def all_airports(self):
+    return [dict(r, keywords=json.loads(r["keywords"])) for r in self._all("SELECT * FROM airports")]
+
+  def airline(self, airline_id):
+    row = self._one("SELECT * FROM airlines WHERE airline_id = ?", (airline_id,))
+    return None if row is None else dict(row)
+
+  def airport(self, airport_id):
+    row = self._one("SELECT * FROM airports WHERE airport_id = ?", (airport_id,))
+    return None if row is None else dict(row, keywords=json.loads(row["keywords"]))
+
+  def seat(self, seat_id):
+    row = self._one("SELECT * FROM seats WHERE seat_id = ?", (seat_id,))
+    return None if row is None else self._seat(row)
+
+  def flights_by_id(self, flight_ids):
+    return [self._flight(r) for r in self._all(f"SELECT * FROM flights WHERE flight_id IN ({','.join('?' * len(flight_ids))})", flight_ids)]
+
+  def flights_in_window(self, departure_airport_id, arrival_airport_id, start, end):
+    if arrival_airport_id is None:
+      rows = self._all("SELECT * FROM flights WHERE departure_airport_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+                       (departure_airport_id, start.isoformat(), end.isoformat()))
+    else:
+      rows = self._all("SELECT * FROM flights WHERE departure_airport_id = ? AND arrival_airport_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+                       (departure_airport_id, arrival_airport_id, start.isoformat(), end.isoformat()))
+    return [self._flight(r) for r in rows]
+
+  def free_seats(self, flight_id, travel_class, limit=1):
+    return [self._seat(r) for r in self._all(self.FREE_SEATS + " ORDER BY price LIMIT ?", (flight_id, travel_class, limit))]
+
+  def claim_seat(self, flight_id, travel_class):
+    with self._lock:
+      self.conn.execute("BEGIN IMMEDIATE")
+      try:
+        row = self.conn.execute(
+            self.FREE_SEATS + " AND price = (SELECT MIN(price) FROM seats WHERE flight_id = ? AND travel_class = ? AND booked = 0) ORDER BY RANDOM() LIMIT 1",
+            (flight_id, travel_class, flight_id, travel_class)).fetchone()
+        if row is not None:
+          self.conn.execute("UPDATE seats SET booked = 1 WHERE seat_id = ?", (row["seat_id"],))
+        self.conn.execute("COMMIT")
+      except BaseException:
+        self.conn.execute("ROLLBACK")
+        raise
+    return None if row is None else dict(self._seat(row), booked=True)
+
+  def insert_booking(self, b):
+    self._all("INSERT INTO bookings (seat_id, person_id) VALUES (?, ?)", (b.seat_id, b.person_id))
+
+  def has_booking(self, seat_id, person_id):
+    return self._one("SELECT 1 FROM bookings WHERE seat_id = ? AND person_id = ?", (seat_id, person_id)) is not None
+
+  def bookings_of(self, person_ids, limit, skip):
+    return [dict(r) for r in self._all(
+        f"SELECT seat_id, person_id FROM bookings WHERE person_id IN ({','.join('?' * len(person_ids))}) ORDER BY booking_no DESC LIMIT ? OFFSET ?",
+        list(person_ids) + [limit, skip])]
+
+  def person(self, person_id):
+    row = self._one("SELECT * FROM persons WHERE person_id = ?", (person_id,))
+    return None if row is None else dict(row, birthdate=datetime.fromisoformat(row["birthdate"]))
+
+  def insert_person(self, person):
+    self._all("INSERT INTO persons VALUES (?, ?, ?, ?, ?)",
+              (person.person_id, person.name, person.birthdate.isoformat(), person.passport, person.travel_class))
+
+  def next_person_id(self):
+    with self._lock:
+      self.conn.execute("BEGIN IMMEDIATE")
+      self.conn.execute("INSERT OR IGNORE INTO sequences SELECT 'person_id', COALESCE(MAX(person_id) + 1, 0) FROM persons")
+      person_id = self.conn.execute("SELECT value FROM sequences WHERE name = 'person_id'").fetchone()[0]
+      self.conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'person_id'")
+      self.conn.execute("COMMIT")
+    return person_id
+
+  def person_ids_for_passport(self, passport):
+    return [r[0] for r in self._all("SELECT person_id FROM persons WHERE passport = ?", (passport,))]
+
+  def occupancy(self, flight_ids):
+    rows = self._all(f"SELECT flight_id, AVG(booked) FROM seats WHERE flight_id IN ({','.join('?' * len(flight_ids))}) GROUP BY flight_id", flight_ids)
+    return {flight_id: occupancy for flight_id, occupancy in rows}
+
+
+def create_repository(config: Mapping[str, Any]) -> FlightRepository:
+  backend = config.get("REPOSITORY", "mongo")
+  if backend == "memory":
+    return InMemoryRepository()
+  if backend == "sqlite":
+    return SQLiteRepository(config.get("SQLITE_PATH", ":memory:"))
+  if backend == "mongo":
+    return MongoRepository(mongo)
+  raise ValueError(f"Unknown repository {backend}.")
+
+
+def benchmark(repository: FlightRepository, flights: List[Flight], operations: int) -> Dict[str, float]:
+  """Average microseconds per call of every operation."""
+  rng = random.Random(0)
+  picks = [rng.choice(flights) for _ in range(operations)]
+  timings = {}
+
+  def timed(name, fn):
+    start = time.perf_counter()
+    for f in picks:
+      fn(f)
+    timings[name] = (time.perf_counter() - start) / operations * 1e6
+
+  def day(f):
+    return f.date.replace(hour=0, minute=0), f.date.replace(hour=23, minute=59)
+
+  timed("flights_in_window", lambda f: repository.flights_in_window(f.departure_airport_id, f.arrival_airport_id, *day(f)))
+  timed("free_seats", lambda f: repository.free_seats(f.flight_id, 2))
+  timed("occupancy", lambda f: repository.occupancy([f.flight_id]))
+  timed("search_seats", lambda f: repository.search_seats(f.departure_airport_id, f.arrival_airport_id, *day(f), 2, SearchFilters()))
+  timed("claim_seat+insert_booking", lambda f: repository.book_seat(f.flight_id, 2, 0))
+  return timings
+
+
+def main():
+  from .dataset import generate_dataset
+
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--backends", default="memory,sqlite", help="Comma separated, out of memory, sqlite and mongo.")
+  parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/flightsBenchmark", help="Scratch database for the mongo backend.")
+  parser.add_argument("--operations", type=int, default=2000)
+  args = parser.parse_args()
+
+  dataset = generate_dataset()
+  flights = dataset["flights"]
+  seats = [s for flight_seats in dataset["seats"].values() for s in flight_seats.values()]
+  print(f"{len(flights)} flights, {len(seats)} seats, {args.operations} operations each.")
+
+  for backend in args.backends.split(","):
+    if backend == "mongo":
+      import pymongo
+      from .dataset import create_indexes, drop_collections
+      db = pymongo.MongoClient(args.mongo_uri).get_default_database()
+      drop_collections(db)
+      create_indexes(db)
+      repository = MongoRepository(db)
+    else:
+      repository = create_repository({"REPOSITORY": backend})
+    start = time.perf_counter()
+    repository.add(dataset["airlines"], dataset["airports"], flights, seats)
+    print(f"\n{backend}: loaded in {time.perf_counter() - start:.2f}s")
+    for name, micros in benchmark(repository, flights, args.operations).items():
+      print(f"  {name:<28} {micros:>10.1f} us/op")
+
+
+if __name__ == "__main__":
+  main()
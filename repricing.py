@@ -0,0 +1,81 @@
+"""Reprices all unbooked seats from occupancy and days to departure.
+
+Run with `python -m <package>.repricing`. Fares are always derived from the
+seat's `base_price` (its price at generation time), so repeated passes don't
+compound.
+"""
+from typing import Any, List
+from datetime import datetime
+import argparse
+import time
+
+import numpy as np
+from pymongo import UpdateMany
+
+from .analytics import BATCH_SIZE, load_seats
+from .database import mongo
+from .fares import rebuild_cheapest_fares
+
+# A full flight costs this much more than an empty one.
+OCCUPANCY_SURCHARGE = 0.6
+# Surcharge reached on the day of departure, ramping up over LAST_MINUTE_DAYS.
+LAST_MINUTE_SURCHARGE = 0.3
+LAST_MINUTE_DAYS = 14
+# Discount for flights departing more than EARLY_BIRD_DAYS from now.
+EARLY_BIRD_DISCOUNT = 0.1
+EARLY_BIRD_DAYS = 60
+WRITE_BATCH_SIZE = 1000
+
+
+def fares(base_price: np.ndarray, occupancy: np.ndarray, days_to_departure: np.ndarray) -> np.ndarray:
+  occupancy_factor = 1.0 + OCCUPANCY_SURCHARGE * occupancy ** 2
+  last_minute = np.clip((LAST_MINUTE_DAYS - days_to_departure) / LAST_MINUTE_DAYS, 0.0, 1.0)
+  time_factor = 1.0 + LAST_MINUTE_SURCHARGE * last_minute
+  time_factor = np.where(days_to_departure > EARLY_BIRD_DAYS, 1.0 - EARLY_BIRD_DISCOUNT, time_factor)
+  return np.round(base_price * occupancy_factor * time_factor, 2)
+
+
+def reprice(db: Any, now: datetime) -> int:
+  # Seats generated before repricing existed only have their original price.
+  db.seats.update_many({"base_price": {"$exists": False}}, [{"$set": {"base_price": "$price"}}])
+
+  flights = list(db.flights.find({"date": {"$gt": now}}, {"_id": 0, "flight_id": 1, "date": 1}).batch_size(BATCH_SIZE))
+  if not flights:
+    return 0
+  flight_ids = np.array([f["flight_id"] for f in flights], dtype=object)
+  days_to_departure = np.array([(f["date"] - now).total_seconds() / 86400.0 for f in flights])
+  flight, travel_class, base_price, booked = load_seats(
+      db, {f["flight_id"]: i for i, f in enumerate(flights)}, price_field="base_price")
+
+  occupancy = np.bincount(flight, weights=booked, minlength=len(flights)) / np.maximum(np.bincount(flight, minlength=len(flights)), 1)
+  free = ~booked
+  # All free seats of a flight with the same class and base price get the same
+  # fare, so one UpdateMany per group covers them.
+  groups = np.unique(np.stack([flight[free], travel_class[free].astype(np.int64), base_price[free]], axis=1), axis=0)
+  group_flight = groups[:, 0].astype(np.int64)
+  new_prices = fares(groups[:, 2], occupancy[group_flight], days_to_departure[group_flight])
+
+  requests: List[UpdateMany] = [UpdateMany(
+      {"flight_id": flight_ids[f], "travel_class": int(c), "base_price": b, "booked": False},
+      {"$set": {"price": p}}) for f, c, b, p in zip(group_flight.tolist(), groups[:, 1].tolist(), groups[:, 2].tolist(), new_prices.tolist())]
+  # Small unordered batches keep each write short, bookings interleave freely.
+  for i in range(0, len(requests), WRITE_BATCH_SIZE):
+    db.seats.bulk_write(requests[i:i + WRITE_BATCH_SIZE], ordered=False)
+  return len(requests)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--now", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), default=datetime.utcnow(),
+                      help="Reprice as of this date (YYYY-MM-DD), defaults to today.")
+  args = parser.parse_args()
+
+  start = time.time()
+  groups = reprice(mongo.db, args.now)
+  print(f"Repriced {groups} fare groups in {time.time() - start:.2f}s.")
+  rebuild_cheapest_fares(mongo.db)
+  print(f"Finished in {time.time() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,123 @@
+"""Concurrency stress test for booking against a local mongod.
+
+Run with `python -m <package>.stress [--mode threads|processes]`. Every
+concurrency level starts from a fresh scratch database with a few small, hot
+flights, fires booking attempts through POST /api/v1/book and then checks the
+booking invariants. Never point --mongo-uri at a database you want to keep.
+"""
+from typing import Any, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import multiprocessing
+import random
+import time
+
+import pymongo
+
+from .dataset import check_insert_many, create_indexes, drop_collections
+from .fares import rebuild_cheapest_fares
+from .objects import Airline, Airport, Flight, Seat
+
+DEFAULT_MONGO_URI = "mongodb://localhost:27017/flightsStress"
+
+
+def setup(db: Any, flights: int, seats_per_flight: int) -> List[str]:
+  drop_collections(db)
+  create_indexes(db)
+  check_insert_many(db.airlines, [Airline(0, "Stress", "")])
+  check_insert_many(db.airports, [Airport("AAA", "A", "A", []), Airport("BBB", "B", "B", [])])
+  date = datetime.utcnow() + timedelta(days=1)
+  hot_flights = [Flight(f"AAA_BBB_Stress_{i}", 0, "AAA", "BBB", "Stress", date + timedelta(hours=i), 60) for i in range(flights)]
+  check_insert_many(db.flights, hot_flights)
+  check_insert_many(db.seats, [
+      Seat(i * seats_per_flight + j, f.flight_id, str(j), 2, 100, False)
+      for i, f in enumerate(hot_flights) for j in range(seats_per_flight)])
+  rebuild_cheapest_fares(db)
+  return [f.flight_id for f in hot_flights]
+
+
+def run_attempts(mongo_uri: str, flight_ids: List[str], attempts: int, threads: int) -> List[Tuple[str, int]]:
+  """Returns the (flight_id, HTTP status) of every attempt."""
+  # Imported here so spawned worker processes build their own app and client.
+  from .main import create_app
+  app = create_app({"MONGO_URI": mongo_uri})
+
+  def attempt(i: int) -> Tuple[str, int]:
+    flight_id = random.choice(flight_ids)
+    with app.test_client() as client:
+      return flight_id, client.post("/api/v1/book", json={
+          "flight_id": flight_id,
+          "travel_class": 2,
+          "name": f"Stress {i}",
+          "birthdate": "1990-01-01",
+          "passport": str(i),
+      }).status_code
+
+  with ThreadPoolExecutor(max_workers=threads) as pool:
+    return list(pool.map(attempt, range(attempts)))
+
+
+def check_invariants(db: Any, booked: int) -> List[str]:
+  violations = []
+  for d in db.bookings.aggregate([{"$group": {"_id": "$seat_id", "n": {"$sum": 1}}}, {"$match": {"n": {"$gt": 1}}}]):
+    violations.append(f"Seat {d['_id']} booked {d['n']} times.")
+  booked_seats = {s["seat_id"] for s in db.seats.find({"booked": True}, {"seat_id": 1})}
+  booking_seats = {b["seat_id"] for b in db.bookings.find({}, {"seat_id": 1})}
+  for seat_id in booked_seats - booking_seats:
+    violations.append(f"Seat {seat_id} is booked without a booking.")
+  for seat_id in booking_seats - booked_seats:
+    violations.append(f"Seat {seat_id} has a booking but isn't booked.")
+  for d in db.persons.aggregate([{"$group": {"_id": "$person_id", "n": {"$sum": 1}}}, {"$match": {"n": {"$gt": 1}}}]):
+    violations.append(f"Person id {d['_id']} used {d['n']} times.")
+  if len(booking_seats) != booked:
+    violations.append(f"{booked} successful bookings reported, {len(booking_seats)} stored.")
+  return violations
+
+
+def run_level(args: Any, db: Any, concurrency: int) -> bool:
+  flight_ids = setup(db, args.flights, args.seats)
+  start = time.time()
+  if args.mode == "threads":
+    results = run_attempts(args.mongo_uri, flight_ids, args.attempts, concurrency)
+  else:
+    # Each process runs its share of the attempts on a single thread.
+    shares = [args.attempts // concurrency + (i < args.attempts % concurrency) for i in range(concurrency)]
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn")) as pool:
+      results = [r for rs in pool.map(run_attempts, [args.mongo_uri] * concurrency, [flight_ids] * concurrency, shares, [1] * concurrency) for r in rs]
+  elapsed = time.time() - start
+
+  booked = sum(status == 201 for _, status in results)
+  rejected = [flight_id for flight_id, status in results if status == 409]
+  errors = len(results) - booked - len(rejected)
+  # A rejection on a flight that still has free seats left was a lost race,
+  # not a sell out.
+  has_free_seats = {s["flight_id"] for s in db.seats.find({"booked": False}, {"flight_id": 1})}
+  conflicts = sum(flight_id in has_free_seats for flight_id in rejected)
+
+  violations = check_invariants(db, booked)
+  print(f"{concurrency:>11} {booked / elapsed:>12.1f} {len(rejected) / len(results):>13.1%} {conflicts / len(results):>13.1%} {errors:>6} {len(violations):>10}")
+  for v in violations[:20]:
+    print("  " + v)
+  return not violations
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--mongo-uri", default=DEFAULT_MONGO_URI, help="Scratch database, it is dropped on every level.")
+  parser.add_argument("--mode", choices=["threads", "processes"], default="threads")
+  parser.add_argument("--concurrency", default="1,4,16,64", help="Comma separated concurrency levels.")
+  parser.add_argument("--attempts", type=int, default=2000, help="Booking attempts per level.")
+  parser.add_argument("--flights", type=int, default=3)
+  parser.add_argument("--seats", type=int, default=400, help="Seats per flight.")
+  args = parser.parse_args()
+
+  db = pymongo.MongoClient(args.mongo_uri).get_default_database()
+  print(f"{args.attempts} attempts on {args.flights} flights with {args.seats} seats each, {args.mode}.")
+  print("concurrency bookings/sec rejected rate conflict rate errors violations")
+  ok = all([run_level(args, db, int(c)) for c in args.concurrency.split(",")])
+  raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,55 @@
+import datetime
+import importlib
+import os
+import sys
+
+import pytest
+
+# The repository root is itself the package, import it by its directory name.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+PACKAGE = os.path.basename(REPO_DIR)
+
+
+def load(module: str):
+  return importlib.import_module(f"{PACKAGE}.{module}")
+
+
+@pytest.fixture
+def pkg():
+  return load
+
+
+@pytest.fixture
+def mongo_app(pkg, monkeypatch):
+  mongomock = pytest.importorskip("mongomock")
+  database = pkg("database")
+  booking = pkg("booking")
+  app = pkg("main").create_app({"MONGO_URI": "mongodb://localhost/flightsTest", "SLOW_QUERY_MS": 0})
+  monkeypatch.setattr(database.mongo, "_client", mongomock.MongoClient("mongodb://localhost/flightsTest"))
+  monkeypatch.setattr(database.mongo, "_pid", os.getpid())
+  # Capped collections and $lookup sub-pipelines are not supported by mongomock.
+  monkeypatch.setattr(booking, "append_booking_event", lambda *args: None)
+  monkeypatch.setattr(booking, "on_seat_booked", lambda *args: None)
+
+  db = database.mongo.db
+  db.airlines.insert_one({"airline_id": 0, "name": "Test Air", "logo_url": "https://example.com/logo.png"})
+  db.airports.insert_many([
+      {"airport_id": "AAA", "city": "A", "country": "X", "keywords": []},
+      {"airport_id": "BBB", "city": "B", "country": "X", "keywords": []},
+  ])
+  db.flights.insert_one({"flight_id": "AAA_BBB_0", "airline_id": 0, "departure_airport_id": "AAA", "arrival_airport_id": "BBB",
+                         "plane": "Test", "date": datetime.datetime(2030, 1, 1, 10), "duration_mins": 60})
+  db.seats.insert_many([{"seat_id": i, "flight_id": "AAA_BBB_0", "number": f"{i}A", "travel_class": 2, "price": 100, "booked": False} for i in range(3)])
+  db.persons.insert_one({"person_id": 7, "name": "Jane Doe", "birthdate": datetime.datetime(1990, 1, 1), "passport": "123", "travel_class": 2})
+  return app
+
+
+@pytest.fixture
+def mongomock_bulk(monkeypatch):
+  """Lets mongomock run the bulk writes of newer pymongo versions."""
+  mongomock = pytest.importorskip("mongomock")
+  builder = mongomock.collection.BulkOperationBuilder
+  for name in ("add_update", "add_replace"):
+    add = getattr(builder, name)
+    monkeypatch.setattr(builder, name, lambda self, *args, sort=None, add=add, **kwargs: add(self, *args, **kwargs))
@@ -0,0 +1,29 @@
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+
+def test_limiter_sheds_beyond_the_queue(pkg):
+  limiter = pkg("admission").AdmissionLimiter(1, 0, 0.01, 3)
+  assert limiter.acquire()
+  assert not limiter.try_acquire()
+  with pytest.raises(ServiceUnavailable) as e:
+    limiter.acquire_or_shed()
+  assert e.value.retry_after == 3 and limiter.shed == 1
+  limiter.release()
+  with limiter.admitted():
+    assert limiter.in_flight == 1
+  assert limiter.in_flight == 0
+
+
+def test_queued_search_times_out(pkg):
+  limiter = pkg("admission").AdmissionLimiter(1, 1, 0.01, 1)
+  assert limiter.acquire()
+  assert not limiter.acquire()
+  assert (limiter.queued, limiter.shed) == (0, 1)
+
+
+def test_server_threads_must_leave_room_for_bookings(pkg):
+  create_app = pkg("main").create_app
+  with pytest.raises(ValueError):
+    create_app({"REPOSITORY": "memory", "SERVER_THREADS": 12, "SEARCH_MAX_IN_FLIGHT": 4, "SEARCH_MAX_QUEUE": 8})
+  create_app({"REPOSITORY": "memory", "SERVER_THREADS": 14, "SEARCH_MAX_IN_FLIGHT": 4, "SEARCH_MAX_QUEUE": 8})
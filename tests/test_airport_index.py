@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def index(pkg):
+  Airport = pkg("objects").Airport
+  return pkg("airport_index").AirportIndex([
+      Airport("ZRH", "Zurich", "Switzerland", ["Kloten"]),
+      Airport("VIE", "Vienna", "Austria", ["Schwechat", "Wien"]),
+      Airport("JFK", "New York City", "United States of America", ["Kennedy"]),
+      Airport("ZAG", "Zagreb", "Croatia", []),
+  ])
+
+
+def test_complete_matches_codes_cities_keywords_and_words(index):
+  assert [a.airport_id for a in index.complete("z")] == ["ZAG", "ZRH"]
+  assert [a.airport_id for a in index.complete("york")] == ["JFK"]
+  assert [a.airport_id for a in index.complete("Zürich")] == ["ZRH"]
+  assert [a.airport_id for a in index.complete("wien")] == ["VIE"]
+  assert index.complete("") == [] and index.complete("x") == []
+  assert len(index.complete("z", limit=1)) == 1
+
+
+def test_codes_rank_before_cities(pkg, index):
+  Airport = pkg("objects").Airport
+  index.rebuild([Airport("VIE", "Vienna", "Austria", []), Airport("VNO", "Vilnius", "Lithuania", ["Vienna Road"])])
+  assert [a.airport_id for a in index.complete("vie")] == ["VIE", "VNO"]
+
+
+def test_resolve(index):
+  assert index.resolve("zrh") == "ZRH"
+  assert index.resolve("Kloten") == "ZRH"
+  assert index.resolve("z") is None  # Ambiguous.
+  assert index.resolve("nowhere") is None
+
+
+def test_autocomplete_route(pkg):
+  app = pkg("main").create_app({"REPOSITORY": "memory"})
+  objects = pkg("objects")
+  app.extensions["repository"].add([], [objects.Airport("ZRH", "Zurich", "Switzerland", ["Kloten"])], [], [])
+  response = app.test_client().get("/airports/autocomplete", query_string={"q": "klo"})
+  assert response.get_json() == [{"airport_id": "ZRH", "city": "Zurich", "country": "Switzerland"}]
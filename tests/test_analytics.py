@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_load_seats_grows_from_a_zero_estimate(pkg, monkeypatch):
+  db = mongomock.MongoClient().analyticsTest
+  db.seats.insert_many([{"flight_id": "AAA_BBB_0", "travel_class": 2, "price": 100.0 + i, "booked": i == 0} for i in range(3)])
+  # The estimate comes from collection metadata and can lag behind inserts.
+  monkeypatch.setattr(type(db.seats), "estimated_document_count", lambda self, **kwargs: 0)
+  flight, travel_class, price, booked = pkg("analytics").load_seats(db, {"AAA_BBB_0": 0})
+  assert list(flight) == [0, 0, 0] and list(price) == [100.0, 101.0, 102.0] and list(booked) == [True, False, False]
+
+
+def booking_db(pkg, monkeypatch):
+  monkeypatch.setattr(pkg("events"), "READ_LAG", datetime.timedelta(seconds=-5))
+  db = mongomock.MongoClient().analyticsTest
+  db.flights.insert_one({"flight_id": "AAA_BBB_0", "airline_id": 0, "departure_airport_id": "AAA", "arrival_airport_id": "BBB",
+                         "date": datetime.datetime(2030, 1, 1, 10)})
+  db.seats.insert_many([{"seat_id": i, "flight_id": "AAA_BBB_0", "travel_class": 2, "price": 100.0, "booked": i == 0} for i in range(3)])
+  return db
+
+
+def book(pkg, db, seat_id, price):
+  db.seats.update_one({"seat_id": seat_id}, {"$set": {"booked": True}})
+  db.booking_events.insert_one(pkg("events").booking_event(
+      {"seat_id": seat_id, "flight_id": "AAA_BBB_0", "price": price, "travel_class": 2}, 7))
+
+
+def test_daily_report_counts_bookings_from_the_event_log(pkg, monkeypatch, mongomock_bulk):
+  analytics = pkg("analytics")
+  db = booking_db(pkg, monkeypatch)
+  # The first run has no checkpoint and starts from the booked seats.
+  [row] = analytics.daily_report(db)
+  assert (row["seats"], row["booked"], row["revenue"]) == (3, 1, 100.0)
+
+  book(pkg, db, 1, 150.0)
+  # Repricing the free seat changes the fares but not what was sold.
+  db.seats.update_one({"seat_id": 2}, {"$set": {"price": 300.0}})
+  [row] = analytics.daily_report(db)
+  assert (row["booked"], row["revenue"], row["fare_sum"]) == (2, 250.0, 500.0)
+  assert analytics.fold_booking_events(db) == 0
+
+
+def test_fold_booking_events_rebuilds_after_the_log_wrapped(pkg, monkeypatch, mongomock_bulk):
+  analytics = pkg("analytics")
+  db = booking_db(pkg, monkeypatch)
+  book(pkg, db, 1, 100.0)
+  assert analytics.fold_booking_events(db) == 0  # Rebuilt from the seats, already counted.
+  book(pkg, db, 2, 100.0)
+  # The capped log dropped everything up to and including the checkpoint.
+  db.booking_events.delete_many({})
+  analytics.fold_booking_events(db)
+  assert [t["booked"] for t in db.report_bookings.find({})] == [3]
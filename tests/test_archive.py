@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture(autouse=True)
+def plain_collections(monkeypatch):
+  # mongomock has no storage engine options, archive collections are created plain.
+  create_collection = mongomock.database.Database.create_collection
+  monkeypatch.setattr(mongomock.database.Database, "create_collection", lambda self, name, **kwargs: create_collection(self, name))
+
+
+def test_archive_departed_moves_flights_seats_and_bookings(pkg, mongo_app, mongomock_bulk):
+  db = pkg("database").mongo.db
+  db.bookings.insert_one({"seat_id": 0, "person_id": 7})
+  assert pkg("archive").archive_departed(db, datetime.datetime(2030, 1, 2)) == 1
+  assert db.flights.count_documents({}) == db.seats.count_documents({}) == db.bookings.count_documents({}) == 0
+  assert [f["flight_id"] for f in db.archive_flights.find({})] == ["AAA_BBB_0"]
+  assert db.archive_seats.count_documents({}) == 3
+  assert list(db.archive_bookings.find({}, {"_id": 0})) == [{"seat_id": 0, "person_id": 7}]
+  # A rerun finds nothing left to move.
+  assert pkg("archive").archive_departed(db, datetime.datetime(2030, 1, 2)) == 0
+
+
+def test_boarding_pass_of_archived_booking(pkg, mongo_app, mongomock_bulk):
+  db = pkg("database").mongo.db
+  db.seats.update_one({"seat_id": 0}, {"$set": {"booked": True}})
+  db.bookings.insert_one({"seat_id": 0, "person_id": 7})
+  pkg("archive").archive_departed(db, datetime.datetime(2030, 1, 2))
+  response = mongo_app.test_client().get("/boarding_pass/0/7")
+  assert response.status_code == 200 and b"Jane Doe" in response.data
+
+
+def test_trips_include_archived_bookings(pkg, mongo_app):
+  db = pkg("database").mongo.db
+  db.archive_flights.insert_one({"flight_id": "AAA_BBB_OLD", "airline_id": 0, "departure_airport_id": "AAA", "arrival_airport_id": "BBB",
+                                 "plane": "Test", "date": datetime.datetime(2020, 1, 1, 10), "duration_mins": 60})
+  db.archive_seats.insert_one({"seat_id": 99, "flight_id": "AAA_BBB_OLD", "number": "99Z", "travel_class": 2, "price": 100, "booked": True})
+  db.archive_bookings.insert_one({"seat_id": 99, "person_id": 7})
+  client = mongo_app.test_client()
+  assert client.get("/book/AAA_BBB_0/2/7").status_code == 200
+  response = client.get("/trips?passport=123")
+  assert response.status_code == 200
+  assert response.data.count(b"Boarding pass") == 2 and b"99Z" in response.data
+
+
+def test_daily_report_includes_archived_flights(pkg, mongo_app, mongomock_bulk):
+  pytest.importorskip("numpy")
+  db = pkg("database").mongo.db
+  db.seats.update_one({"seat_id": 0}, {"$set": {"booked": True}})
+  pkg("archive").archive_departed(db, datetime.datetime(2030, 1, 2))
+  [row] = pkg("analytics").daily_report(db)
+  assert (row["day"], row["seats"], row["booked"], row["revenue"]) == (datetime.datetime(2030, 1, 1), 3, 1, 100)
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+class RacingSeats:
+  """Seats collection where other bookings land right before each claim."""
+
+  def __init__(self, seats, taken_before_claim):
+    self._seats = seats
+    self._taken = list(taken_before_claim)
+
+  def find_one_and_update(self, *args, **kwargs):
+    if self._taken:
+      self._seats.update_many({"seat_id": {"$in": self._taken.pop(0)}}, {"$set": {"booked": True}})
+    return self._seats.find_one_and_update(*args, **kwargs)
+
+  def __getattr__(self, name):
+    return getattr(self._seats, name)
+
+
+class RacingDatabase:
+  def __init__(self, taken_before_claim):
+    db = mongomock.MongoClient().bookingTest
+    db.seats.insert_many([{"seat_id": i, "flight_id": "F", "travel_class": 2, "price": price, "booked": False}
+                          for i, price in enumerate([100, 100, 200])])
+    self.seats = RacingSeats(db.seats, taken_before_claim)
+
+
+def test_claim_takes_another_seat_at_the_same_price_after_losing_a_race(pkg):
+  db = RacingDatabase([[0]])
+  # Seat 0 goes to another booking; when it was the sampled one, the claim
+  # falls back to seat 1 at the same price.
+  seat = pkg("booking").claim_seat(db, "F", 2)
+  assert (seat["seat_id"], seat["price"]) == (1, 100)
+  assert db.seats.count_documents({"booked": True}) == 2
+
+
+def test_claim_moves_to_the_next_price_when_the_cheapest_sells_out(pkg):
+  db = RacingDatabase([[0, 1], []])
+  seat = pkg("booking").claim_seat(db, "F", 2)
+  assert (seat["seat_id"], seat["price"]) == (2, 200)
+  assert pkg("booking").claim_seat(db, "F", 2) is None
+
+
+def test_sold_out_booking_shows_the_failure_page(pkg):
+  app = pkg("main").create_app({"REPOSITORY": "memory"})
+  objects = pkg("objects")
+  repository = app.extensions["repository"]
+  repository.add([objects.Airline(0, "Test Air", "")], [objects.Airport(a, a, "X", []) for a in ("AAA", "BBB")],
+                 [objects.Flight("AAA_BBB_0", 0, "AAA", "BBB", "Test", datetime.datetime(2030, 1, 1), 60)],
+                 [objects.Seat(0, "AAA_BBB_0", "1A", 2, 100, False)])
+  person = objects.Person(repository.next_person_id(), "Jane Doe", datetime.datetime(1990, 1, 1), "P-1", 2)
+  repository.insert_person(person)
+  client = app.test_client()
+  assert b"Boarding pass" in client.get(f"/book/AAA_BBB_0/2/{person.person_id}").data
+  assert b"Seat booking failed" in client.get(f"/book/AAA_BBB_0/2/{person.person_id}").data
@@ -0,0 +1,56 @@
+import threading
+import types
+
+import pytest
+
+
+def test_lru_cache_evicts_least_recently_used(pkg):
+  cache = pkg("cache").LRUCache(maxsize=2)
+  cache.put("a", 1)
+  cache.put("b", 2)
+  assert cache.get("a") == 1
+  cache.put("c", 3)
+  assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_single_flight_runs_concurrent_calls_once(pkg):
+  searches = pkg("cache").SingleFlight(ttl=60, maxsize=10)
+  started, release = threading.Event(), threading.Event()
+  calls = []
+
+  def search():
+    calls.append(1)
+    started.set()
+    release.wait(5)
+    return ["result"]
+
+  results = []
+  leader = threading.Thread(target=lambda: results.append(searches.do("key", search)))
+  leader.start()
+  started.wait(5)
+  followers = [threading.Thread(target=lambda: results.append(searches.do("key", search))) for _ in range(4)]
+  for t in followers:
+    t.start()
+  release.set()
+  for t in [leader] + followers:
+    t.join(5)
+  assert len(calls) == 1 and len(results) == 5 and all(r is results[0] for r in results)
+  # Kept for the ttl afterwards.
+  assert searches.do("key", lambda: ["other"]) is results[0]
+
+
+def test_single_flight_never_keeps_failures(pkg):
+  searches = pkg("cache").SingleFlight(ttl=60, maxsize=10)
+  with pytest.raises(ZeroDivisionError):
+    searches.do("key", lambda: 1 / 0)
+  assert searches.do("key", lambda: 2) == 2
+
+
+def test_single_flight_results_expire(pkg, monkeypatch):
+  cache = pkg("cache")
+  now = [100.0]
+  monkeypatch.setattr(cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+  searches = cache.SingleFlight(ttl=5, maxsize=10)
+  assert searches.do("key", lambda: 1) == 1
+  now[0] += 6
+  assert searches.do("key", lambda: 2) == 2
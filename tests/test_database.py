@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def clients(pkg, monkeypatch):
+  created = []
+  def client(uri, **kwargs):
+    created.append((uri, kwargs))
+    return object()
+  monkeypatch.setattr(pkg("database").pymongo, "MongoClient", client)
+  return created
+
+
+def test_client_is_created_on_first_use(pkg, clients):
+  lazy = pkg("database").LazyMongo({"MONGO_URI": "mongodb://db.example/flights", "MONGO_MAX_POOL_SIZE": 7})
+  assert clients == []
+  assert lazy.client is lazy.client
+  assert clients == [("mongodb://db.example/flights", {"maxPoolSize": 7, "minPoolSize": 0, "connect": False})]
+
+
+def test_forked_process_gets_its_own_client(pkg, clients, monkeypatch):
+  database = pkg("database")
+  lazy = database.LazyMongo()
+  parent = lazy.client
+  monkeypatch.setattr(database.os, "getpid", lambda: -1)
+  assert lazy.client is not parent and len(clients) == 2
+
+
+def test_create_app_does_not_connect(pkg, clients, monkeypatch):
+  database = pkg("database")
+  monkeypatch.setattr(database.mongo, "_client", None)
+  app = pkg("main").create_app({"MONGO_URI": "mongodb://db.example/flights"})
+  assert clients == [] and app.extensions["mongo"] is database.mongo
+
+
+def test_next_sequence_continues_after_the_maximum(pkg):
+  mongomock = pytest.importorskip("mongomock")
+  database = pkg("database")
+  db = mongomock.MongoClient().databaseTest
+  db.seats.insert_many([{"seat_id": 4}, {"seat_id": 9}])
+  assert database.next_seat_id(db, 3) == 10
+  assert database.next_seat_id(db) == 13
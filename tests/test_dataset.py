@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+DAY = datetime.datetime(2030, 1, 1)
+
+
+@pytest.fixture
+def db(pkg, monkeypatch, mongomock_bulk):
+  dataset = pkg("dataset")
+  db = mongomock.MongoClient().datasetTest
+  # mongomock has neither capped collections nor $lookup sub-pipelines.
+  monkeypatch.setattr(db, "create_collection", lambda name, **kwargs: None)
+  monkeypatch.setattr(dataset, "refresh_cheapest_fares", lambda *args: None)
+  db.persons.insert_one({"person_id": 1000, "name": "Jane Doe", "birthdate": datetime.datetime(1990, 1, 1), "passport": "P-1", "travel_class": 2})
+  db.seats.insert_one({"seat_id": 5000, "flight_id": "OLD", "number": "1A", "travel_class": 2, "price": 10.0, "booked": True})
+  db.bookings.insert_one({"seat_id": 5000, "person_id": 1000})
+  return db
+
+
+def snapshot(db):
+  return {name: sorted((sorted(d.items()) for d in db[name].find({}, {"_id": 0})), key=repr)
+          for name in ("flights", "seats", "persons", "bookings")}
+
+
+def test_top_up_is_idempotent_and_continues_ids(pkg, db):
+  dataset = pkg("dataset")
+  dataset.top_up_db(db, [DAY])
+  assert db.flights.count_documents({}) > 0
+  assert db.seats.find_one({"seat_id": 5000})["booked"] and db.bookings.count_documents({"seat_id": 5000, "person_id": 1000}) == 1
+  assert min(s["seat_id"] for s in db.seats.find({"flight_id": {"$ne": "OLD"}})) == 5001
+  assert min(p["person_id"] for p in db.persons.find({"person_id": {"$ne": 1000}})) == 1001
+  new_bookings = db.bookings.count_documents({}) - 1
+  assert db.seats.count_documents({"booked": True}) - 1 == new_bookings == db.booking_events.count_documents({})
+
+  before = snapshot(db)
+  dataset.top_up_db(db, [DAY])
+  assert snapshot(db) == before
+
+
+def test_top_up_skips_archived_flights(pkg, db):
+  dataset = pkg("dataset")
+  dataset.top_up_db(db, [DAY])
+  flight = db.flights.find_one({}, {"_id": 0})
+  db.archive_flights.insert_one(dict(flight))
+  db.flights.delete_one({"flight_id": flight["flight_id"]})
+  db.seats.delete_many({"flight_id": flight["flight_id"]})
+  dataset.top_up_db(db, [DAY])
+  assert db.flights.find_one({"flight_id": flight["flight_id"]}) is None
+  assert db.seats.count_documents({"flight_id": flight["flight_id"]}) == 0
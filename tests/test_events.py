@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_first_event_creates_capped_collection(pkg, monkeypatch):
+  events = pkg("events")
+  db = mongomock.MongoClient().eventsTest
+  created = []
+  # mongomock has no capped collections, record what would be created.
+  monkeypatch.setattr(db, "create_collection", lambda name, **kwargs: created.append((name, kwargs)))
+  monkeypatch.setattr(events, "_ensured", set())
+  monkeypatch.setattr(events, "READ_LAG", datetime.timedelta(seconds=-5))
+  seat = {"seat_id": 1, "flight_id": "AAA_BBB_0", "price": 100, "travel_class": 2}
+  events.append_booking_event(db, seat, 7)
+  events.append_booking_event(db, seat, 8)
+  assert created == [("booking_events", {"capped": True, "size": events.BOOKING_EVENTS_SIZE})]
+  assert [e["person_id"] for e in events.read_booking_events(db)] == [7, 8]
+
+
+def test_events_endpoint_is_off_by_default(pkg):
+  app = pkg("main").create_app({"REPOSITORY": "memory"})
+  assert app.test_client().get("/api/v1/events").status_code == 404
+
+
+def insert_events(db, pkg, ages):
+  ObjectId = pytest.importorskip("bson").ObjectId
+  now = datetime.datetime.utcnow()
+  ids = [ObjectId.from_datetime(now - datetime.timedelta(seconds=age)) for age in ages]
+  db.booking_events.insert_many([{"_id": i, "seat_id": n, "flight_id": "AAA_BBB_0", "person_id": 7, "price": 100, "travel_class": 2}
+                                 for n, i in enumerate(ids)])
+  return ids
+
+
+def test_read_booking_events_after_offset_and_behind_the_clock(pkg):
+  db = mongomock.MongoClient().eventsTest
+  ids = insert_events(db, pkg, [30, 20, 10, 0])
+  read = pkg("events").read_booking_events
+  # The newest event is within READ_LAG of the clock and not served yet.
+  assert [e["_id"] for e in read(db)] == ids[:3]
+  assert [e["_id"] for e in read(db, ids[0], limit=1)] == [ids[1]]
+  assert read(db, ids[2]) == []
+
+
+def test_events_endpoint_pages_by_offset(pkg, mongo_app):
+  mongo_app.config["ADMIN_ENDPOINTS"] = True
+  ids = insert_events(pkg("database").mongo.db, pkg, [30, 20])
+  client = mongo_app.test_client()
+  page = client.get("/api/v1/events", query_string={"limit": 1}).get_json()
+  assert [e["offset"] for e in page["events"]] == [str(ids[0])] and page["next"] == str(ids[0])
+  page = client.get("/api/v1/events", query_string={"after": page["next"]}).get_json()
+  assert [e["seat_id"] for e in page["events"]] == [1]
+  assert client.get("/api/v1/events", query_string={"after": page["next"]}).get_json() == {"events": [], "next": str(ids[1])}
+  assert client.get("/api/v1/events", query_string={"after": "7"}).status_code == 400
@@ -0,0 +1,89 @@
+import io
+import urllib.error
+import urllib.request
+
+import pytest
+
+
+@pytest.fixture
+def logos(pkg, monkeypatch):
+  logos = pkg("logos")
+  monkeypatch.setattr(logos, "_failed", {})
+  return logos
+
+
+def airline(pkg, airline_id=9):
+  return pkg("objects").Airline(airline_id, "Test Air", f"https://example.com/{airline_id}.png")
+
+
+def offline(monkeypatch):
+  calls = []
+  def urlopen(*args, **kwargs):
+    calls.append(args)
+    raise urllib.error.URLError("offline")
+  monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+  return calls
+
+
+def test_logo_url_is_fetched_before_the_seed(pkg, logos, monkeypatch, tmp_path):
+  seeds = tmp_path / "seeds"
+  seeds.mkdir()
+  (seeds / "9.png").write_bytes(b"\x89PNG seed")
+  class Response(io.BytesIO):
+    def __enter__(self):
+      return self
+  monkeypatch.setattr(urllib.request, "urlopen", lambda *args, **kwargs: Response(b"\x89PNG fetched"))
+  path = logos.original_logo(airline(pkg), str(tmp_path / "cache"), str(seeds))
+  assert open(path, "rb").read() == b"\x89PNG fetched" and not logos.is_seed(airline(pkg), path)
+
+
+def test_seed_is_served_while_the_fetch_fails(pkg, logos, monkeypatch, tmp_path):
+  seeds = tmp_path / "seeds"
+  seeds.mkdir()
+  (seeds / "9.png").write_bytes(b"\x89PNG seed")
+  calls = offline(monkeypatch)
+  path = logos.original_logo(airline(pkg), str(tmp_path / "cache"), str(seeds))
+  assert path == str(seeds / "9.png") and logos.is_seed(airline(pkg), path)
+  # Not cached as the original, the download is retried once FETCH_RETRY_SECS passed.
+  monkeypatch.setattr(logos, "_failed", {})
+  logos.original_logo(airline(pkg), str(tmp_path / "cache"), str(seeds))
+  assert len(calls) == 2
+
+
+def test_failed_fetches_are_not_retried_right_away(pkg, logos, monkeypatch, tmp_path):
+  calls = offline(monkeypatch)
+  for _ in range(2):
+    with pytest.raises(OSError):
+      logos.original_logo(airline(pkg), str(tmp_path), str(tmp_path / "seeds"))
+  assert len(calls) == 1
+
+
+def test_thumbnail_rejects_invalid_width(pkg, logos, tmp_path):
+  with pytest.raises(ValueError):
+    logos.logo_thumbnail(airline(pkg, 0), 0, str(tmp_path))
+
+
+def test_original_served_with_its_own_mimetype(pkg, logos, monkeypatch, tmp_path):
+  seeds = tmp_path / "seeds"
+  seeds.mkdir()
+  (seeds / "9.jpg").write_bytes(b"\xff\xd8\xff\xe0" + b"\0" * 16)
+  (seeds / "0.png").write_bytes(b"\x89PNG\r\n")
+  offline(monkeypatch)
+  monkeypatch.setattr(logos, "Image", None)
+  path = logos.logo_thumbnail(airline(pkg), 150, str(tmp_path / "cache"), str(seeds))
+  assert logos.logo_mimetype(path) == "image/jpeg"
+  assert logos.logo_mimetype(logos.logo_thumbnail(airline(pkg, 0), 150, str(tmp_path / "cache"), str(seeds))) == "image/png"
+
+
+def test_seed_is_not_cached_as_immutable(pkg, logos, mongo_app, monkeypatch, tmp_path):
+  seeds = tmp_path / "seeds"
+  seeds.mkdir()
+  (seeds / "0.png").write_bytes(b"\x89PNG\r\n")
+  offline(monkeypatch)
+  monkeypatch.setattr(logos, "Image", None)
+  mongo_app.config.update(LOGO_CACHE_DIR=str(tmp_path / "cache"), LOGO_SEED_DIR=str(seeds))
+  digest = logos.logo_digest(pkg("objects").Airline(0, "Test Air", "https://example.com/logo.png"))
+  response = mongo_app.test_client().get(f"/logos/0/{digest}/150.png")
+  assert response.status_code == 200 and response.cache_control.max_age == logos.FETCH_RETRY_SECS
+  assert not response.cache_control.immutable
+  response.close()
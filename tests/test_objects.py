@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+FLIGHT = {"flight_id": "AAA_BBB_0", "airline_id": 0, "departure_airport_id": "AAA", "arrival_airport_id": "BBB",
+          "plane": "Test", "date": datetime.datetime(2030, 1, 1, 8), "duration_mins": 60}
+
+
+@pytest.fixture
+def objects(pkg, monkeypatch):
+  objects = pkg("objects")
+  monkeypatch.setattr(objects, "_preloaded", {})
+  return objects
+
+
+def test_identity_scope_materializes_once(objects):
+  with objects.identity_scope():
+    flight = objects.Flight.from_dict(FLIGHT)
+    assert objects.Flight.from_dict(dict(FLIGHT)) is flight
+    assert objects.lookup(objects.Flight, "AAA_BBB_0") is flight
+  # Outside a scope every call builds a new instance.
+  assert objects.Flight.from_dict(FLIGHT) is not objects.Flight.from_dict(FLIGHT)
+  assert objects.lookup(objects.Flight, "AAA_BBB_0") is None
+
+
+def test_scopes_are_isolated_and_start_from_preloaded(objects):
+  airline = objects.Airline(0, "Test Air", "https://example.com/0.png")
+  objects.preload_identities([airline], [])
+  with objects.identity_scope():
+    first = objects.Flight.from_dict(FLIGHT)
+    assert objects.Airline.from_dict(airline.to_dict()) is airline
+  with objects.identity_scope():
+    assert objects.Flight.from_dict(FLIGHT) is not first
+    assert objects.lookup(objects.Airline, 0) is airline
+
+
+def test_scopes_nest(objects):
+  with objects.identity_scope():
+    outer = objects.Flight.from_dict(FLIGHT)
+    with objects.identity_scope():
+      assert objects.Flight.from_dict(FLIGHT) is not outer
+    assert objects.lookup(objects.Flight, "AAA_BBB_0") is outer
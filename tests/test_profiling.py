@@ -0,0 +1,42 @@
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_mongo_db_is_profiled(pkg, mongo_app):
+  with mongo_app.app_context():
+    assert isinstance(pkg("database").mongo.db, pkg("profiling").ProfiledDatabase)
+
+
+def test_cursor_indexing_and_slicing(pkg, mongo_app):
+  db = pkg("database").mongo.db
+  assert db.seats.find({}).sort("seat_id", -1)[0]["seat_id"] == 2
+  assert [s["seat_id"] for s in db.seats.find({}).sort("seat_id", 1)[1:3]] == [1, 2]
+
+
+def test_book_through_profiled_database(mongo_app):
+  response = mongo_app.test_client().get("/book/AAA_BBB_0/2/7")
+  assert response.status_code == 200
+  assert b"Jane Doe" in response.data
+  operations = {(q["collection"], q["operation"]) for q in mongo_app.extensions["slow_query_log"].entries()}
+  assert ("persons", "find_one") in operations
+
+
+def test_book_unknown_person(mongo_app):
+  assert mongo_app.test_client().get("/book/AAA_BBB_0/2/8").status_code == 404
+
+
+def test_slow_queries_endpoint_is_off_by_default(mongo_app):
+  assert mongo_app.test_client().get("/api/v1/admin/slow_queries").status_code == 404
+  assert mongo_app.test_client().delete("/api/v1/admin/slow_queries").status_code == 404
+
+
+def test_slow_queries_keep_no_values(mongo_app):
+  mongo_app.config["ADMIN_ENDPOINTS"] = True
+  client = mongo_app.test_client()
+  client.get("/trips?passport=P-123")
+  queries = client.get("/api/v1/admin/slow_queries").get_json()["queries"]
+  persons = [q for q in queries if q["collection"] == "persons"]
+  assert persons and all(q["query"] == {"passport": "?"} for q in persons)
+  assert b"P-123" not in client.get("/api/v1/admin/slow_queries").data
@@ -0,0 +1,17 @@
+import datetime
+
+
+def test_flight_card_follows_the_airline_logo(pkg, monkeypatch, tmp_path):
+  rendering, objects = pkg("rendering"), pkg("objects")
+  monkeypatch.setattr(rendering, "flight_cards", pkg("cache").LRUCache(maxsize=10))
+  app = pkg("main").create_app({"REPOSITORY": "memory", "JINJA_BYTECODE_CACHE_DIR": str(tmp_path)})
+  flight = objects.Flight("AAA_BBB_0", 0, "AAA", "BBB", "Test", datetime.datetime(2030, 1, 1, 8), 60)
+  flight.airline = objects.Airline(0, "Test Air", "https://example.com/0.png")
+  flight.departure_airport, flight.arrival_airport = (objects.Airport(a, a, "X", []) for a in ("AAA", "BBB"))
+  with app.test_request_context():
+    card = rendering.flight_card(flight)
+    assert rendering.logo_url(flight.airline) in card and "AAA" in card
+    assert rendering.flight_card(flight) is card
+    flight.airline = objects.Airline(0, "Test Air", "https://example.com/new.png")
+    assert rendering.flight_card(flight) != card
+    assert rendering.logo_url(flight.airline) in rendering.flight_card(flight)
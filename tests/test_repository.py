@@ -0,0 +1,190 @@
+import datetime
+import json
+
+import pytest
+
+DAY = datetime.datetime(2030, 1, 1)
+
+
+def add_fixtures(pkg, repository):
+  objects = pkg("objects")
+  airlines = [objects.Airline(0, "Test Air", "https://example.com/0.png"), objects.Airline(1, "Other Air", "https://example.com/1.png")]
+  airports = [objects.Airport(a, a, "X", [a.lower()]) for a in ("AAA", "BBB", "CCC")]
+  flights = [
+      objects.Flight("AAA_BBB_0", 0, "AAA", "BBB", "Test", DAY.replace(hour=8), 60),
+      objects.Flight("AAA_BBB_1", 1, "AAA", "BBB", "Test", DAY.replace(hour=20), 60),
+      objects.Flight("AAA_CCC_0", 0, "AAA", "CCC", "Test", DAY.replace(hour=9), 90),
+  ]
+  prices = {"AAA_BBB_0": [100, 100, 300], "AAA_BBB_1": [50, 900, 900], "AAA_CCC_0": [2500, 3000, 3000]}
+  seats = [objects.Seat(len(prices) * i + j, f.flight_id, f"{j}A", 2, price, False)
+           for i, f in enumerate(flights) for j, price in enumerate(prices[f.flight_id])]
+  repository.add(airlines, airports, flights, seats)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, pkg):
+  repository = pkg("repository").create_repository({"REPOSITORY": request.param})
+  add_fixtures(pkg, repository)
+  return repository
+
+
+def test_claim_seat_takes_the_cheapest(repository):
+  claimed = {repository.claim_seat("AAA_BBB_0", 2)["seat_id"] for _ in range(2)}
+  assert claimed == {0, 1}
+  assert repository.claim_seat("AAA_BBB_0", 2)["price"] == 300
+  assert repository.claim_seat("AAA_BBB_0", 2) is None
+  assert repository.claim_seat("AAA_BBB_0", 1) is None
+  assert repository.occupancy(["AAA_BBB_0", "AAA_BBB_1"]) == {"AAA_BBB_0": 1.0, "AAA_BBB_1": 0.0}
+
+
+def test_search_seats_facets(pkg, repository):
+  filters = pkg("facets").SearchFilters(airline_ids=[0])
+  seats, facets = repository.search_seats("AAA", "BBB", DAY, DAY + datetime.timedelta(days=1), 2, filters)
+  assert [(s.flight_id, s.price, s.flight.airline.name) for s in seats] == [("AAA_BBB_0", 100, "Test Air")]
+  assert [(a.airline_id, n) for a, n in facets.airlines] == [(0, 1), (1, 1)]
+  assert facets.prices == [("100-200", 1)]
+  assert facets.times_of_day == [("morning", 1)]
+
+
+def test_cheapest_departures_and_fare_matrix(repository):
+  seats = repository.cheapest_departures("AAA", 2, DAY, DAY + datetime.timedelta(days=1), k=2)
+  assert [(s.flight_id, s.price) for s in seats] == [("AAA_BBB_1", 50), ("AAA_BBB_0", 100)]
+  matrix = repository.fare_matrix("AAA", "BBB", DAY, 1)
+  assert [(m["day"], m["prices"]) for m in matrix] == [
+      (DAY - datetime.timedelta(days=1), {}), (DAY, {2: 50}), (DAY + datetime.timedelta(days=1), {})]
+
+
+def test_book_and_find_trips(pkg, repository):
+  person = pkg("objects").Person(repository.next_person_id(), "Jane Doe", datetime.datetime(1990, 1, 1), "P-1", 2)
+  repository.insert_person(person)
+  assert repository.next_person_id() == person.person_id + 1
+  first = repository.book_seat("AAA_BBB_1", 2, person.person_id)
+  second = repository.book_seat("AAA_CCC_0", 2, person.person_id)
+  assert (first.seat_id, first.price) == (3, 50)
+  assert repository.find_booking(first.seat_id, person.person_id).person.name == "Jane Doe"
+  assert repository.find_booking(first.seat_id, person.person_id + 1) is None
+  trips = repository.find_trips(repository.person_ids_for_passport("P-1"))
+  assert [b.seat.flight_id for b in trips] == ["AAA_CCC_0", "AAA_BBB_1"]
+  assert [b.seat_id for b in repository.find_trips([person.person_id], limit=1, skip=1)] == [first.seat_id]
+  assert second.flight.arrival_airport.airport_id == "CCC"
+
+
+@pytest.fixture
+def memory_app(pkg):
+  pkg("main").searches.clear()
+  app = pkg("main").create_app({"REPOSITORY": "memory"})
+  add_fixtures(pkg, app.extensions["repository"])
+  return app
+
+
+def test_api_books_through_in_memory_repository(pkg, memory_app):
+  client = memory_app.test_client()
+  response = client.post("/api/v1/book", json={"flight_id": "AAA_BBB_0", "name": "Jane Doe", "birthdate": "1990-01-01", "passport": "P-1"})
+  assert response.status_code == 201
+  booking = response.get_json()
+  assert booking["price"] == 100 and booking["seat_id"] in (0, 1)
+  assert memory_app.extensions["repository"].person_ids_for_passport("P-1") == [booking["person_id"]]
+  assert client.get(f"/boarding_pass/{booking['seat_id']}/{booking['person_id']}").status_code == 200
+  assert b"Boarding pass" in client.get("/trips?passport=P-1").data
+
+
+def test_api_search_through_in_memory_repository(memory_app):
+  response = memory_app.test_client().get("/api/v1/search", query_string={"from": "aaa", "to": "BBB", "dep_date": "2030-01-01", "fields": "flight_id,price"})
+  assert response.get_json() == {"results": [{"flight_id": "AAA_BBB_0", "price": 100}, {"flight_id": "AAA_BBB_1", "price": 50}]}
+
+
+def test_api_fields_as_json_list(memory_app):
+  response = memory_app.test_client().post("/api/v1/search", json={"from": "AAA", "to": "BBB", "dep_date": "2030-01-01", "fields": ["flight_id", "price"]})
+  assert response.get_json()["results"][0] == {"flight_id": "AAA_BBB_0", "price": 100}
+
+
+def test_api_batch_fields_as_json_list(memory_app):
+  response = memory_app.test_client().post("/api/v1/search/batch", json={
+      "queries": [{"from": "AAA", "to": "BBB", "dep_date": "2030-01-01"}], "fields": ["flight_id"]})
+  assert json.loads(response.data.splitlines()[0]) == {"query": 0, "results": [{"flight_id": "AAA_BBB_0"}, {"flight_id": "AAA_BBB_1"}]}
+
+
+def test_api_batch_searches_count_against_the_limiter(pkg, monkeypatch):
+  pkg("main").searches.clear()
+  app = pkg("main").create_app({"REPOSITORY": "memory", "SEARCH_MAX_IN_FLIGHT": 2})
+  repository = app.extensions["repository"]
+  add_fixtures(pkg, repository)
+  limiter = app.extensions["search_admission"]
+  in_flight = []
+  search_seats = repository.search_seats
+  monkeypatch.setattr(repository, "search_seats", lambda *args: in_flight.append(limiter.in_flight) or search_seats(*args))
+
+  response = app.test_client().post("/api/v1/search/batch", json={"queries": [
+      {"from": "AAA", "to": to, "dep_date": f"2030-01-0{day}"} for to in ("BBB", "CCC") for day in (1, 5, 9)]})
+  lines = [json.loads(line) for line in response.data.splitlines()]
+  response.close()
+  assert sorted(line["query"] for line in lines) == list(range(6))
+  assert len(in_flight) == 6 and 1 <= max(in_flight) <= 2
+  assert limiter.in_flight == 0
+
+
+def test_api_batch_rejects_too_many_queries(pkg, memory_app):
+  queries = [{"from": "AAA", "to": "BBB", "dep_date": "2030-01-01"}] * (pkg("api").MAX_BATCH_QUERIES + 1)
+  response = memory_app.test_client().post("/api/v1/search/batch", json={"queries": queries})
+  assert response.status_code == 413
+  assert memory_app.extensions["search_admission"].in_flight == 0
+
+
+def test_api_batch_merges_windows_up_to_a_cap(pkg):
+  api = pkg("api")
+  starts = [DAY + datetime.timedelta(days=d) for d in (0, 0, 1, 2, 3, 4)]
+  merged = api.merge_windows([(s, s + api.SEARCH_WINDOW, i) for i, s in enumerate(starts)])
+  assert [indices for _, _, indices in merged] == [[0, 1, 2, 3], [4, 5]]
+  assert all(end - start <= api.MAX_MERGED_WINDOW for start, end, _ in merged)
+
+
+def test_api_batch_hides_search_errors(memory_app, monkeypatch):
+  repository = memory_app.extensions["repository"]
+  monkeypatch.setattr(repository, "search_seats", lambda *args: 1 / 0)
+  response = memory_app.test_client().post("/api/v1/search/batch", json={"queries": [{"from": "AAA", "to": "BBB", "dep_date": "2030-01-01"}]})
+  assert json.loads(response.data.splitlines()[0]) == {"query": 0, "error": "Search failed."}
+  response.close()
+
+
+def test_mongo_only_routes_without_mongo(pkg, memory_app, monkeypatch, tmp_path):
+  memory_app.config["ADMIN_ENDPOINTS"] = True
+  client = memory_app.test_client()
+  assert client.get("/airlines").status_code == 404
+  assert client.get("/api/v1/events").status_code == 404
+  # Logos look their airline up through the repository.
+  logos = pkg("logos")
+  def offline(url, path):
+    raise OSError("offline")
+  monkeypatch.setattr(logos, "_fetch", offline)
+  monkeypatch.setattr(logos, "_seed_file", lambda seed_dir, airline_id: None)
+  memory_app.config["LOGO_CACHE_DIR"] = str(tmp_path)
+  digest = logos.logo_digest(pkg("objects").Airline(0, "Test Air", "https://example.com/0.png"))
+  response = client.get(f"/logos/0/{digest}/150.png")
+  assert response.status_code == 302 and response.location == "https://example.com/0.png"
+  assert client.get(f"/logos/5/{digest}/150.png").status_code == 404
+
+
+def test_warm_up_without_mongo(pkg, memory_app):
+  pkg("main").warm_up(memory_app)
+  assert memory_app.test_client().get("/ready").status_code == 200
+
+
+def test_api_search_best_limit(pkg, memory_app):
+  client = memory_app.test_client()
+  query = {"from": "AAA", "dep_date": "2030-01-01", "fields": "flight_id"}
+  assert len(client.get("/api/v1/search_best", query_string=query).get_json()["results"]) == 3
+  response = client.get("/api/v1/search_best", query_string=dict(query, limit=1))
+  assert response.get_json() == {"results": [{"flight_id": "AAA_BBB_1"}]}
+  assert f"the {pkg('fares').TOP_K} cheapest departures".encode() in client.get("/best").data
+
+
+def test_search_page_reads_departure_minutes(pkg, memory_app):
+  objects = pkg("objects")
+  memory_app.extensions["repository"].add([], [], [objects.Flight("AAA_BBB_2", 0, "AAA", "BBB", "Test", DAY.replace(hour=8, minute=5), 60)],
+                                          [objects.Seat(100, "AAA_BBB_2", "1A", 2, 10, False)])
+  response = memory_app.test_client().post("/search", data={
+      "pass_name": "Jane Doe", "pass_birthdate": "1990-01-01", "pass_class": "2", "pass_passport": "P-1",
+      "from": "AAA", "to": "BBB", "dep_date": "2030-01-01", "dep_time": "08:10"})
+  assert response.status_code == 200
+  # 08:10 is ten past eight, not ten seconds past.
+  assert b"AAA_BBB_2" not in response.data and b"AAA_BBB_1" in response.data
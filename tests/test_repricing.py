@@ -0,0 +1,33 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+
+NOW = datetime.datetime(2030, 1, 1)
+
+
+def test_fares_surcharges_and_discounts(pkg):
+  repricing = pkg("repricing")
+  fares = repricing.fares(np.array([100.0] * 4), np.array([0.0, 1.0, 0.0, 0.0]), np.array([30.0, 30.0, 0.0, 90.0]))
+  assert fares.tolist() == [100.0, 100.0 * (1 + repricing.OCCUPANCY_SURCHARGE), 100.0 * (1 + repricing.LAST_MINUTE_SURCHARGE),
+                            100.0 * (1 - repricing.EARLY_BIRD_DISCOUNT)]
+
+
+def test_reprice_only_touches_free_seats_of_future_flights(pkg, mongomock_bulk):
+  repricing = pkg("repricing")
+  db = mongomock.MongoClient().repricingTest
+  db.flights.insert_many([
+      {"flight_id": "SOON", "date": NOW + datetime.timedelta(days=30)},
+      {"flight_id": "GONE", "date": NOW - datetime.timedelta(days=1)},
+  ])
+  db.seats.insert_many([{"seat_id": i, "flight_id": "SOON", "travel_class": 2, "price": 100.0, "booked": i == 0} for i in range(2)]
+                       + [{"seat_id": 2, "flight_id": "GONE", "travel_class": 2, "price": 100.0, "booked": False}])
+  assert repricing.reprice(db, NOW) == 1
+  prices = {s["seat_id"]: (s["price"], s["base_price"]) for s in db.seats.find({})}
+  # Half full: the booked seat keeps what it sold for.
+  assert prices == {0: (100.0, 100.0), 1: (round(100.0 * (1 + repricing.OCCUPANCY_SURCHARGE * 0.25), 2), 100.0), 2: (100.0, 100.0)}
+  # Derived from base_price, so another pass doesn't compound.
+  repricing.reprice(db, NOW)
+  assert db.seats.find_one({"seat_id": 1})["price"] == prices[1][0]
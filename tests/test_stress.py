@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def bookings_db():
+  db = mongomock.MongoClient().stressTest
+  db.seats.insert_many([{"seat_id": i, "flight_id": "F", "booked": i < 2} for i in range(4)])
+  db.bookings.insert_many([{"seat_id": 0, "person_id": 0}, {"seat_id": 1, "person_id": 1}])
+  db.persons.insert_many([{"person_id": 0}, {"person_id": 1}])
+  return db
+
+
+def test_check_invariants_of_consistent_bookings(pkg):
+  assert pkg("stress").check_invariants(bookings_db(), 2) == []
+
+
+def test_check_invariants_reports_every_violation(pkg):
+  db = bookings_db()
+  db.bookings.insert_one({"seat_id": 0, "person_id": 2})
+  db.bookings.insert_one({"seat_id": 3, "person_id": 1})
+  db.seats.update_one({"seat_id": 2}, {"$set": {"booked": True}})
+  db.persons.insert_one({"person_id": 1})
+  assert sorted(pkg("stress").check_invariants(db, 2)) == sorted([
+      "Seat 0 booked 2 times.",
+      "Seat 2 is booked without a booking.",
+      "Seat 3 has a booking but isn't booked.",
+      "Person id 1 used 2 times.",
+      "2 successful bookings reported, 3 stored.",
+  ])
+
+
+def test_concurrent_bookings_never_share_a_seat(pkg):
+  # The harness needs a real mongod, the same race runs here against the
+  # in-memory backend.
+  app = pkg("main").create_app({"REPOSITORY": "memory"})
+  objects = pkg("objects")
+  flight = objects.Flight("AAA_BBB_0", 0, "AAA", "BBB", "Test", datetime.datetime(2030, 1, 1), 60)
+  app.extensions["repository"].add(
+      [objects.Airline(0, "Test Air", "")], [objects.Airport(a, a, "X", []) for a in ("AAA", "BBB")], [flight],
+      [objects.Seat(i, flight.flight_id, str(i), 2, 100, False) for i in range(20)])
+
+  def attempt(i):
+    with app.test_client() as client:
+      response = client.post("/api/v1/book", json={"flight_id": "AAA_BBB_0", "name": f"Stress {i}", "birthdate": "1990-01-01", "passport": str(i)})
+      return response.status_code, (response.get_json() or {}).get("seat_id")
+
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    results = list(pool.map(attempt, range(30)))
+  seat_ids = [seat_id for status, seat_id in results if status == 201]
+  assert sorted(seat_ids) == list(range(20))
+  assert sorted(status for status, _ in results if status != 201) == [409] * 10
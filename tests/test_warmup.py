@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+NOW = datetime.datetime(2030, 1, 10)
+
+
+def report_row(day, departure, arrival, booked, now=NOW):
+  return {"day": now - datetime.timedelta(days=day), "departure_airport_id": departure, "arrival_airport_id": arrival, "booked": booked}
+
+
+def flight(day, departure, arrival):
+  return {"departure_airport_id": departure, "arrival_airport_id": arrival, "date": NOW + datetime.timedelta(days=day)}
+
+
+def test_hot_routes_ranks_recent_bookings(pkg):
+  db = mongomock.MongoClient().warmupTest
+  db.report_daily.insert_many([
+      report_row(1, "AAA", "BBB", 5), report_row(2, "AAA", "BBB", 5),
+      report_row(1, "BBB", "AAA", 8),
+      report_row(60, "CCC", "AAA", 100),  # Beyond HOT_ROUTE_HISTORY_DAYS.
+  ])
+  assert pkg("warmup").hot_routes(db, NOW, 5) == [("AAA", "BBB"), ("BBB", "AAA")]
+  assert pkg("warmup").hot_routes(db, NOW, 1) == [("AAA", "BBB")]
+
+
+def test_hot_routes_without_a_report_takes_the_busiest_schedule(pkg):
+  db = mongomock.MongoClient().warmupTest
+  # Departed flights don't count.
+  db.flights.insert_many([flight(d, "AAA", "BBB") for d in range(3)] + [flight(1, "BBB", "AAA")] + [flight(-d, "CCC", "AAA") for d in range(1, 5)])
+  assert pkg("warmup").hot_routes(db, NOW, 5) == [("AAA", "BBB"), ("BBB", "AAA")]
+
+
+def test_warm_up_primes_hot_routes_before_ready(pkg, mongo_app, monkeypatch):
+  main = pkg("main")
+  db = pkg("database").mongo.db
+  db.report_daily.insert_one(report_row(0, "AAA", "BBB", 1, datetime.datetime.utcnow()))
+  # mongomock has no capped collections, index hints or $lookup sub-pipelines.
+  monkeypatch.setattr(main, "ensure_booking_events", lambda *args: None)
+  monkeypatch.setattr(main, "touch_indexes", lambda *args: 0)
+  repository = mongo_app.extensions["repository"]
+  searched = []
+
+  def search_seats(*args):
+    searched.append((args[0], args[1], args[4], mongo_app.test_client().get("/ready").status_code))
+    return [], None
+  monkeypatch.setattr(repository, "search_seats", search_seats)
+  mongo_app.config.update(WARMUP_DAYS=2)
+  main.warm_up(mongo_app)
+  assert searched == [("AAA", "BBB", travel_class, 503) for _ in range(2) for travel_class in (1, 2)]
+  assert mongo_app.test_client().get("/ready").status_code == 200
+
+
+def test_warm_up_stops_at_the_budget(pkg, mongo_app, monkeypatch):
+  main = pkg("main")
+  db = pkg("database").mongo.db
+  db.report_daily.insert_one(report_row(0, "AAA", "BBB", 1, datetime.datetime.utcnow()))
+  monkeypatch.setattr(main, "ensure_booking_events", lambda *args: None)
+  monkeypatch.setattr(main, "touch_indexes", lambda *args: pytest.fail("Index touch after the budget ran out."))
+  monkeypatch.setattr(mongo_app.extensions["repository"], "search_seats", lambda *args: pytest.fail("Search after the budget ran out."))
+  mongo_app.config.update(WARMUP_BUDGET_SECS=-1)
+  main.warm_up(mongo_app)
+  assert mongo_app.extensions["ready"]
@@ -0,0 +1,54 @@
+from typing import Any, List, Tuple
+from datetime import datetime, timedelta
+
+import pymongo
+
+# Written by the analytics job, not imported from there to keep NumPy out of
+# the web app.
+REPORT_COLLECTION = "report_daily"
+# Days of booking history used to find the hottest routes.
+HOT_ROUTE_HISTORY_DAYS = 30
+# Indexes the search and booking paths hit on every request.
+HOT_INDEXES = [
+    ("flights", [("departure_airport_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)]),
+    ("seats", [("flight_id", pymongo.ASCENDING), ("travel_class", pymongo.ASCENDING), ("booked", pymongo.ASCENDING)]),
+]
+
+
+def hot_routes(db: Any, now: datetime, limit: int) -> List[Tuple[str, str]]:
+  """Most booked (departure, arrival) routes, most flown ones without a report."""
+  routes = db[REPORT_COLLECTION].aggregate([
+    { "$match": { "day": { "$gte": now - timedelta(days=HOT_ROUTE_HISTORY_DAYS) } } },
+    { "$group": {
+        "_id": { "departure_airport_id": "$departure_airport_id", "arrival_airport_id": "$arrival_airport_id" },
+        "n": { "$sum": "$booked" },
+      }
+    },
+    { "$sort": { "n": pymongo.DESCENDING } },
+    { "$limit": limit },
+  ])
+  routes = [(r["_id"]["departure_airport_id"], r["_id"]["arrival_airport_id"]) for r in routes]
+  if routes:
+    return routes
+  return [(r["_id"]["departure_airport_id"], r["_id"]["arrival_airport_id"]) for r in db.flights.aggregate([
+    { "$match": { "date": { "$gte": now } } },
+    { "$group": {
+        "_id": { "departure_airport_id": "$departure_airport_id", "arrival_airport_id": "$arrival_airport_id" },
+        "n": { "$sum": 1 },
+      }
+    },
+    { "$sort": { "n": pymongo.DESCENDING } },
+    { "$limit": limit },
+  ])]
+
+
+def touch_indexes(db: Any, deadline: float, clock) -> int:
+  """Pages the hot indexes into memory with covered scans, until `deadline`."""
+  keys = 0
+  for collection, index in HOT_INDEXES:
+    projection = {"_id": 0, **{field: 1 for field, _ in index}}
+    for _ in db[collection].find({}, projection).hint(index).batch_size(10000):
+      keys += 1
+      if keys % 1000 == 0 and clock() > deadline:
+        return keys
+  return keys